@@ -1,5 +1,5 @@
 import { useState, useRef, useEffect } from 'react';
-import { modelOptions, maxHistoryLength, serverURL } from './Config';
+import { modelOptions, maxHistoryLength, serverURL, JOB_POLL_TIMEOUT_MS } from './Config';
 
 // 辅助函数
 export const hashCode = (str) => {
@@ -227,6 +227,7 @@ export const useChatLogic = () => {
         body: JSON.stringify({
           messages: updatedRequestMessages,
           model: selectedModel,
+          conversation_id: conversations.find(conv => conv.active)?.id,
           stream: true
         }),
         signal: controller.signal
@@ -380,6 +381,7 @@ export const useChatLogic = () => {
         body: JSON.stringify({
           messages: requestMsgs,
           model: selectedModel,
+          conversation_id: conversations.find(conv => conv.active)?.id,
           stream: true
         }),
         signal: controller.signal
@@ -569,6 +571,7 @@ export const useChatLogic = () => {
             content: msg.content
           })), editedMessage],
           model: selectedModel,
+          conversation_id: conversations.find(conv => conv.active)?.id,
           stream: true
         })
       });
@@ -648,10 +651,35 @@ export const useChatLogic = () => {
         throw new Error('上传失败');
       }
       
-      // 显示上传成功消息
+      // 文档在后台处理，轮询任务状态直到处理完成
+      const { job_id } = await response.json();
       setDisplayMessages(prev => [...prev, {
         role: 'system',
-        content: '文档上传成功！现在你可以询问关于这些文档的问题了。'
+        content: '文档上传成功，正在后台处理...'
+      }]);
+      
+      let job;
+      const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+      do {
+        if (Date.now() > deadline) {
+          throw new Error('文档处理超时，请稍后刷新页面查看');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const jobResponse = await fetch(`${serverURL}/api/jobs/${job_id}`);
+        if (!jobResponse.ok) {
+          throw new Error('查询处理进度失败');
+        }
+        job = await jobResponse.json();
+      } while (job.status === 'queued' || job.status === 'running');
+      
+      if (job.status === 'failed') {
+        throw new Error(job.error || '文档处理失败');
+      }
+      
+      // 显示处理完成消息
+      setDisplayMessages(prev => [...prev, {
+        role: 'system',
+        content: '文档处理完成！现在你可以询问关于这些文档的问题了。'
       }]);
       
     } catch (error) {
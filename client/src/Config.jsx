@@ -8,6 +8,7 @@ export const modelOptions = [
   'deepseek-reasoner'
 ];
 export const maxHistoryLength = 10;  // 添加最大对话长度配置
+export const JOB_POLL_TIMEOUT_MS = 10 * 60 * 1000;  // 上传后最多等待文档处理完成的时间
 
 // API 地址
 export const serverURL = process.env.NODE_ENV === 'production' 
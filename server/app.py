@@ -1,84 +1,59 @@
 from flask import Flask, request, jsonify, Response, stream_with_context, make_response
 from flask_cors import CORS
 import os
-from document_store import DocumentStore
+from document_store import DocumentStore, ARK_BASE_URL
+from ingest_jobs import IngestJobQueue
+from chat_service import (
+    SSE_HEADERS, DEFAULT_MODEL, DONE_EVENT, ANALYZING_EVENT, build_system_prompt, apply_system_prompt,
+    retrieval_events, replay_events, chunk_delta, error_event, comment_event
+)
+from sse_writer import SSEWriter, paced
+from metrics import metrics
+from context_builder import CONTEXT_CANDIDATES, assemble_context
+from conversation_history import ConversationHistory, HISTORY_SUMMARY_MODEL, condense_query
+from semantic_cache import SemanticAnswerCache
 from werkzeug.utils import secure_filename
-import json
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from http_pool import ark_client, ark_pool
 from dotenv import load_dotenv
 import logging
-from logging import Formatter, StreamHandler
+import time
+from log_pipeline import async_handler, sampled
 
-# 配置日志
+# 配置日志：格式化和写出在后台线程中进行，见 log_pipeline
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-
-# 创建自定义格式化器
-class CustomFormatter(Formatter):
-    def format(self, record):
-        # 保存原始消息
-        original_msg = record.msg
-        separator = record.__dict__.get('separator', '')
-        
-        # 设置基本格式
-        record.msg = f"{original_msg}\n{separator}" if separator else original_msg
-        
-        # 调用父类的 format 方法
-        return super().format(record)
-
-# 创建处理器并设置格式化器
-handler = StreamHandler()
-handler.setFormatter(CustomFormatter(
-    fmt='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-))
+handler = async_handler()
 logger.addHandler(handler)
 
-# 自定义日志格式
-def log_separator(length=80):
-    return "-" * length
-
 class CustomLogger:
+    """请求、检索上下文和回答的结构化日志
+
+    只把原始字段交给日志队列，序列化和截断在后台线程中进行；完整内容按 sample_key（问题文本）抽样记录。
+    """
     @staticmethod
-    def request(method, path, data=None):
-        separator = f"""请求详情:
-方法: {method}
-路径: {path}
-数据: {json.dumps(data, ensure_ascii=False, indent=2) if data else 'None'}
-{log_separator()}"""
-        
-        logger.info(
-            "收到请求",
-            extra={'separator': separator}
-        )
+    def request(method, path, data=None, sample_key=None):
+        fields = {'event': 'request', 'method': method, 'path': path}
+        if data and sampled(sample_key if sample_key is not None else path):
+            fields['data'] = data
+        elif isinstance(data, dict):
+            fields['messages'] = len(data.get('messages') or [])
+        logger.info("收到请求", extra={'fields': fields})
 
     @staticmethod
-    def chat_completion(query, docs_count, context):
-        separator = f"""查询详情:
-用户问题: {query}
-找到文档数: {docs_count}
-
-相关文档内容:
-{context}
-{log_separator()}"""
-        
-        logger.info(
-            "处理聊天请求",
-            extra={'separator': separator}
-        )
+    def chat_completion(query, docs_count, context, context_tokens=None):
+        fields = {'event': 'chat_completion', 'query': query, 'docs_count': docs_count,
+                  'context_tokens': context_tokens, 'context_chars': len(context)}
+        if sampled(query):
+            fields['context'] = context
+        logger.info("处理聊天请求", extra={'fields': fields})
 
     @staticmethod
     def response_complete(query, full_response):
-        separator = f"""响应详情:
-用户问题: {query}
-完整响应:
-{full_response}
-{log_separator()}"""
-        
-        logger.info(
-            "生成响应完成",
-            extra={'separator': separator}
-        )
+        fields = {'event': 'response_complete', 'query': query, 'response_chars': len(full_response)}
+        if sampled(query):
+            fields['response'] = full_response
+        logger.info("生成响应完成", extra={'fields': fields})
 
 # 加载环境变量
 load_dotenv()
@@ -108,11 +83,32 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # 初始化文档存储和 OpenAI 客户端
 doc_store = DocumentStore()
-client = OpenAI(
+# 对话客户端与向量接口共用 Ark 连接池（长连接、HTTP/2），超时和重试见 http_pool
+client = ark_client(
     api_key=os.getenv("ARK_API_KEY"),  # 从环境变量读取 ARK_API_KEY
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
+    base_url=ARK_BASE_URL,
 )
 
+# 启动时预加载已有索引，而不是等到第一次上传；
+# 用 gunicorn preload_app 启动时，这一步只在主进程执行一次
+_index_load_started = time.perf_counter()
+try:
+    if doc_store.load_existing_index():
+        logger.info(f"已预加载向量索引，耗时 {time.perf_counter() - _index_load_started:.2f} 秒")
+except Exception as e:
+    logger.error(f"预加载向量索引失败: {str(e)}")
+
+# 后台入库任务队列，/upload 只负责保存文件和提交任务；
+# 任务状态写在索引目录下的 ingest_jobs.sqlite 中，任何一个 worker 都能查询
+ingest_queue = IngestJobQueue(doc_store, UPLOAD_FOLDER)
+
+# 对话历史窗口和摘要缓存，Flask 和 ASGI 两种服务方式共用
+conversation_history = ConversationHistory()
+# 语义答案缓存，SEMANTIC_CACHE=1 时开启
+answer_cache = SemanticAnswerCache()
+# 发起模型请求的线程，请求在途时处理请求的线程继续向客户端发送检索结果
+chat_setup_executor = ThreadPoolExecutor(max_workers=int(os.getenv('CHAT_SETUP_THREADS', 32)))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -136,26 +132,28 @@ def upload_file():
             uploaded_files.append(filename)
     
     if uploaded_files:
-        # 重新加载文档库
-        try:
-            logger.info("\n开始处理文档...")
-            doc_store.load_documents(app.config['UPLOAD_FOLDER'])
-            logger.info(f"文档处理成功: {uploaded_files}")
-            logger.info("=== 文件上传请求完成 ===\n")
-            return jsonify({
-                'message': '文件上传成功',
-                'files': uploaded_files
-            })
-        except Exception as e:
-            error_msg = f"文档处理失败: {str(e)}"
-            logger.error(f"错误: {error_msg}")
-            logger.error("=== 文件上传请求失败 ===\n")
-            return jsonify({'error': error_msg}), 500
+        # 文档处理交给后台任务队列，请求立即返回任务 ID；处理期间对话继续使用旧索引
+        job = ingest_queue.submit(uploaded_files)
+        logger.info(f"已提交入库任务 {job.id}: {uploaded_files}")
+        logger.info("=== 文件上传请求完成 ===\n")
+        return jsonify({
+            'message': '文件上传成功，正在后台处理',
+            'files': uploaded_files,
+            'job_id': job.id,
+            'status_url': f"/api/jobs/{job.id}"
+        }), 202
     
     logger.error("错误: 没有有效的文件被上传")
     logger.error("=== 文件上传请求失败 ===\n")
     return jsonify({'error': '没有上传有效的文件'}), 400
 
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
 @app.before_request
 def log_request_info():
     if request.path != '/api/test':  # 忽略测试端点的日志
@@ -172,16 +170,7 @@ def after_request(response):
 @app.route('/api/chat', methods=['POST', 'OPTIONS'])
 def chat():
     # 设置 CORS 头
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Accept',
-        'Access-Control-Max-Age': '3600',
-        'Content-Type': 'text/event-stream',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-        'X-Accel-Buffering': 'no'  # 禁用 Nginx 缓冲（如果有的话）
-    }
+    headers = SSE_HEADERS
 
     if request.method == 'OPTIONS':
         logger.debug("处理 OPTIONS 请求")
@@ -189,88 +178,207 @@ def chat():
 
     try:
         data = request.json
-        CustomLogger.request(request.method, request.path, data)
-        messages = data['messages']
-        model = data.get('model', 'deepseek-r1-250120')
-        query = messages[-1]['content']
-        
-        # 检索相关文档
-        relevant_docs = doc_store.search(query)
-        
-        # 构建并记录上下文
-        context = "\n\n".join([f"文档片段 {i+1}:\n{doc.page_content}" for i, doc in enumerate(relevant_docs)])
-        CustomLogger.chat_completion(query, len(relevant_docs), context)
-        
-        # 构建系统提示词
-        system_prompt = f"""你好!我是一个专业的AI助手,很高兴为你提供帮助。我会仔细阅读以下参考文档来回答你的问题:
-
-参考文档:
-{context}
-
-在回答过程中,我会:
-- 优先使用文档中的信息进行回答
-- 用简洁清晰的语言表达
-- 如果需要补充额外信息,我会明确标注出哪些内容来自文档,哪些是我的补充说明
-
-如果文档中没有找到相关信息,我会坦诚地告诉你。请问有什么我可以帮你的吗?"""
-        
-        # 更新消息列表中的系统消息
-        if messages[0]['role'] == 'system':
-            messages[0]['content'] = system_prompt
-        else:
-            messages.insert(0, {"role": "system", "content": system_prompt})
-        
-        def generate():
-            full_response = []
-            try:
-                # 发送初始推理内容
-                yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': '正在分析相关文档...\n'}}]})}\n\n".encode('utf-8')
-                yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': f'找到 {len(relevant_docs)} 个相关文档片段。\n'}}]})}\n\n".encode('utf-8')
-                
-                # 可以选择性地显示找到的文档片段
-                if relevant_docs:
-                    yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': '相关文档内容：\n'}}]})}\n\n".encode('utf-8')
-                    for i, doc in enumerate(relevant_docs):
-                        yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': f'片段 {i+1}：{doc.page_content}\n'}}]})}\n\n".encode('utf-8')
-                    yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': '\n基于以上文档回答：\n'}}]})}\n\n".encode('utf-8')
-
-                # 调用 OpenAI API 进行流式响应
-                logger.debug("调用 OpenAI API")
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    stream=True
-                )
-
-                for chunk in response:
-                    logger.debug("收到 chunk: %s", chunk)
-                    if hasattr(chunk.choices[0].delta, 'reasoning_content') and chunk.choices[0].delta.reasoning_content:
-                        content = chunk.choices[0].delta.reasoning_content
-                        yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': chunk.choices[0].delta.reasoning_content}}]})}\n\n".encode('utf-8')
-                        full_response.append(content)
-                    elif hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        yield f"data: {json.dumps({'choices': [{'delta': {'content': chunk.choices[0].delta.content}}]})}\n\n".encode('utf-8')
-                        full_response.append(content)
-
-                yield b"data: [DONE]\n\n"
-                CustomLogger.response_complete(query, ''.join(full_response))
-            except Exception as e:
-                logger.error("生成响应流时出错: %s", str(e))
-                yield f"data: {json.dumps({'error': str(e)})}\n\n".encode('utf-8')
-                yield b"data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers=headers,
-            direct_passthrough=True
-        )
-
+        request_messages = data['messages']
+        model = data.get('model', DEFAULT_MODEL)
+        # 检索用压缩后的查询，追问时带上之前的问题
+        query = condense_query(request_messages)
+        CustomLogger.request(request.method, request.path, data, sample_key=query)
     except Exception as e:
         logger.error(f"处理请求时出错: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    def summarize(prompt):
+        response = client.chat.completions.create(model=HISTORY_SUMMARY_MODEL or model, messages=prompt)
+        return response.choices[0].message.content
+
+    def generate():
+        full_response = []
+        answer = []
+        pending_response = None
+        timings = metrics.request_timings()
+        try:
+            # 先发出第一个事件，客户端立即收到响应头；连接池中没有空闲连接时（刚启动或空闲超过
+            # ARK_KEEPALIVE_EXPIRY），检索期间在后台预先建立到模型服务的连接
+            yield ANALYZING_EVENT
+            ark_pool.warm_up(ARK_BASE_URL)
+
+            # 只原样发送最近的对话，更早的部分用缓存的摘要代替；需要更新摘要时与检索并发进行
+            trimming = chat_setup_executor.submit(
+                _timed, 'history', timings,
+                conversation_history.trim, data.get('conversation_id'), request_messages, summarize
+            )
+
+            # 检索候选文档，search_mode 可选 dense / hybrid / lexical，不传时使用 SEARCH_MODE
+            with metrics.timer('retrieval', timings):
+                candidates = doc_store.search(query, k=CONTEXT_CANDIDATES, mode=data.get('search_mode'))
+            index_version = doc_store.index_version
+            history = trimming.result()
+            messages = list(history.messages)
+            if history.covered:
+                logger.info(f"对话历史: 较早的 {history.covered} 条消息由摘要代替，原样发送 {len(messages)} 条")
+
+            # 合并重叠的文本块，按 token 预算构建并记录上下文
+            with metrics.timer('context_build', timings):
+                assembled = assemble_context(candidates)
+            relevant_docs, context = assembled.docs, assembled.context
+            CustomLogger.chat_completion(query, len(relevant_docs), context, assembled.tokens)
+            yield comment_event(f"context_tokens {assembled.tokens}")
+
+            # 语义答案缓存只用于对话的第一个问题，之后的回答还依赖对话历史
+            query_embedding = None
+            if answer_cache.enabled and len(messages) == 1 and history.summary is None:
+                query_embedding = doc_store.embed_query(query)
+                cached_answer = answer_cache.lookup(query_embedding, model, context, index_version)
+                if cached_answer is not None:
+                    logger.info("语义答案缓存命中，直接返回已有回答")
+                    yield from replay_events(relevant_docs, cached_answer)
+                    return
+
+            # 构建系统提示词，先发起模型请求，等待模型响应的同时把检索到的片段发给客户端
+            apply_system_prompt(messages, build_system_prompt(context, history.summary))
+            logger.debug("调用 OpenAI API")
+            llm_started = time.perf_counter()
+            pending_response = chat_setup_executor.submit(
+                client.chat.completions.create,
+                model=model,
+                messages=messages,
+                stream=True
+            )
+            yield from retrieval_events(relevant_docs)
+
+            response = pending_response.result()
+            writer = SSEWriter()
+            debug = logger.isEnabledFor(logging.DEBUG)
+            first_token = None
+            for chunk in paced(response, writer):
+                if chunk is None:
+                    # 上游停顿，合并窗口已到，先发出缓存的片段
+                    yield writer.flush()
+                    continue
+                if debug:
+                    logger.debug("收到 chunk: %s", chunk)
+                content, is_answer = chunk_delta(chunk)
+                if content:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        metrics.observe('llm_first_token', first_token - llm_started, timings)
+                    full_response.append(content)
+                    if is_answer:
+                        answer.append(content)
+                    event = writer.write(content, is_answer)
+                    if event:
+                        yield event
+            event = writer.flush()
+            if event:
+                yield event
+            finished = time.perf_counter()
+            metrics.observe('llm_stream', finished - llm_started, timings)
+            if first_token is not None:
+                metrics.observe_rate(model, writer.deltas, finished - first_token)
+            if timings is not None:
+                yield comment_event(f"server-timing {timings.header()}")
+
+            yield DONE_EVENT
+            CustomLogger.response_complete(query, ''.join(full_response))
+            if query_embedding is not None:
+                answer_cache.put(query_embedding, model, context, index_version, ''.join(answer))
+        except Exception as e:
+            logger.error("生成响应流时出错: %s", str(e))
+            yield error_event(e)
+            yield DONE_EVENT
+        finally:
+            # 客户端断开时及时关闭上游连接，模型请求还没返回时等它返回后再关闭
+            if pending_response is not None:
+                pending_response.add_done_callback(_close_stream)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers=headers,
+        direct_passthrough=True
+    )
+
+def _timed(stage, timings, fn, *args):
+    with metrics.timer(stage, timings):
+        return fn(*args)
+
+def _close_stream(future):
+    if future.exception() is None:
+        future.result().close()
+
+# 批量检索单次请求最多的查询条数
+MAX_BATCH_QUERIES = int(os.getenv('MAX_BATCH_QUERIES', 1000))
+# 每条查询最多返回的文本块数，更大的 k 按此截断
+MAX_SEARCH_K = int(os.getenv('MAX_SEARCH_K', 50))
+
+def _parse_k(value):
+    """解析检索条数 k：必须是正整数（或由数字组成的字符串），超过 MAX_SEARCH_K 时截断；不合法时返回 None"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        return None
+    return min(value, MAX_SEARCH_K)
+
+@app.route('/api/search/batch', methods=['POST'])
+def search_batch():
+    """批量检索，用于离线评测：{"queries": [...], "k": 3, "search_mode": "dense"}"""
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({'error': 'queries 必须是字符串列表'}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'单次最多 {MAX_BATCH_QUERIES} 条查询'}), 400
+    k = _parse_k(data.get('k', 3))
+    if k is None:
+        return jsonify({'error': 'k 必须是正整数'}), 400
+
+    started = time.perf_counter()
+    timings = metrics.request_timings()
+    try:
+        with metrics.timer('search_batch', timings):
+            results = doc_store.search_batch(queries, k=k, mode=data.get('search_mode'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f"批量检索 {len(queries)} 条查询，耗时 {time.perf_counter() - started:.2f} 秒")
+    response = jsonify({
+        'index_version': doc_store.index_version,
+        'results': [
+            {
+                'query': query,
+                'documents': [{'content': doc.page_content, 'metadata': doc.metadata} for doc in docs]
+            }
+            for query, docs in zip(queries, results)
+        ]
+    })
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.header()
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """各级缓存的命中率和大小"""
+    return jsonify({
+        'query_embedding': doc_store.query_embedding_cache.stats(),
+        'search': doc_store.search_cache.stats(),
+        'history_summary': conversation_history.stats(),
+        'semantic_answer': answer_cache.stats(),
+    })
+
+@app.route('/api/pool/stats')
+def pool_stats():
+    """Ark 连接池的请求数、新建连接数、复用率和当前连接数（当前 worker 进程）"""
+    return jsonify(ark_pool.stats())
+
+# /metrics 中附带连接池和语义缓存的当前统计
+metrics.register_gauges('ark_pool', lambda: ark_pool.stats())
+metrics.register_gauges('semantic_cache', lambda: answer_cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的阶段耗时统计；设置了 METRICS_DIR 时汇总所有 worker 进程"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(Exception)
 def handle_error(error):
     print(f"错误: {str(error)}")
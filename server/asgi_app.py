@@ -0,0 +1,179 @@
+"""异步（ASGI）服务入口
+
+uvicorn asgi_app:app --port 5001
+
+/api/chat 由基于 asyncio 的路由处理：检索、模型流式输出和 SSE 写出都不占用线程，
+单个进程就可以同时保持数百个对话流。其余接口（/upload、/api/test 等）
+转交给 app.py 中的 Flask 应用，与它共用同一个 DocumentStore。
+"""
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from a2wsgi import WSGIMiddleware
+import asyncio
+import contextlib
+import os
+import time
+
+from app import app as flask_app, doc_store, conversation_history, answer_cache, logger, CustomLogger
+from chat_service import (
+    SSE_HEADERS, DEFAULT_MODEL, DONE_EVENT, ANALYZING_EVENT, build_system_prompt, apply_system_prompt,
+    retrieval_events, replay_events, chunk_delta, error_event, comment_event
+)
+from sse_writer import SSEWriter, apaced
+from metrics import metrics
+from context_builder import CONTEXT_CANDIDATES, assemble_context
+from conversation_history import HISTORY_SUMMARY_MODEL, condense_query
+from document_store import ARK_BASE_URL
+from http_pool import ark_async_client, ark_pool
+
+async_client = ark_async_client(
+    api_key=os.getenv("ARK_API_KEY"),
+    base_url=ARK_BASE_URL,
+)
+
+
+async def _timed(stage, awaitable, timings):
+    with metrics.timer(stage, timings):
+        return await awaitable
+
+
+async def chat(request):
+    headers = SSE_HEADERS
+
+    if request.method == 'OPTIONS':
+        return Response(status_code=204, headers=headers)
+
+    try:
+        data = await request.json()
+        request_messages = data['messages']
+        model = data.get('model', DEFAULT_MODEL)
+        # 检索用压缩后的查询，追问时带上之前的问题
+        query = condense_query(request_messages)
+        CustomLogger.request(request.method, request.url.path, data, sample_key=query)
+    except Exception as e:
+        logger.error(f"处理请求时出错: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+    async def summarize(prompt):
+        response = await async_client.chat.completions.create(model=HISTORY_SUMMARY_MODEL or model, messages=prompt)
+        return response.choices[0].message.content
+
+    async def generate():
+        full_response = []
+        answer = []
+        pending_response = None
+        response = None
+        warm_up = None
+        timings = metrics.request_timings()
+        try:
+            # 先发出第一个事件，客户端立即收到响应头；连接池中没有空闲连接时（刚启动或空闲超过
+            # ARK_KEEPALIVE_EXPIRY），检索期间在后台预先建立到模型服务的连接
+            yield ANALYZING_EVENT
+            warm_up = asyncio.ensure_future(ark_pool.awarm_up(ARK_BASE_URL))
+
+            # 检索相关文档（查询向量化是异步请求，本地检索在线程池中执行），同时截取对话历史，
+            # 需要更新摘要时两者并发进行；search_mode 可选 dense / hybrid / lexical，不传时使用 SEARCH_MODE
+            retrieval = doc_store.asearch(query, k=CONTEXT_CANDIDATES, mode=data.get('search_mode'))
+            trimming = conversation_history.atrim(data.get('conversation_id'), request_messages, summarize)
+            candidates, history = await asyncio.gather(
+                _timed('retrieval', retrieval, timings),
+                _timed('history', trimming, timings),
+            )
+            index_version = doc_store.index_version
+            messages = list(history.messages)
+            if history.covered:
+                logger.info(f"对话历史: 较早的 {history.covered} 条消息由摘要代替，原样发送 {len(messages)} 条")
+
+            # 合并重叠的文本块，按 token 预算构建上下文
+            with metrics.timer('context_build', timings):
+                assembled = assemble_context(candidates)
+            relevant_docs, context = assembled.docs, assembled.context
+            CustomLogger.chat_completion(query, len(relevant_docs), context, assembled.tokens)
+            yield comment_event(f"context_tokens {assembled.tokens}")
+
+            # 语义答案缓存只用于对话的第一个问题，之后的回答还依赖对话历史
+            query_embedding = None
+            if answer_cache.enabled and len(messages) == 1 and history.summary is None:
+                query_embedding = await doc_store.aembed_query(query)
+                cached_answer = answer_cache.lookup(query_embedding, model, context, index_version)
+                if cached_answer is not None:
+                    logger.info("语义答案缓存命中，直接返回已有回答")
+                    for event in replay_events(relevant_docs, cached_answer):
+                        yield event
+                    return
+
+            # 先发起模型请求，等待模型响应的同时把检索到的片段发给客户端
+            apply_system_prompt(messages, build_system_prompt(context, history.summary))
+            llm_started = time.perf_counter()
+            pending_response = asyncio.ensure_future(async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True
+            ))
+            for event in retrieval_events(relevant_docs):
+                yield event
+
+            response = await pending_response
+            writer = SSEWriter()
+            first_token = None
+            async for chunk in apaced(response, writer):
+                if chunk is None:
+                    # 上游停顿，合并窗口已到，先发出缓存的片段
+                    yield writer.flush()
+                    continue
+                content, is_answer = chunk_delta(chunk)
+                if content:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        metrics.observe('llm_first_token', first_token - llm_started, timings)
+                    full_response.append(content)
+                    if is_answer:
+                        answer.append(content)
+                    event = writer.write(content, is_answer)
+                    if event:
+                        yield event
+            event = writer.flush()
+            if event:
+                yield event
+            finished = time.perf_counter()
+            metrics.observe('llm_stream', finished - llm_started, timings)
+            if first_token is not None:
+                metrics.observe_rate(model, writer.deltas, finished - first_token)
+            if timings is not None:
+                yield comment_event(f"server-timing {timings.header()}")
+
+            yield DONE_EVENT
+            CustomLogger.response_complete(query, ''.join(full_response))
+            if query_embedding is not None:
+                answer_cache.put(query_embedding, model, context, index_version, ''.join(answer))
+        except Exception as e:
+            logger.error("生成响应流时出错: %s", str(e))
+            yield error_event(e)
+            yield DONE_EVENT
+        finally:
+            # 客户端断开时及时关闭上游连接，模型请求还没返回时直接取消
+            if response is not None:
+                await response.close()
+            elif pending_response is not None:
+                pending_response.cancel()
+            if warm_up is not None and not warm_up.done():
+                warm_up.cancel()
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=headers)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # worker 启动时在后台预先建立到模型服务的连接，只做一次，不拖慢启动
+    warm_up = asyncio.ensure_future(ark_pool.awarm_up(ARK_BASE_URL))
+    try:
+        yield
+    finally:
+        warm_up.cancel()
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/api/chat', chat, methods=['POST', 'OPTIONS']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
@@ -0,0 +1,148 @@
+"""近似索引基准测试：与精确（Flat）检索对比 recall@k、单条查询延迟 p50/p99 和索引内存
+
+python benchmark_ann.py --sizes 10000,100000,1000000 --dim 256
+python benchmark_ann.py --specs "HNSW32;IVF{nlist},Flat;IVF{nlist},PQ32" --output ann.json
+python benchmark_ann.py --specs "SQ8;SQfp16;IVF{nlist},SQ8" --rescore 1,4,8
+
+memory_mb 是粗排时需要常驻内存的大小（近似索引的编码），memory_ratio 是它与 float32 精确向量之比。
+量化索引（SQ / PQ）按 --rescore 中的倍数分别测试：1 为直接使用量化距离，大于 1 时取 k×rescore 个候选
+再从 float32 向量中读取这些行精确重排。
+
+语料为合成的聚类向量（归一化后与真实文本向量的分布更接近）。
+索引描述用分号分隔，{nlist} 会替换为 4·sqrt(N) 取整到 2 的幂。
+"""
+import argparse
+import json
+import math
+import time
+
+import faiss
+import numpy as np
+
+from index_storage import AnnIndex, MmapFlatIndex, build_ann_index, is_quantized
+
+DEFAULT_SPECS = "HNSW32;IVF{nlist},Flat;IVF{nlist},PQ32;SQ8;SQfp16"
+
+
+def synthetic_corpus(n, dim, n_queries, seed=0):
+    """生成聚类分布的单位向量语料，以及在语料附近扰动得到的查询"""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(16, int(math.sqrt(n)))
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100000):
+        end = min(n, start + 100000)
+        labels = rng.integers(0, n_clusters, end - start)
+        block = centers[labels] + 0.5 * rng.standard_normal((end - start, dim)).astype(np.float32)
+        vectors[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    picks = rng.integers(0, n, n_queries)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries.astype(np.float32)
+
+
+def default_nlist(n):
+    return 2 ** max(4, round(math.log2(4 * math.sqrt(n))))
+
+
+def measure_latency(index, queries, k):
+    """逐条查询，返回每条的耗时（毫秒）和结果"""
+    latencies = []
+    labels = []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels.append(found[0])
+    return np.array(latencies), np.array(labels)
+
+
+def recall_at_k(found, ground_truth, k):
+    hits = sum(len(set(f[:k].tolist()) & set(g[:k].tolist())) for f, g in zip(found, ground_truth))
+    return hits / (len(ground_truth) * k)
+
+
+def summarize(latencies):
+    return {
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def run_size(n, args):
+    print(f"\n=== 语料规模 {n} × {args.dim} ===")
+    vectors, queries = synthetic_corpus(n, args.dim, args.queries)
+    results = []
+
+    flat = MmapFlatIndex(args.dim, vectors)
+    flat_mb = (vectors.nbytes + flat.norms.nbytes) / 2 ** 20
+    latencies, ground_truth = measure_latency(flat, queries, args.k)
+    results.append({
+        'size': n, 'spec': 'Flat', 'params': {}, 'build_s': 0.0,
+        'recall_at_k': 1.0, 'memory_mb': round(flat_mb, 1), 'memory_ratio': 1.0,
+        **summarize(latencies),
+    })
+    print(f"Flat: p50 {results[-1]['latency_ms_p50']} ms")
+
+    nlist = default_nlist(n)
+    for spec in args.specs.split(';'):
+        spec = spec.strip().replace('{nlist}', str(nlist))
+        start = time.perf_counter()
+        ann = build_ann_index(spec, vectors)
+        build_s = time.perf_counter() - start
+        if ann is None:
+            continue
+        memory_mb = faiss.serialize_index(ann).nbytes / 2 ** 20
+
+        if faiss.try_extract_index_ivf(ann) is not None:
+            sweep = [{'nprobe': value} for value in args.nprobe]
+        elif 'HNSW' in spec.upper():
+            sweep = [{'efSearch': value} for value in args.ef_search]
+        else:
+            sweep = [{}]
+        if is_quantized(spec):
+            sweep = [{**params, 'rescore': factor} for params in sweep for factor in args.rescore]
+        for params in sweep:
+            index = AnnIndex(flat, spec, ann=ann, search_params=params)
+            latencies, found = measure_latency(index, queries, args.k)
+            results.append({
+                'size': n, 'spec': spec, 'params': params, 'build_s': round(build_s, 2),
+                'recall_at_k': round(recall_at_k(found, ground_truth, args.k), 4),
+                'memory_mb': round(memory_mb, 1), 'memory_ratio': round(memory_mb / flat_mb, 3),
+                **summarize(latencies),
+            })
+            print(f"{spec} {params}: recall@{args.k} {results[-1]['recall_at_k']}, "
+                  f"p50 {results[-1]['latency_ms_p50']} ms, p99 {results[-1]['latency_ms_p99']} ms, "
+                  f"内存 {results[-1]['memory_mb']} MB（{results[-1]['memory_ratio']}×）, 构建 {results[-1]['build_s']} 秒")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='近似索引 recall / 延迟 / 内存基准测试')
+    parser.add_argument('--sizes', default='10000,100000', help='语料规模，逗号分隔，例如 10000,100000,1000000')
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--specs', default=DEFAULT_SPECS, help='索引描述，分号分隔')
+    parser.add_argument('--nprobe', default='4,16,64')
+    parser.add_argument('--ef-search', default='32,64,128')
+    parser.add_argument('--rescore', default='1,4', help='量化索引精确重排的候选倍数，逗号分隔')
+    parser.add_argument('--threads', type=int, default=1, help='faiss 使用的线程数')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+    args.nprobe = [int(v) for v in args.nprobe.split(',')]
+    args.ef_search = [int(v) for v in args.ef_search.split(',')]
+    args.rescore = [int(v) for v in args.rescore.split(',')]
+    faiss.omp_set_num_threads(args.threads)
+
+    results = []
+    for size in args.sizes.split(','):
+        results.extend(run_size(int(size), args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'dim': args.dim, 'k': args.k, 'queries': args.queries, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Ark 连接池基准测试：每次新建客户端 vs 共用连接池
+
+python benchmark_http_pool.py --requests 2000 --concurrency 16
+python benchmark_http_pool.py --latency 0.02 --output http_pool.json
+
+在本地启动模拟 Ark 服务，分别用两种方式并发发送向量请求和流式对话请求：
+fresh 每个请求新建一个 OpenAI 客户端（每次都建立新连接），pooled 使用 http_pool 的共用连接池。
+统计吞吐、延迟分位数和新建连接数。模拟服务是本机明文 HTTP/1.1，
+这里测到的只是 TCP 建连的开销；真实的 Ark 接口走 TLS，每次新建连接还要多一次 TLS 握手。
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from openai import OpenAI
+
+from http_pool import HTTPPool, ark_client
+from mock_ark_server import MockArkServer
+
+
+def embed_request(client):
+    client.embeddings.create(model='mock', input=["连接池基准测试"], encoding_format="float")
+
+
+def chat_request(client):
+    stream = client.chat.completions.create(
+        model='mock', messages=[{'role': 'user', 'content': "你好"}], stream=True
+    )
+    for _ in stream:
+        pass
+
+
+def run(make_client, request, n, concurrency):
+    """并发发送 n 个请求，返回 (总耗时, 每个请求的延迟毫秒)"""
+    def one(_):
+        start = time.perf_counter()
+        request(make_client())
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one, range(n)))
+    return time.perf_counter() - start, latencies
+
+
+def summarize(elapsed, latencies, connections):
+    latencies = np.array(latencies)
+    return {
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3),
+        'connections_opened': connections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ark 连接池基准测试')
+    parser.add_argument('--requests', type=int, default=1000, help='每种场景的请求数')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟服务每个请求的固定延迟（秒）')
+    parser.add_argument('--stream-tokens', type=int, default=20, help='对话请求流式返回的 token 数')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    results = {}
+    with MockArkServer(latency=args.latency, stream_tokens=args.stream_tokens) as server:
+        for name, request in (('embeddings', embed_request), ('chat_stream', chat_request)):
+            request(ark_client('test', server.base_url, pool=HTTPPool()))  # 预热
+
+            def fresh_client():
+                return OpenAI(api_key='test', base_url=server.base_url, max_retries=0)
+
+            elapsed, latencies = run(fresh_client, request, args.requests, args.concurrency)
+            fresh = summarize(elapsed, latencies, args.requests)
+
+            # 客户端本身很轻，这里同样每个请求新建一个，但它们共用同一个连接池
+            pool = HTTPPool(max_keepalive=args.concurrency)
+            elapsed, latencies = run(lambda: ark_client('test', server.base_url, max_retries=0, pool=pool),
+                                     request, args.requests, args.concurrency)
+            pooled = summarize(elapsed, latencies, pool.stats()['connections_opened'])
+            pool.close()
+
+            results[name] = {'fresh': fresh, 'pooled': pooled}
+            print(f"\n=== {name}，{args.requests} 个请求，并发 {args.concurrency} ===")
+            for mode, result in (('fresh', fresh), ('pooled', pooled)):
+                print(f"{mode:>7}: {result['requests_per_s']} 请求/秒，p50 {result['latency_ms_p50']} ms，"
+                      f"p99 {result['latency_ms_p99']} ms，新建连接 {result['connections_opened']} 个")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'requests': args.requests, 'concurrency': args.concurrency,
+                       'latency': args.latency, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""关键词（BM25）索引基准测试：构建耗时、磁盘占用和查询延迟
+
+python benchmark_lexical.py --sizes 10000,100000
+python benchmark_lexical.py --sizes 100000 --dim 1024 --output lexical.json
+
+语料为合成的中英文混排文本块（常用汉字组成的词、英文单词和错误码）。
+指定 --dim 时同时用随机向量测量精确向量检索和混合检索（倒数排名融合）的本地耗时，
+便于和关键词检索对比；这里不包含查询向量化的网络请求，实际的向量检索还要再加上一次接口往返。
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from index_storage import MmapFlatIndex
+from lexical_index import LexicalIndex, tokenize, write_lexical_index, reciprocal_rank_fusion
+
+COMMON_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+ENGLISH_WORDS = ["index", "vector", "search", "server", "config", "timeout", "retry", "upload",
+                 "gunicorn", "faiss", "embedding", "cache", "stream", "token", "worker", "model"]
+
+
+def synthetic_chunks(n, chunk_chars, seed=0):
+    """生成 n 个中英文混排文本块"""
+    rng = np.random.default_rng(seed)
+    chars = np.array(list(COMMON_CHARS))
+    # 用齐普夫分布选字，高频字和低频字的比例更接近真实文本
+    weights = 1.0 / np.arange(1, len(chars) + 1)
+    weights /= weights.sum()
+    words_per_chunk = chunk_chars // 3
+    chunks = []
+    for _ in range(n):
+        # 每个文本块一次性抽好所有随机数，词的长度为 2~4 个字
+        lengths = rng.integers(2, 5, words_per_chunk)
+        text = rng.choice(chars, size=int(lengths.sum()), p=weights)
+        kinds = rng.random(words_per_chunk)
+        english = rng.integers(0, len(ENGLISH_WORDS), words_per_chunk)
+        codes = rng.integers(1000, 10000, words_per_chunk)
+        words = []
+        start = 0
+        for length, kind, word_id, code in zip(lengths, kinds, english, codes):
+            if kind < 0.08:
+                words.append(f" {ENGLISH_WORDS[word_id]} ")
+            elif kind < 0.1:
+                words.append(f" E{code} ")
+            else:
+                words.append("".join(text[start:start + length]))
+            start += length
+        chunks.append("".join(words) + "。")
+    return chunks
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies)
+    return {
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def timed_queries(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, results
+
+
+def run_size(n, args):
+    print(f"\n=== 文本块数 {n}，每块约 {args.chunk_chars} 字 ===")
+    chunks = synthetic_chunks(n, args.chunk_chars)
+    rng = np.random.default_rng(1)
+    # 查询：从文本块里截取一小段（中文短语），以及单独的错误码或英文词
+    queries = []
+    for i in rng.integers(0, n, args.queries):
+        text = chunks[i]
+        start = rng.integers(0, max(1, len(text) - 8))
+        queries.append(text[start:start + 8])
+    codes = [word for word in chunks[0].split() if word.startswith('E')][:5] or ["E1234"]
+    queries += codes * max(1, args.queries // (10 * len(codes)))
+
+    start = time.perf_counter()
+    token_count = sum(len(tokenize(text)) for text in chunks)
+    tokenize_s = time.perf_counter() - start
+
+    result = {'size': n, 'tokens': token_count, 'tokenize_s': round(tokenize_s, 2)}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        write_lexical_index(tmp_dir, chunks)
+        result['build_s'] = round(time.perf_counter() - start, 2)
+        result['disk_mb'] = round(sum(f.stat().st_size for f in Path(tmp_dir).iterdir()) / 2 ** 20, 1)
+
+        start = time.perf_counter()
+        index = LexicalIndex.load(tmp_dir)
+        result['load_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+        index.search(queries[0], args.k)  # 预热，建立 SQLite 连接
+        latencies, _ = timed_queries(lambda q: index.search(q, args.k), queries)
+        result['lexical'] = percentiles(latencies)
+        print(f"分词 {tokenize_s:.2f} 秒（{token_count} 个词项），构建 {result['build_s']} 秒，"
+              f"磁盘 {result['disk_mb']} MB，加载 {result['load_ms']} ms")
+        print(f"关键词检索: p50 {result['lexical']['latency_ms_p50']} ms, p99 {result['lexical']['latency_ms_p99']} ms")
+
+        if args.dim:
+            vectors = rng.standard_normal((n, args.dim)).astype(np.float32)
+            flat = MmapFlatIndex(args.dim, vectors)
+            query_vectors = rng.standard_normal((len(queries), args.dim)).astype(np.float32)
+            dense_latencies, dense_results = timed_queries(
+                lambda i: flat.search(query_vectors[i:i + 1], args.candidates)[1][0].tolist(), range(len(queries))
+            )
+            result['dense_local'] = percentiles(dense_latencies)
+            print(f"精确向量检索（不含查询向量化）: p50 {result['dense_local']['latency_ms_p50']} ms, "
+                  f"p99 {result['dense_local']['latency_ms_p99']} ms")
+
+            def fuse(i):
+                lexical = [pos for pos, _ in index.search(queries[i], args.candidates)]
+                return reciprocal_rank_fusion([dense_results[i], lexical])[:args.k]
+
+            # 混合检索耗时 = 同一条查询的向量检索耗时 + 关键词检索和融合的耗时
+            fuse_latencies, _ = timed_queries(fuse, range(len(queries)))
+            result['hybrid_local'] = percentiles(np.array(dense_latencies) + np.array(fuse_latencies))
+            print(f"混合检索（不含查询向量化）: p50 {result['hybrid_local']['latency_ms_p50']} ms, "
+                  f"p99 {result['hybrid_local']['latency_ms_p99']} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BM25 关键词索引基准测试')
+    parser.add_argument('--sizes', default='10000,100000', help='文本块数，逗号分隔')
+    parser.add_argument('--chunk-chars', type=int, default=500, help='每个文本块的字数')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--candidates', type=int, default=20, help='混合检索时每一路的候选数')
+    parser.add_argument('--dim', type=int, default=0, help='同时测量向量检索和混合检索时使用的向量维度')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    results = [run_size(int(size), args) for size in args.sizes.split(',')]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'chunk_chars': args.chunk_chars, 'k': args.k, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
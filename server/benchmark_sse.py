@@ -0,0 +1,132 @@
+"""SSE 事件编码基准测试：每核每秒能编码的事件数
+
+python benchmark_sse.py --events 200000
+python benchmark_sse.py --flush-interval 20 --output sse.json
+
+用 openai 的 ChatCompletionChunk 构造一段模拟的模型输出（先推理后回答，每个片段 1~3 个字），
+分别用原来的写法（逐个构造字典、json.dumps、f-string 再编码，并格式化 debug 日志）和
+SSEWriter 编码，单线程计时，只统计编码本身，不包括网络写出。--flush-interval 大于 0 时
+同时测量合并小片段的效果：按 --token-interval 给每个片段一个模拟的到达时间。
+"""
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+from openai.types.chat import ChatCompletionChunk
+
+from chat_service import chunk_delta
+from sse_writer import SSEWriter
+
+TEXT = "检索增强生成先从文档中找到相关片段，再把片段和问题一起交给模型回答。"
+
+
+def make_chunks(n, seed=0):
+    rng = np.random.default_rng(seed)
+    chunks = []
+    for i in range(n):
+        start = int(rng.integers(0, len(TEXT) - 3))
+        text = TEXT[start:start + int(rng.integers(1, 4))]
+        delta = {'content': text} if i >= n // 3 else {'reasoning_content': text}
+        chunks.append(ChatCompletionChunk.model_validate({
+            'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'mock',
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}],
+        }))
+    return chunks
+
+
+def legacy_encode(chunks, logger):
+    """原来的逐个事件编码方式"""
+    size = 0
+    for chunk in chunks:
+        logger.debug("收到 chunk: %s", chunk)
+        delta = chunk.choices[0].delta
+        if getattr(delta, 'reasoning_content', None):
+            payload = {'choices': [{'delta': {'reasoning_content': delta.reasoning_content}}]}
+        elif getattr(delta, 'content', None):
+            payload = {'choices': [{'delta': {'content': delta.content}}]}
+        else:
+            continue
+        size += len(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+    return size, len(chunks)
+
+
+def writer_encode(chunks, writer):
+    size = 0
+    for chunk in chunks:
+        text, is_answer = chunk_delta(chunk)
+        if text:
+            event = writer.write(text, is_answer)
+            if event:
+                size += len(event)
+    event = writer.flush()
+    if event:
+        size += len(event)
+    return size, writer.frames
+
+
+class SimulatedClock:
+    """每次读取前进 step 秒，模拟片段按固定间隔到达"""
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size, frames = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, size, frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SSE 事件编码基准测试')
+    parser.add_argument('--events', type=int, default=100000, help='模拟的模型片段数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数，取最快的一次')
+    parser.add_argument('--flush-interval', type=float, default=0, help='合并小片段的时间窗口（毫秒）')
+    parser.add_argument('--token-interval', type=float, default=5, help='模拟的片段到达间隔（毫秒）')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.events)
+    logger = logging.getLogger('benchmark_sse')
+    logger.setLevel(logging.INFO)
+
+    scenarios = {
+        'legacy': lambda: legacy_encode(chunks, logger),
+        'writer': lambda: writer_encode(chunks, SSEWriter(flush_interval=0)),
+    }
+    if args.flush_interval > 0:
+        # 每个片段读两次时钟，步长取片段间隔的一半
+        scenarios['writer_batched'] = lambda: writer_encode(chunks, SSEWriter(
+            flush_interval=args.flush_interval / 1000, clock=SimulatedClock(args.token_interval / 2000)))
+
+    results = {}
+    print(f"\n=== {args.events} 个片段，单线程 ===")
+    for name, fn in scenarios.items():
+        elapsed, size, frames = measure(fn, args.repeat)
+        results[name] = {
+            'events_per_s': round(args.events / elapsed),
+            'us_per_event': round(elapsed / args.events * 1e6, 3),
+            'frames': frames,
+            'bytes': size,
+        }
+        print(f"{name:>15}: {results[name]['events_per_s']} 片段/秒，每个 {results[name]['us_per_event']} 微秒，"
+              f"写出 {frames} 帧，{size} 字节")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'events': args.events, 'flush_interval_ms': args.flush_interval,
+                       'token_interval_ms': args.token_interval, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
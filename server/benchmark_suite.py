@@ -0,0 +1,307 @@
+"""离线基准测试套件：入库、冷启动加载索引、检索延迟、对话首 token 时间和并发流
+
+python benchmark_suite.py --output bench.json
+python benchmark_suite.py --docs 500 --queries 500 --concurrency 200 --output bench.json --compare last.json
+python benchmark_suite.py --scenarios ingest,index_load,search
+
+全部使用本地模拟的 Ark 服务（mock_ark_server，确定性向量、可配置的延迟和流式输出），
+不需要 API key，也不访问网络，在临时目录中运行，不影响当前目录下的索引：
+
+ingest       生成 --docs 篇文档并入库（解析、切分、向量化、写索引），统计耗时、吞吐和主进程的内存峰值；
+             --large-file-mb 另外生成一个大文本文件；用不同的大小各运行一次，对比 rss_mb_growth
+             可以看出入库的内存峰值是否随文件大小增长（本脚本只记录数值，不做判断）
+index_load   新建 DocumentStore 从磁盘加载刚写好的索引（冷启动，没有任何进程内缓存）
+search       --queries 个不同的查询依次检索（每个都要请求一次查询向量），统计 p50/p99；
+             再把同样的查询检索一遍，统计命中进程内缓存时的延迟
+chat_ttft    启动异步服务（asgi_app），逐个发送对话请求，统计首字节和首个回答 token 时间
+streams      同一个服务上同时打开 --concurrency 个对话流
+
+结果写入 JSON，附带 git 提交、Python 版本和参数，便于在不同版本之间对比；
+--compare 指定之前的结果文件时，打印各项延迟和吞吐的变化。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmark_lexical import synthetic_chunks
+from loadtest_chat import run_load, seed_documents, start_asgi_server, wait_until_ready
+from mock_ark_server import MockArkServer
+
+SERVER_DIR = Path(__file__).resolve().parent
+SCENARIOS = ('ingest', 'index_load', 'search', 'chat_ttft', 'streams')
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return {
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def write_documents(directory, n, chunks_per_doc, chunk_chars):
+    """生成 n 篇文档，每篇由若干合成文本块组成"""
+    directory.mkdir(exist_ok=True)
+    chunks = synthetic_chunks(n * chunks_per_doc, chunk_chars)
+    total_chars = 0
+    for i in range(n):
+        text = "\n\n".join(chunks[i * chunks_per_doc:(i + 1) * chunks_per_doc])
+        (directory / f"doc{i:05d}.txt").write_text(text, encoding='utf-8')
+        total_chars += len(text)
+    return total_chars
+
+
+def rss_mb():
+    """当前进程的常驻内存（MB），读取 /proc，其他平台返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        return None
+
+
+class PeakRSS:
+    """在后台线程中定时采样常驻内存，记录 with 块执行期间的峰值"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, rss_mb())
+
+    def result(self):
+        if self.start is None:
+            return {}
+        return {'rss_mb_start': round(self.start, 1), 'rss_mb_peak': round(self.peak, 1),
+                'rss_mb_growth': round(self.peak - self.start, 1)}
+
+
+def write_large_file(directory, size_mb, chunk_chars):
+    """生成一个约 size_mb MB 的文本文件，分批写出，不在内存中拼出整个文件"""
+    path = directory / "large.txt"
+    written = 0
+    seed = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < size_mb * 1024 * 1024:
+            text = "\n\n".join(synthetic_chunks(200, chunk_chars, seed=seed)) + "\n\n"
+            f.write(text)
+            written += len(text.encode('utf-8'))
+            seed += 1
+    return path.stat().st_size
+
+
+def new_store(mock):
+    from document_store import ArkEmbeddings, DocumentStore
+    store = DocumentStore()
+    store.embeddings = ArkEmbeddings(api_key='test', base_url=mock.base_url)
+    return store
+
+
+def run_ingest(mock, args):
+    documents = Path("documents")
+    total_chars = write_documents(documents, args.docs, args.chunks_per_doc, args.chunk_chars)
+    large_bytes = write_large_file(documents, args.large_file_mb, args.chunk_chars) if args.large_file_mb else 0
+    store = new_store(mock)
+    start = time.perf_counter()
+    with PeakRSS() as memory:
+        store.load_documents(str(documents))
+    elapsed = time.perf_counter() - start
+    chunks = store.vector_store.index.ntotal
+    return {
+        'docs': args.docs,
+        'chars': total_chars,
+        'large_file_bytes': large_bytes,
+        'chunks': chunks,
+        'elapsed_s': round(elapsed, 3),
+        'docs_per_s': round(args.docs / elapsed, 1),
+        'chunks_per_s': round(chunks / elapsed, 1),
+        'embedding_requests': mock.stats['requests'],
+        **memory.result(),
+    }
+
+
+def run_index_load(mock, args):
+    store = new_store(mock)
+    start = time.perf_counter()
+    assert store.load_existing_index(), "没有可加载的索引，需要先运行 ingest"
+    elapsed = time.perf_counter() - start
+    return {'elapsed_ms': round(elapsed * 1000, 3), 'chunks': store.vector_store.index.ntotal}
+
+
+def run_search(mock, args):
+    store = new_store(mock)
+    store.load_existing_index()
+    rng = np.random.default_rng(1)
+    phrases = synthetic_chunks(args.queries, 12, seed=2)
+    queries = [f"{phrase} {i}" for i, phrase in zip(rng.permutation(args.queries), phrases)]
+
+    def timed():
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            store.search(query, k=args.k, mode=args.search_mode)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    cold = timed()
+    warm = timed()
+    return {
+        'queries': args.queries,
+        'k': args.k,
+        'mode': args.search_mode or store.search_mode,
+        'uncached': percentiles(cold),
+        'cached': percentiles(warm),
+    }
+
+
+def run_chat(mock, args, scenarios, port):
+    """在同一个异步服务上依次运行 chat_ttft 和 streams"""
+    results = {}
+    server = start_asgi_server(mock, os.getcwd(), port)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(url)
+        if not Path("faiss_index", "CURRENT").exists():
+            seed_documents(url)
+        # 先发一个请求，不计入结果：第一次请求要加载分词器、建立到模拟服务的连接
+        asyncio.run(run_load(url, 1, 1))
+        if 'chat_ttft' in scenarios:
+            results['chat_ttft'] = asyncio.run(run_load(url, 1, args.chat_requests))
+        if 'streams' in scenarios:
+            results['streams'] = asyncio.run(run_load(url, args.concurrency, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """把嵌套的结果展开成 {'search.uncached.latency_ms_p50': 值}，只保留数值"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, previous):
+    """打印延迟（_ms、_s）、吞吐（_per_s）和内存（_mb_peak、_mb_growth）指标相对上一次结果的变化"""
+    before = flatten(previous.get('results', {}))
+    after = flatten(current['results'])
+    print(f"\n=== 与 {previous.get('revision')} 对比 ===")
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        if not old or not any(name.endswith(suffix) for suffix in ('_ms', '_s', '_ms_p50', '_ms_p99', '_mb_peak', '_mb_growth')):
+            continue
+        change = (new - old) / old * 100
+        higher_is_better = name.endswith('_per_s')
+        worse = change < 0 if higher_is_better else change > 0
+        flag = '  <- 变差' if worse and abs(change) >= 10 else ''
+        print(f"{name:>45}: {old} -> {new} ({change:+.1f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线基准测试套件')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"逗号分隔，可选 {', '.join(SCENARIOS)}")
+    parser.add_argument('--docs', type=int, default=200, help='入库的文档数')
+    parser.add_argument('--chunks-per-doc', type=int, default=5)
+    parser.add_argument('--chunk-chars', type=int, default=300)
+    parser.add_argument('--large-file-mb', type=float, default=0, help='另外入库一个这么大的文本文件（MB）')
+    parser.add_argument('--queries', type=int, default=200, help='检索测试的查询数')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--search-mode', help='dense / hybrid / lexical，默认使用 SEARCH_MODE')
+    parser.add_argument('--chat-requests', type=int, default=20, help='chat_ttft 依次发送的请求数')
+    parser.add_argument('--concurrency', type=int, default=100, help='streams 同时打开的对话流数')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟 Ark 服务每个请求的固定延迟（秒）')
+    parser.add_argument('--stream-tokens', type=int, default=50)
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', help='之前的结果文件，打印变化')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+
+    # 向量缓存会让重复运行的结果不可比，这里关闭；解析只用一个进程，结果更稳定
+    os.environ.update(ARK_API_KEY='test', EMBEDDING_CACHE_MAX_MB='0', INGEST_WORKERS='1')
+    old_cwd = os.getcwd()
+    results = {}
+    with MockArkServer(latency=args.latency, stream_tokens=args.stream_tokens, token_delay=args.token_delay) as mock, \
+            tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            if 'ingest' in scenarios or 'index_load' in scenarios or 'search' in scenarios:
+                results['ingest'] = run_ingest(mock, args)
+                print(f"ingest: {results['ingest']}")
+            if 'index_load' in scenarios:
+                results['index_load'] = run_index_load(mock, args)
+                print(f"index_load: {results['index_load']}")
+            if 'search' in scenarios:
+                results['search'] = run_search(mock, args)
+                print(f"search: {results['search']}")
+            if 'chat_ttft' in scenarios or 'streams' in scenarios:
+                for name, result in run_chat(mock, args, scenarios, args.port).items():
+                    results[name] = result
+                    print(f"{name}: ttft p50 {result['ttft_ms_p50']} ms，p99 {result['ttft_ms_p99']} ms，"
+                          f"完成 {result['completed']}/{result['requests']}")
+        finally:
+            os.chdir(old_cwd)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""聊天接口的公共逻辑：上下文、提示词和 SSE 事件，Flask 和 ASGI 两种服务方式共用"""
+import json
+
+from sse_writer import encode_content, encode_reasoning
+
+# 流式响应的 HTTP 头
+SSE_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Accept',
+    'Access-Control-Max-Age': '3600',
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no'  # 禁用 Nginx 缓冲（如果有的话）
+}
+
+DEFAULT_MODEL = 'deepseek-r1-250120'
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+
+
+def reasoning_event(text):
+    return encode_reasoning(text)
+
+
+def content_event(text):
+    return encode_content(text)
+
+
+def error_event(error):
+    return sse_event({'error': str(error)})
+
+
+# 收到请求后立即发送的第一个事件，检索在它之后进行
+ANALYZING_EVENT = reasoning_event('正在分析相关文档...\n')
+
+
+def comment_event(text):
+    """SSE 注释行，客户端会忽略，用于附带统计信息"""
+    return f": {text}\n\n".encode('utf-8')
+
+
+def build_context(relevant_docs):
+    return "\n\n".join([f"文档片段 {i+1}:\n{doc.page_content}" for i, doc in enumerate(relevant_docs)])
+
+
+def build_system_prompt(context, history_summary=None):
+    """history_summary 为较早对话的摘要，有摘要时附在提示词末尾"""
+    prompt = _system_prompt(context)
+    if history_summary:
+        prompt += f"\n\n之前的对话摘要:\n{history_summary}"
+    return prompt
+
+
+def _system_prompt(context):
+    return f"""你好!我是一个专业的AI助手,很高兴为你提供帮助。我会仔细阅读以下参考文档来回答你的问题:
+
+参考文档:
+{context}
+
+在回答过程中,我会:
+- 优先使用文档中的信息进行回答
+- 用简洁清晰的语言表达
+- 如果需要补充额外信息,我会明确标注出哪些内容来自文档,哪些是我的补充说明
+
+如果文档中没有找到相关信息,我会坦诚地告诉你。请问有什么我可以帮你的吗?"""
+
+
+def apply_system_prompt(messages, system_prompt):
+    """更新消息列表中的系统消息"""
+    if messages and messages[0]['role'] == 'system':
+        messages[0]['content'] = system_prompt
+    else:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    return messages
+
+
+def retrieval_events(relevant_docs):
+    """检索结果的推理内容事件，在 ANALYZING_EVENT 之后发送"""
+    yield reasoning_event(f'找到 {len(relevant_docs)} 个相关文档片段。\n')
+
+    # 可以选择性地显示找到的文档片段
+    if relevant_docs:
+        yield reasoning_event('相关文档内容：\n')
+        for i, doc in enumerate(relevant_docs):
+            yield reasoning_event(f'片段 {i+1}：{doc.page_content}\n')
+        yield reasoning_event('\n基于以上文档回答：\n')
+
+
+def chunk_delta(chunk):
+    """取出模型流式 chunk 中的文本，返回 (文本, 是否为正式回答)；没有内容时返回 (None, False)"""
+    if not chunk.choices:
+        return None, False
+    delta = chunk.choices[0].delta
+    text = getattr(delta, 'reasoning_content', None)
+    if text:
+        return text, False
+    text = delta.content
+    if text:
+        return text, True
+    return None, False
+
+
+def replay_events(relevant_docs, answer):
+    """回放语义缓存中的答案，事件格式与模型流式输出相同"""
+    yield from retrieval_events(relevant_docs)
+    yield reasoning_event('找到相似问题的已有回答，直接返回。\n')
+    yield content_event(answer)
+    yield DONE_EVENT
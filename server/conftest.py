@@ -0,0 +1,67 @@
+"""测试共用的 fixture：临时工作目录、模拟 Ark 服务、连到模拟服务的 DocumentStore 和 Flask 测试客户端
+
+DocumentStore 的索引目录（faiss_index）和文档目录都是相对当前目录的，
+workdir 切换到 tmp_path，并关闭向量缓存，测试之间互不影响。
+需要调整模拟服务参数的测试用 @pytest.mark.mock_ark(stream_tokens=5) 标注。
+"""
+from pathlib import Path
+
+import pytest
+from openai import OpenAI
+
+from document_store import ArkEmbeddings, DocumentStore
+from mock_ark_server import MockArkServer
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "mock_ark(**kwargs): 传给 MockArkServer 的参数")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """切换到临时目录运行，ARK_API_KEY 使用测试值，关闭向量缓存"""
+    monkeypatch.setenv('ARK_API_KEY', 'test')
+    monkeypatch.setenv('EMBEDDING_CACHE_MAX_MB', '0')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def documents(workdir):
+    """空的文档目录，使用相对路径，与 DocumentStore 记录的 source 一致"""
+    path = Path("documents")
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def mock_ark(request):
+    """在后台线程运行的模拟 Ark 服务，测试结束时停止"""
+    marker = request.node.get_closest_marker('mock_ark')
+    with MockArkServer(**(marker.kwargs if marker else {})) as server:
+        yield server
+
+
+@pytest.fixture
+def make_store(workdir, mock_ark):
+    """创建向量接口指向模拟服务的 DocumentStore，参数传给 ArkEmbeddings"""
+    def make(**embedding_kwargs):
+        store = DocumentStore(ingest_workers=1)
+        store.embeddings = ArkEmbeddings(api_key='test', base_url=mock_ark.base_url, **embedding_kwargs)
+        return store
+    return make
+
+
+@pytest.fixture
+def app_client(monkeypatch, mock_ark):
+    """返回 client_for(store, **attrs)：把 app 模块的 doc_store、模型客户端和 attrs 中的属性
+    临时替换后，返回 Flask 测试客户端；测试结束时恢复"""
+    import app as app_module
+
+    def client_for(store, **attrs):
+        monkeypatch.setattr(app_module, 'doc_store', store)
+        monkeypatch.setattr(app_module, 'client', OpenAI(api_key='test', base_url=mock_ark.base_url))
+        for name, value in attrs.items():
+            monkeypatch.setattr(app_module, name, value)
+        return app_module.app.test_client()
+    return client_for
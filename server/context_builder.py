@@ -0,0 +1,155 @@
+"""按 token 预算组装检索上下文
+
+检索时多取一些候选文本块，同一来源（同一文件、同一页）中相互重叠或相邻的块
+合并成一段，去掉切分时 chunk_overlap 造成的重复内容；再按检索排名依次放入，
+放不下的块跳过，保证上下文不超过 CONTEXT_TOKEN_BUDGET。
+"""
+from collections import namedtuple
+import functools
+import os
+
+from langchain_core.documents import Document
+
+from chat_service import build_context
+from document_store import estimate_tokens
+from ingest import CHUNK_OVERLAP
+
+# 检索的候选文本块数和上下文的 token 预算
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', 8))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))
+# tiktoken 编码名称，只用于计数，与模型自身的分词不完全一致
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'cl100k_base')
+
+# 没有位置信息（旧索引中的文本块）时，首尾至少重合这么多字符才认为是相邻块
+MIN_TEXT_OVERLAP = 20
+# 两个块之间只隔着这么几个字符（被切掉的分隔符）时也视为相邻
+MAX_ADJACENT_GAP = 2
+
+
+class ContextResult(namedtuple('ContextResult', ['docs', 'context', 'tokens', 'candidates', 'dropped'])):
+    """组装结果：合并后的文档段、上下文文本、上下文 token 数、候选块数、因超出预算跳过的块数"""
+    __slots__ = ()
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=TOKENIZER_ENCODING):
+    """加载并缓存 tiktoken 编码；无法加载（例如离线环境下载不到词表）时返回 None"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        print(f"无法加载 tiktoken 编码 {name}，改用估算的 token 数: {str(e)}")
+        return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text):
+    """计算文本的 token 数，同一个文本块在不同请求中反复出现，结果缓存"""
+    encoding = get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class _Passage:
+    """一段连续的文档内容，由一个或多个文本块合并而成"""
+
+    def __init__(self, doc):
+        self.group = (doc.metadata.get('source'), doc.metadata.get('page'))
+        self.metadata = dict(doc.metadata)
+        self.text = doc.page_content
+        self.start = doc.metadata.get('start_index')
+        self.chunks = 1
+
+    @property
+    def end(self):
+        return self.start + len(self.text)
+
+    def merged_text(self, other):
+        """与另一段重叠或相邻时返回 (起始位置, 合并后的文本)，否则返回 None"""
+        if self.group != other.group or self.group[0] is None:
+            return None
+        if self.start is not None and other.start is not None:
+            first, second = (self, other) if self.start <= other.start else (other, self)
+            gap = second.start - first.end
+            if gap > MAX_ADJACENT_GAP:
+                return None
+            if gap > 0:
+                return first.start, first.text + "\n" + second.text
+            return first.start, first.text + second.text[first.end - second.start:]
+        if other.text in self.text:
+            return self.start, self.text
+        if self.text in other.text:
+            return other.start, other.text
+        for first, second in ((self, other), (other, self)):
+            size = _text_overlap(first.text, second.text)
+            if size >= MIN_TEXT_OVERLAP:
+                return None, first.text + second.text[size:]
+        return None
+
+    def absorb(self, other, start, text):
+        self.start, self.text = start, text
+        self.chunks += other.chunks
+
+    def tokens(self):
+        return count_tokens(self.text)
+
+    def to_document(self):
+        metadata = dict(self.metadata, chunks=self.chunks)
+        if self.start is not None:
+            metadata['start_index'] = self.start
+        return Document(page_content=self.text, metadata=metadata)
+
+
+def _text_overlap(left, right):
+    """left 的结尾与 right 的开头重合的最长字符数，切分时的重叠不超过 CHUNK_OVERLAP"""
+    for size in range(min(len(left) - 1, len(right) - 1, CHUNK_OVERLAP), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _header_tokens(i):
+    return count_tokens(f"文档片段 {i}:\n") + 1
+
+
+def assemble_context(candidates, token_budget=None):
+    """把按相关度排好序的候选文本块组装成不超过 token_budget 的上下文
+
+    按排名依次处理每个块：与已选的某一段重叠或相邻时合并进去，只为新增的内容计 token；
+    否则作为新的一段。加入后超出预算的块跳过，继续尝试排名更低、更短的块。
+    返回 ContextResult，docs 按各段中排名最高的块排序。
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    passages = []
+    used = dropped = 0
+    for doc in candidates:
+        passage = _Passage(doc)
+        target = next((p for p in passages if p.merged_text(passage) is not None), None)
+        if target is None:
+            cost = passage.tokens() + _header_tokens(len(passages) + 1)
+            if used + cost > token_budget:
+                dropped += 1
+                continue
+            passages.append(passage)
+            used += cost
+            continue
+
+        start, text = target.merged_text(passage)
+        cost = count_tokens(text) - target.tokens()
+        if used + cost > token_budget:
+            dropped += 1
+            continue
+        target.absorb(passage, start, text)
+        used += cost
+        # 新块可能把两段连成一段，合并后只会更短
+        for other in [p for p in passages if p is not target]:
+            merged = target.merged_text(other)
+            if merged is not None:
+                used += count_tokens(merged[1]) - target.tokens() - other.tokens() - _header_tokens(len(passages))
+                target.absorb(other, *merged)
+                passages.remove(other)
+
+    docs = [passage.to_document() for passage in passages]
+    context = build_context(docs)
+    return ContextResult(docs, context, count_tokens(context) if context else 0, len(candidates), dropped)
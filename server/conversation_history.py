@@ -0,0 +1,159 @@
+"""对话历史的 token 窗口和滚动摘要
+
+客户端每轮都会发来完整的 messages。这里只把最近的若干轮原样发给模型，总量不超过
+HISTORY_TOKEN_BUDGET；更早的轮次压缩成一段摘要放进系统提示词。
+
+摘要按对话 ID 缓存，记录它覆盖了前多少条消息以及这些消息的哈希。之后的请求只要
+前缀没变就直接复用，不再请求模型。超出预算时一次多截掉一些（只保留预算的
+HISTORY_KEEP_RATIO），在前一份摘要的基础上只总结新截掉的消息，
+所以摘要每隔几轮才更新一次。
+"""
+from collections import namedtuple
+import hashlib
+import json
+import os
+
+from context_builder import count_tokens
+from query_cache import LRUCache
+
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 4000))
+HISTORY_KEEP_RATIO = float(os.getenv('HISTORY_KEEP_RATIO', 0.5))
+# 生成摘要使用的模型，不设置时使用本轮对话的模型
+HISTORY_SUMMARY_MODEL = os.getenv('HISTORY_SUMMARY_MODEL')
+# 检索查询的 token 上限；最后一条消息短于 FOLLOWUP_QUERY_TOKENS 时视为追问，带上之前的问题
+RETRIEVAL_QUERY_TOKENS = int(os.getenv('RETRIEVAL_QUERY_TOKENS', 64))
+FOLLOWUP_QUERY_TOKENS = int(os.getenv('FOLLOWUP_QUERY_TOKENS', 16))
+
+# 每条消息除内容外的固定开销（角色、分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTION = (
+    "请把下面的对话内容压缩成一段简洁的摘要，保留用户的问题、关键事实、结论和尚未解决的事项，"
+    "不要添加对话中没有的信息。如果提供了之前的摘要，请把新内容合并进去，输出完整的新摘要。"
+)
+
+
+class HistoryWindow(namedtuple('HistoryWindow', ['messages', 'summary', 'pending', 'covered'])):
+    """messages 为原样发送的最近消息；summary 为更早消息的摘要；
+    pending 为需要合并进摘要的新消息；covered 为没有原样发送、由摘要代替的消息条数"""
+    __slots__ = ()
+
+
+def message_tokens(message):
+    return count_tokens(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS
+
+
+def messages_digest(messages):
+    """消息列表的哈希，用来确认缓存的摘要对应的前缀没有被修改"""
+    payload = json.dumps([(m.get('role'), m.get('content')) for m in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def summary_prompt(previous_summary, messages):
+    """生成摘要请求的消息列表"""
+    transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in messages)
+    content = f"之前的摘要:\n{previous_summary}\n\n新的对话:\n{transcript}" if previous_summary else f"对话:\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTION},
+        {"role": "user", "content": content},
+    ]
+
+
+def condense_query(messages):
+    """检索用的查询：最后一条用户消息；它很短（像是追问）时，往前补上最近的用户问题"""
+    user_messages = [m.get('content') or '' for m in messages if m.get('role') == 'user']
+    if not user_messages:
+        return (messages[-1].get('content') or '') if messages else ''
+    parts = [user_messages[-1]]
+    tokens = count_tokens(parts[0])
+    if tokens < FOLLOWUP_QUERY_TOKENS:
+        for content in reversed(user_messages[:-1]):
+            tokens += count_tokens(content)
+            if tokens > RETRIEVAL_QUERY_TOKENS:
+                break
+            parts.insert(0, content)
+    return "\n".join(parts)
+
+
+class ConversationHistory:
+    """按 token 预算截取对话历史，较早的消息用缓存的滚动摘要代替"""
+
+    def __init__(self, token_budget=None, keep_ratio=None, cache_size=None, cache_ttl=None):
+        self.token_budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.keep_ratio = HISTORY_KEEP_RATIO if keep_ratio is None else keep_ratio
+        cache_size = int(os.getenv('HISTORY_CACHE_SIZE', 1024)) if cache_size is None else cache_size
+        cache_ttl = float(os.getenv('HISTORY_CACHE_TTL', 86400)) if cache_ttl is None else cache_ttl
+        # 对话 ID -> (摘要覆盖的消息条数, 这些消息的哈希, 摘要)
+        self.summary_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.summaries_computed = 0
+
+    @staticmethod
+    def conversation_key(conversation_id, messages):
+        """没有对话 ID 时用第一条消息的哈希区分对话"""
+        if conversation_id:
+            return str(conversation_id)
+        return messages_digest(messages[:1])
+
+    def plan(self, conversation_id, messages):
+        """计算本轮的历史窗口，不请求模型；pending 不为空时需要先更新摘要"""
+        conversation = [m for m in messages if m.get('role') != 'system']
+        key = self.conversation_key(conversation_id, conversation)
+        covered, summary = 0, None
+        cached = self.summary_cache.get(key)
+        if cached is not None:
+            count, digest, cached_summary = cached
+            if count < len(conversation) and messages_digest(conversation[:count]) == digest:
+                covered, summary = count, cached_summary
+
+        tokens = [message_tokens(m) for m in conversation]
+        if sum(tokens[covered:]) <= self.token_budget:
+            return HistoryWindow(conversation[covered:], summary, [], covered)
+
+        # 超出预算：从后往前保留不超过 keep_ratio 预算的消息，至少保留最后一条
+        keep_budget = self.token_budget * self.keep_ratio
+        cut, kept = len(conversation) - 1, tokens[-1]
+        while cut > covered and kept + tokens[cut - 1] <= keep_budget:
+            cut -= 1
+            kept += tokens[cut]
+        # 尽量让保留的部分从用户消息开始，不把一问一答拆开
+        while cut < len(conversation) - 1 and conversation[cut].get('role') != 'user':
+            cut += 1
+        return HistoryWindow(conversation[cut:], summary, conversation[covered:cut], cut)
+
+    def complete(self, conversation_id, messages, window, summary):
+        """记录更新后的摘要，返回带新摘要的窗口"""
+        conversation = [m for m in messages if m.get('role') != 'system']
+        key = self.conversation_key(conversation_id, conversation)
+        self.summary_cache.put(key, (window.covered, messages_digest(conversation[:window.covered]), summary))
+        self.summaries_computed += 1
+        return window._replace(summary=summary, pending=[])
+
+    def trim(self, conversation_id, messages, summarize):
+        """返回本轮的历史窗口，需要时调用 summarize(prompt_messages) 更新摘要
+
+        摘要失败时只截断、不带新内容的摘要，不影响本轮对话。
+        """
+        window = self.plan(conversation_id, messages)
+        if not window.pending:
+            return window
+        try:
+            summary = summarize(summary_prompt(window.summary, window.pending))
+        except Exception as e:
+            print(f"生成对话摘要失败，仅截断历史: {str(e)}")
+            return window._replace(pending=[])
+        return self.complete(conversation_id, messages, window, summary)
+
+    async def atrim(self, conversation_id, messages, summarize):
+        """trim 的异步版本，summarize 为协程函数"""
+        window = self.plan(conversation_id, messages)
+        if not window.pending:
+            return window
+        try:
+            summary = await summarize(summary_prompt(window.summary, window.pending))
+        except Exception as e:
+            print(f"生成对话摘要失败，仅截断历史: {str(e)}")
+            return window._replace(pending=[])
+        return self.complete(conversation_id, messages, window, summary)
+
+    def stats(self):
+        return dict(self.summary_cache.stats(), summaries_computed=self.summaries_computed)
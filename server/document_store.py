@@ -1,26 +1,72 @@
-from langchain_community.document_loaders import DirectoryLoader, TextLoader, PyPDFLoader, UnstructuredWordDocumentLoader
-from langchain_community.document_loaders.markdown import UnstructuredMarkdownLoader
-from langchain_community.document_loaders.pdf import PyPDFLoader
-from langchain_community.document_loaders.word_document import UnstructuredWordDocumentLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from openai import OpenAI
-from langchain_community.vectorstores import FAISS
+import openai
 import os
 from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
 import numpy as np
 import hashlib
 from pathlib import Path
 import json
+import sqlite3
+import uuid
+import random
+import time
+import asyncio
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ingest import LOADERS, iter_file_windows
+from embedding_cache import EmbeddingCache
+from query_cache import LRUCache
+from http_pool import EMBED_TIMEOUT, ark_client, ark_async_client
+from index_storage import (
+    IndexBuilder, IndexDirectory, load_index,
+    is_legacy_index, migrate_legacy_index, parse_search_params
+)
+from lexical_index import LexicalIndex, write_lexical_index, reciprocal_rank_fusion
+from metrics import metrics
 
 # 加载环境变量
 load_dotenv()
 
-class ArkEmbeddings:
-    def __init__(self, api_key, base_url):
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+# Ark 接口配置，可通过环境变量指向本地模拟服务
+ARK_BASE_URL = os.getenv('ARK_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
+EMBEDDING_MODEL = os.getenv('ARK_EMBEDDING_MODEL', 'ep-20250227223958-wb4sk')
+
+# 可以重试的错误：限流、超时、连接失败和服务端 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def estimate_tokens(text):
+    """粗略估计文本的 token 数：中日韩字符每个约 1 个 token，其余约 4 个字符 1 个 token"""
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class ArkEmbeddings(Embeddings):
+    def __init__(self, api_key, base_url, model=EMBEDDING_MODEL,
+                 max_concurrency=None, max_batch_size=None, max_batch_tokens=None,
+                 max_retries=5, base_backoff=0.5, max_backoff=30.0, cache=None, http_pool=None):
+        # 与对话接口共用 http_pool 中的 Ark 连接池；重试由 _create_embeddings 统一处理
+        self._client_kwargs = {'api_key': api_key, 'base_url': base_url, 'timeout': EMBED_TIMEOUT,
+                               'max_retries': 0, 'pool': http_pool}
+        self.client = ark_client(**self._client_kwargs)
+        # 异步客户端在第一次异步调用时创建
+        self._async_client = None
+        self.model = model
+        # 同时在途的请求数上限
+        self.max_concurrency = max_concurrency or int(os.getenv('EMBED_CONCURRENCY', 4))
+        # 每批最多的文本条数和估计 token 数
+        self.max_batch_size = max_batch_size or int(os.getenv('EMBED_BATCH_SIZE', 10))
+        self.max_batch_tokens = max_batch_tokens or int(os.getenv('EMBED_BATCH_TOKENS', 4096))
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.cache = cache  # 可选的 EmbeddingCache，按 (模型, 文本) 缓存向量
     
     def __call__(self, text):
         """使类实例可调用，用于兼容 FAISS 的接口"""
@@ -30,56 +76,212 @@ class ArkEmbeddings:
             return self.embed_documents(text)
         else:
             raise ValueError(f"Unsupported input type: {type(text)}")
+
+    def _make_batches(self, texts):
+        """按条数和估计 token 数切分批次，返回 [(起始下标, 文本列表)]"""
+        batches = []
+        start, batch_tokens = 0, 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if i > start and (i - start >= self.max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append((start, texts[start:i]))
+                start, batch_tokens = i, 0
+            batch_tokens += tokens
+        if start < len(texts):
+            batches.append((start, texts[start:]))
+        return batches
+
+    def _retry_delay(self, error, attempt):
+        """计算重试等待时间，优先使用服务端返回的 Retry-After"""
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # 指数退避加随机抖动，避免并发请求同时重试
+        return min(self.max_backoff, self.base_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _create_embeddings(self, batch_texts):
+        """请求一批向量，遇到限流、超时等错误时退避重试"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.timer('embed_request'):
+                    response = self.client.embeddings.create(
+                        model=self.model,
+                        input=batch_texts,
+                        encoding_format="float"
+                    )
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"向量请求失败 ({type(e).__name__})，{delay:.1f} 秒后第 {attempt + 1} 次重试")
+                time.sleep(delay)
     
-    def embed_documents(self, texts):
-        """将文档转换为向量"""
-        print(f"\n正在生成 {len(texts)} 个文档的向量...")
-        # 分批处理，每批最多 10 个文档
-        batch_size = 10
-        all_embeddings = []
-        
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            print(f"处理第 {i//batch_size + 1} 批，共 {len(batch_texts)} 个文档")
-            
+    async def _acreate_embeddings(self, batch_texts):
+        """_create_embeddings 的异步版本，等待和重试都不阻塞事件循环"""
+        if self._async_client is None:
+            self._async_client = ark_async_client(**self._client_kwargs)
+        for attempt in range(self.max_retries + 1):
             try:
-                response = self.client.embeddings.create(
-                    model="ep-20250227223958-wb4sk",
-                    input=batch_texts,
-                    encoding_format="float"
-                )
-                batch_embeddings = [embedding.embedding for embedding in response.data]
-                all_embeddings.extend(batch_embeddings)
-            except Exception as e:
-                print(f"处理批次 {i//batch_size + 1} 时出错: {str(e)}")
-                raise
+                with metrics.timer('embed_request'):
+                    response = await self._async_client.embeddings.create(
+                        model=self.model,
+                        input=batch_texts,
+                        encoding_format="float"
+                    )
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(e, attempt))
+
+    def embed_documents(self, texts):
+        """将文档转换为向量，先查缓存，只为未命中且去重后的文本请求接口"""
+        texts = list(texts)
+        if self.cache is None:
+            return self._embed_uncached(texts)
+
+        vectors = self.cache.get_many(self.model, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        print(f"向量缓存命中 {len(texts) - sum(v is None for v in vectors)}/{len(texts)}")
+        if missing:
+            computed = dict(zip(missing, self._embed_uncached(missing)))
+            self.cache.put_many(self.model, missing, [computed[text] for text in missing])
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def _embed_uncached(self, texts):
+        """多批并发请求向量接口，结果保持输入顺序"""
+        batches = self._make_batches(texts)
+        print(f"\n正在生成 {len(texts)} 个文档的向量，共 {len(batches)} 批，并发 {self.max_concurrency}...")
+        all_embeddings = [None] * len(texts)
+
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            for i, (start, batch_texts) in enumerate(batches):
+                try:
+                    all_embeddings[start:start + len(batch_texts)] = self._create_embeddings(batch_texts)
+                except Exception as e:
+                    print(f"处理批次 {i + 1} 时出错: {str(e)}")
+                    raise
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                futures = {
+                    executor.submit(self._create_embeddings, batch_texts): (i, start, batch_texts)
+                    for i, (start, batch_texts) in enumerate(batches)
+                }
+                for future in as_completed(futures):
+                    i, start, batch_texts = futures[future]
+                    try:
+                        all_embeddings[start:start + len(batch_texts)] = future.result()
+                    except Exception as e:
+                        print(f"处理批次 {i + 1} 时出错: {str(e)}")
+                        for pending in futures:
+                            pending.cancel()
+                        raise
         
         print(f"向量生成完成，共 {len(all_embeddings)} 个向量")
         return all_embeddings
     
     def embed_query(self, text):
         """将查询转换为向量"""
-        response = self.client.embeddings.create(
-            model="ep-20250227223958-wb4sk",
-            input=[text],
-            encoding_format="float"
-        )
-        return response.data[0].embedding
+        if self.cache is not None:
+            cached = self.cache.get_many(self.model, [text])[0]
+            if cached is not None:
+                return cached
+        vector = self._create_embeddings([text])[0]
+        if self.cache is not None:
+            self.cache.put_many(self.model, [text], [vector])
+        return vector
+
+    async def aembed_query(self, text):
+        """embed_query 的异步版本
+
+        向量缓存的读写是同步的 SQLite 操作（命中时还要更新使用时间，写入时可能淘汰），
+        并且与入库线程的批量写入共用一把锁，所以放到线程中执行，不阻塞事件循环。
+        """
+        if self.cache is not None:
+            cached = (await asyncio.to_thread(self.cache.get_many, self.model, [text]))[0]
+            if cached is not None:
+                return cached
+        vector = (await self._acreate_embeddings([text]))[0]
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_many, self.model, [text], [vector])
+        return vector
+
+# 检索方式：dense 向量检索；lexical 只用 BM25 关键词检索，不请求向量接口；hybrid 两者按倒数排名融合
+SEARCH_MODES = ('dense', 'hybrid', 'lexical')
+
+
+class IndexSnapshot(namedtuple('IndexSnapshot', ['version', 'vector_store', 'lexical_index'])):
+    """某个版本的只读索引，发布后不再修改；检索请求取一次快照后全程使用它"""
+    __slots__ = ()
+
 
 class DocumentStore:
-    def __init__(self):
+    def __init__(self, ingest_workers=None, index_spec=None, search_params=None, search_mode=None):
         self.embeddings = ArkEmbeddings(
             api_key=os.getenv('ARK_API_KEY'),
-            base_url="https://ark.cn-beijing.volces.com/api/v3"
+            base_url=ARK_BASE_URL,
+            cache=self._create_embedding_cache()
         )
-        self.vector_store = None
         self.index_dir = Path("faiss_index")  # 索引存储目录
+        # 版本化的索引目录，更新时写出新版本再原子切换，见 index_storage.IndexDirectory
+        self.index_directory = IndexDirectory(self.index_dir, int(os.getenv('INDEX_KEEP_VERSIONS', 2)))
+        # 当前快照，只整体替换、不原地修改，读者无需加锁
+        self._snapshot = IndexSnapshot(0, None, None)
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # 其他进程（gunicorn 的其他 worker）发布新版本后，最多这么久会被本进程发现
+        self.refresh_interval = float(os.getenv('INDEX_REFRESH_INTERVAL', 1.0))
+        self._last_refresh_check = 0.0
+        # 以下记录只由持有写锁的入库线程读写，对应 _metadata_version 版本
         self.file_hashes = {}  # 文件路径到哈希的映射
-        
-        # 加载已有索引
+        self.file_chunks = {}  # 文件路径到向量块 ID 列表的映射
+        self.file_stats = {}  # 文件路径到 {mtime_ns, size} 的映射，用于跳过哈希计算
+        # 没有发布新版本时更新的文件状态写在这里（版本目录发布后不再修改），格式为 {version, stats}
+        self._stats_hint_path = self.index_dir / "file_stats.hint.json"
+        self._metadata_version = None
+        self.ingest_workers = ingest_workers  # 解析进程数，None 表示使用 INGEST_WORKERS 或 CPU 核数
+        # 索引类型（faiss index_factory 描述：Flat、HNSW32、IVF1024,Flat、IVF1024,PQ32、紧凑模式 SQ8 / SQfp16 等）和检索参数
+        self.index_spec = index_spec or os.getenv('INDEX_SPEC', 'Flat')
+        self.search_params = search_params or parse_search_params(os.getenv('INDEX_SEARCH_PARAMS'))
+        cache_size = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+        cache_ttl = float(os.getenv('QUERY_CACHE_TTL', 600))
+        self.query_embedding_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)  # 查询 -> 向量
+        self.search_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)  # (查询, k, 检索方式, 索引版本) -> 检索结果
+        self.search_mode = search_mode or os.getenv('SEARCH_MODE', 'dense')
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索方式: {self.search_mode}")
+        # 混合检索时向量和关键词各取多少个候选参与融合
+        self.hybrid_candidates = int(os.getenv('HYBRID_CANDIDATES', 20))
+
         self.index_dir.mkdir(exist_ok=True)
-        self._load_existing_hashes()
-        
+
+    @property
+    def vector_store(self):
+        return self._snapshot.vector_store
+
+    @property
+    def index_version(self):
+        """索引版本号，每发布一个新版本加一，检索结果缓存以它为键的一部分"""
+        return self._snapshot.version
+
+    @staticmethod
+    def _create_embedding_cache():
+        """创建向量缓存，EMBEDDING_CACHE_MAX_MB=0 时禁用
+
+        缓存放在索引目录之外，clear() 之后仍然有效。
+        """
+        max_mb = float(os.getenv('EMBEDDING_CACHE_MAX_MB', 512))
+        if max_mb <= 0:
+            return None
+        path = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache/embeddings.sqlite')
+        return EmbeddingCache(path, max_bytes=int(max_mb * 1024 * 1024))
+
     def _file_hash(self, file_path):
         """计算文件的 SHA256 哈希"""
         hash_sha256 = hashlib.sha256()
@@ -88,112 +290,427 @@ class DocumentStore:
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()
 
-    def _load_existing_hashes(self):
-        """加载已有的哈希记录"""
-        hash_file = self.index_dir / "file_hashes.json"
-        if hash_file.exists():
-            with open(hash_file) as f:
-                self.file_hashes = json.load(f)
+    @staticmethod
+    def _read_json(path):
+        if path.exists():
+            with open(path) as f:
+                return json.load(f)
+        return {}
 
-    def _save_hashes(self):
-        """保存哈希记录"""
-        hash_file = self.index_dir / "file_hashes.json"
-        with open(hash_file, "w") as f:
-            json.dump(self.file_hashes, f)
+    @staticmethod
+    def _write_json(path, data):
+        """先写临时文件再替换，避免留下写了一半的文件"""
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
 
-    def load_documents(self, directory_path):
-        print(f"\n文档处理步骤:")
-        print(f"1. 加载目录: {directory_path}")
-        
-        # 加载文档
-        loaders = {
-            '**/*.txt': TextLoader,
-            '**/*.pdf': PyPDFLoader,
-            '**/*.doc': UnstructuredWordDocumentLoader,
-            '**/*.docx': UnstructuredWordDocumentLoader,
-            '**/*.md': UnstructuredMarkdownLoader,
-        }
-        documents = []
-        has_changes = False
-        
-        for glob_pattern, loader_cls in loaders.items():
-            try:
-                loader = DirectoryLoader(
-                    directory_path,
-                    glob=glob_pattern,
-                    loader_cls=loader_cls
-                )
-                docs = loader.load()
-                if docs:
-                    # 计算文件哈希
-                    for doc in docs:
-                        file_path = doc.metadata['source']
-                        current_hash = self._file_hash(file_path)
-                        
-                        # 检查哈希是否变化
-                        if self.file_hashes.get(file_path) != current_hash:
-                            has_changes = True
-                            self.file_hashes[file_path] = current_hash
-                            documents.append(doc)
-                        else:
-                            print(f"文件未修改: {file_path}")
-            except Exception as e:
-                print(f"加载 {glob_pattern} 文件时出错: {str(e)}")
+    def _load_metadata(self, version):
+        """加载某个版本的文件记录（哈希、向量块 ID、文件状态）"""
+        path = self.index_directory.version_path(version) if version else None
+        self.file_hashes = self._read_json(path / "file_hashes.json") if path else {}
+        self.file_chunks = self._read_json(path / "file_chunks.json") if path else {}
+        self.file_stats = self._read_json(path / "file_stats.json") if path else {}
+        # 发布之后才更新的文件状态保存在版本目录之外，只在对应版本上使用
+        hint = self._read_json(self._stats_hint_path)
+        if version and hint.get('version') == version:
+            self.file_stats = hint['stats']
+        self._metadata_version = version
+
+    def _save_metadata(self, path):
+        """把文件记录写入版本目录"""
+        self._write_json(path / "file_hashes.json", self.file_hashes)
+        self._write_json(path / "file_chunks.json", self.file_chunks)
+        self._write_json(path / "file_stats.json", self.file_stats)
+
+    def _rebuild_file_chunks(self, vector_store):
+        """从已有索引的元数据重建文件到向量块 ID 的映射（兼容旧索引）"""
+        self.file_chunks = {}
+        for doc_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(doc_id)
+            source = doc.metadata.get('source')
+            if source:
+                self.file_chunks.setdefault(source, []).append(doc_id)
+
+    def _migrate_layout(self):
+        """把旧的 faiss_index/current_index + 根目录 JSON 布局迁移为第一个版本目录
+
+        调用方需持有写锁。旧的 pickle 格式会先转换为内存映射格式。
+        """
+        legacy_path = self.index_dir / "current_index"
+        if self.index_directory.current_version() is not None or not legacy_path.exists():
+            return
+        if is_legacy_index(legacy_path):
+            migrate_legacy_index(legacy_path, self.embeddings)
+            print(f"已将旧格式的向量索引转换为新格式: {legacy_path}")
+        self.file_hashes = self._read_json(self.index_dir / "file_hashes.json")
+        self.file_chunks = self._read_json(self.index_dir / "file_chunks.json")
+        self.file_stats = self._read_json(self.index_dir / "file_stats.json")
+        legacy_store = load_index(legacy_path, self.embeddings)
+        if not self.file_chunks:
+            self._rebuild_file_chunks(legacy_store)
+
+        def write(path):
+            write_lexical_index(path, (doc.page_content for _, _, doc in legacy_store.docstore.all_documents()))
+            self._save_metadata(path)
+
+        version = self.index_directory.publish(write, prepared_path=legacy_path)
+        for name in ("file_hashes.json", "file_chunks.json", "file_stats.json"):
+            (self.index_dir / name).unlink(missing_ok=True)
+        self._metadata_version = version
+        print(f"已迁移为版本化索引目录: {self.index_directory.version_path(version)}")
+
+    def _open_version(self, version):
+        """打开某个版本的索引，返回快照；该版本没有索引（例如清空后）时 vector_store 为 None"""
+        path = self.index_directory.version_path(version)
+        if not (path / "meta.json").exists():
+            return IndexSnapshot(version, None, None)
+        with metrics.timer('index_load'):
+            return IndexSnapshot(version, load_index(path, self.embeddings, self.search_params),
+                                 LexicalIndex.load(path))
+
+    def _swap_snapshot(self, snapshot):
+        """切换到新快照；只会前进，较慢的加载不会用旧版本覆盖新版本"""
+        with self._swap_lock:
+            if snapshot.version <= self._snapshot.version:
+                return False
+            self._snapshot = snapshot
+        # 新版本的检索结果使用新的缓存键，这里清空只是为了释放旧结果（查询向量与索引无关，继续保留）
+        self.search_cache.clear()
+        return True
+
+    def _sync_with_disk(self):
+        """持有写锁时调用：磁盘上有更新的版本（其他进程写入的）时加载它和对应的文件记录"""
+        self._migrate_layout()
+        version = self.index_directory.current_version()
+        if version is None:
+            if self._metadata_version is not None:
+                self._load_metadata(None)
+            return
+        if version > self._snapshot.version:
+            self._swap_snapshot(self._open_version(version))
+        if self._metadata_version != version:
+            self._load_metadata(version)
+
+    def load_existing_index(self):
+        """服务启动时加载磁盘上已有的索引，返回是否有可用索引"""
+        with self.index_directory.write_lock():
+            self._sync_with_disk()
+        if self.vector_store is not None:
+            print(f"已加载缓存的向量索引: {self.index_directory.version_path(self.index_version)}")
+        return self.vector_store is not None
+
+    def _maybe_refresh(self):
+        """检查其他进程是否发布了新版本，检查间隔为 refresh_interval；不阻塞检索"""
+        now = time.monotonic()
+        if now - self._last_refresh_check < self.refresh_interval:
+            return
+        self._last_refresh_check = now
+        version = self.index_directory.current_version()
+        if version is None or version <= self._snapshot.version:
+            return
+        # 已经有线程在加载新版本时直接返回，本次检索继续使用当前快照
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            if self._swap_snapshot(self._open_version(version)):
+                print(f"已切换到新版本索引: {self.index_directory.version_path(version)}")
+        except (FileNotFoundError, sqlite3.OperationalError):
+            # 该版本在加载过程中已被更新的版本替换并清理，下次检查时加载最新版本
+            self._last_refresh_check = 0.0
+        finally:
+            self._reload_lock.release()
+
+    def snapshot(self):
+        """返回当前索引快照，检索时取一次并全程使用，期间的索引切换不影响本次检索"""
+        self._maybe_refresh()
+        return self._snapshot
+
+    async def asnapshot(self):
+        """snapshot 的异步版本：需要检查新版本时放到线程中执行，加载新版本索引不阻塞事件循环"""
+        if time.monotonic() - self._last_refresh_check < self.refresh_interval:
+            return self._snapshot
+        return await asyncio.to_thread(self.snapshot)
+
+    def _scan_directory(self, directory_path):
+        """扫描目录找出新增或修改的文件，只读取文件状态和哈希，不解析文件内容
+
+        文件大小和修改时间都与记录一致时直接跳过，连哈希也不计算。
+        返回 (changed_files, present_files)，changed_files 为 {路径: (哈希, 文件状态)}。
+        """
+        root = Path(directory_path)
+        changed_files = {}
+        present_files = set()
+        for item in sorted(root.rglob("*")):
+            if item.suffix.lower() not in LOADERS or not item.is_file():
                 continue
-        
-        if not documents:
+            if any(part.startswith('.') for part in item.relative_to(root).parts):
+                continue
+            file_path = str(item)
+            present_files.add(file_path)
+            stat = item.stat()
+            file_stat = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+            indexed = file_path in self.file_hashes and file_path in self.file_chunks
+            if indexed and self.file_stats.get(file_path) == file_stat:
+                continue
+            current_hash = self._file_hash(file_path)
+            if indexed and self.file_hashes[file_path] == current_hash:
+                # 内容没变（例如只是 touch 了一下），更新状态记录即可
+                self.file_stats[file_path] = file_stat
+                continue
+            changed_files[file_path] = (current_hash, file_stat)
+        return changed_files, present_files
+
+    def load_documents(self, directory_path, progress=None):
+        """增量更新索引，在旁边构建新版本，完成后原子切换；检索全程使用旧版本
+
+        progress(stage, **counts) 在每个阶段完成后调用，用于上报入库进度，
+        stage 依次为 scanned、parsed、chunked、embedded、persisted。
+        """
+        with self.index_directory.write_lock(), metrics.timer('ingest_total'):
+            return self._load_documents(directory_path, progress or (lambda stage, **counts: None))
+
+    def _load_documents(self, directory_path, report):
+        print(f"\n文档处理步骤:")
+        print(f"1. 扫描目录: {directory_path}")
+
+        self._sync_with_disk()
+
+        # 先按文件状态和哈希找出变化，只有新增或修改的文件才会被解析
+        with metrics.timer('ingest_scan'):
+            changed_files, present_files = self._scan_directory(directory_path)
+        if not present_files:
             raise ValueError("没有成功加载任何文档")
-        
-        # 如果有文件变化才重新生成索引
-        if has_changes:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
-            texts = text_splitter.split_documents(documents)
-            
-            # 创建并保存向量存储
-            self.vector_store = FAISS.from_documents(texts, self.embeddings)
-            self._save_vector_store()
-            self._save_hashes()
-        else:
-            # 加载已有索引
-            self._load_vector_store()
-        
+        removed_files = [p for p in self.file_chunks if p not in present_files and not Path(p).exists()]
+        print(f"2. 变化统计: 未修改 {len(present_files) - len(changed_files)} 个文件, "
+              f"新增/修改 {len(changed_files)} 个文件, 删除 {len(removed_files)} 个文件")
+        report('scanned', files_total=len(changed_files))
+
+        if not changed_files and not removed_files:
+            # 文件状态只是跳过哈希计算的提示，不必为它发布新版本，写到版本目录之外
+            if self._metadata_version is not None:
+                self._write_json(self._stats_hint_path,
+                                 {'version': self._metadata_version, 'stats': self.file_stats})
+            report('persisted', persisted=True)
+            print("4. 向量存储处理完成\n")
+            return True
+
+        # 在临时目录中写出新版本，检索请求在此期间继续使用当前快照
+        builder = self._open_builder()
+        try:
+            self._apply_changes(builder, changed_files, removed_files, report)
+            self._publish(builder)
+        except BaseException:
+            builder.abort()
+            raise
+        report('persisted', persisted=True)
+
         print("4. 向量存储处理完成\n")
         return True
 
-    def _save_vector_store(self):
-        """保存向量存储到磁盘"""
-        if self.vector_store:
-            index_path = self.index_dir / "current_index"
-            self.vector_store.save_local(index_path)
-            print(f"向量索引已保存到: {index_path}")
-
-    def _load_vector_store(self):
-        """从磁盘加载向量存储"""
-        index_path = self.index_dir / "current_index"
-        if index_path.exists():
-            self.vector_store = FAISS.load_local(
-                index_path, 
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
-            print(f"已加载缓存的向量索引: {index_path}")
-        else:
-            raise ValueError("没有找到缓存的向量索引")
+    def _apply_changes(self, builder, changed_files, removed_files, report):
+        """删除已删除文件的向量块，解析、向量化新增或修改的文件并追加到 builder，同时更新文件记录"""
+        # 删除已删除文件的旧向量
+        self._delete_file_chunks(builder, removed_files)
+        for file_path in removed_files:
+            self.file_hashes.pop(file_path, None)
+            self.file_stats.pop(file_path, None)
+
+        # 3. 只解析并索引新增或修改的文件，小文件在进程池中并行解析，大文件流式读取；
+        # 切分出的文本块按窗口立即向量化并追加到索引，不等待整个文件或其他文件
+        files_parsed = files_failed = chunk_count = embedded_count = 0
+        added_ids = {}  # 还没处理完的文件已经追加的向量块 ID
+        for file_path, texts, error, last in iter_file_windows(changed_files, workers=self.ingest_workers):
+            if error is not None:
+                print(f"加载 {file_path} 时出错: {str(error)}")
+                # 撤回该文件已经追加的窗口，保留它原来的向量块
+                partial = added_ids.pop(file_path, None)
+                if partial:
+                    builder.delete(partial)
+                files_failed += 1
+                report('parsed', files_parsed=files_parsed, files_failed=files_failed)
+                continue
+            chunk_count += len(texts)
+            report('chunked', chunks=chunk_count)
+            ids = self._add_chunks(builder, texts)
+            added_ids.setdefault(file_path, []).extend(ids)
+            embedded_count += len(ids)
+            report('embedded', chunks_embedded=embedded_count)
+            if not last:
+                continue
+
+            files_parsed += 1
+            report('parsed', files_parsed=files_parsed, files_failed=files_failed)
+            current_hash, file_stat = changed_files[file_path]
+            # 新的向量块全部追加完成后再删除旧的
+            self._delete_file_chunks(builder, [file_path])
+            ids = added_ids.pop(file_path)
+            self.file_chunks[file_path] = ids
+            self.file_hashes[file_path] = current_hash
+            self.file_stats[file_path] = file_stat
+            print(f"3. 文件已索引: {file_path} ({len(ids)} 个向量块)")
+
+    def _open_builder(self):
+        """在临时目录中以当前版本为基础开始构建新版本，还没有索引时从空索引开始"""
+        base_path = None
+        if self.vector_store is not None:
+            base_path = self.index_directory.version_path(self.index_version)
+        return IndexBuilder(self.index_directory.prepare(), base_path, self.index_spec, self.search_params)
+
+    def _delete_file_chunks(self, builder, file_paths):
+        """从索引中删除指定文件的全部向量块"""
+        stale_ids = [
+            doc_id
+            for file_path in file_paths
+            for doc_id in self.file_chunks.pop(file_path, [])
+        ]
+        if stale_ids:
+            builder.delete(stale_ids)
+            print(f"已删除 {len(stale_ids)} 个旧向量块")
+
+    def _add_chunks(self, builder, texts):
+        """为切分后的文本块生成向量并直接追加到正在构建的索引文件，返回新向量块的 ID"""
+        if not texts:
+            return []
+        contents = [t.page_content for t in texts]
+        ids = [str(uuid.uuid4()) for _ in texts]
+        with metrics.timer('ingest_embed'):
+            embeddings = self.embeddings.embed_documents(contents)
+        builder.add(contents, embeddings, [t.metadata for t in texts], ids)
+        return ids
+
+    def _publish(self, builder):
+        """把索引和文件记录写成新版本并切换过去，builder 为 None 时发布一个空版本"""
+        def write(path):
+            if builder is not None and builder.finish() is not None:
+                write_lexical_index(path, builder.iter_texts())
+            self._save_metadata(path)
+
+        with metrics.timer('index_save'):
+            prepared_path = builder.path if builder is not None else None
+            version = self.index_directory.publish(write, prepared_path=prepared_path)
+        self._metadata_version = version
+        self._swap_snapshot(self._open_version(version))
+        print(f"向量索引已保存到: {self.index_directory.version_path(version)}")
+
+    def embed_query(self, query):
+        """查询向量化，重复的问题直接使用缓存，省去一次网络请求"""
+        embedding = self.query_embedding_cache.get(query)
+        if embedding is None:
+            with metrics.timer('query_embedding'):
+                embedding = self.embeddings.embed_query(query)
+            self.query_embedding_cache.put(query, embedding)
+        return embedding
+
+    async def aembed_query(self, query):
+        """embed_query 的异步版本"""
+        embedding = self.query_embedding_cache.get(query)
+        if embedding is None:
+            with metrics.timer('query_embedding'):
+                embedding = await self.embeddings.aembed_query(query)
+            self.query_embedding_cache.put(query, embedding)
+        return embedding
+
+    def _resolve_mode(self, snapshot, mode):
+        mode = mode or self.search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索方式: {mode}")
+        if mode != 'dense' and snapshot.lexical_index is None:
+            # 迁移前的旧版本没有倒排索引，下次更新索引时才会生成
+            return 'dense'
+        return mode
+
+    def _search_snapshot(self, snapshot, queries, k, mode, embeddings):
+        """在某个快照上检索一批查询，不涉及网络请求；lexical 模式下 embeddings 为 None
+
+        所有查询向量堆成一个矩阵，只调用一次向量索引的 search。
+        """
+        with metrics.timer('index_search'):
+            vector_store = snapshot.vector_store
+            candidates = max(k, self.hybrid_candidates) if mode == 'hybrid' else k
+            dense = None
+            if mode != 'lexical':
+                matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(queries), -1)
+                _, labels = vector_store.index.search(matrix, candidates)
+                dense = [[int(pos) for pos in row if pos >= 0] for row in labels]
+            results = []
+            for i, query in enumerate(queries):
+                if mode == 'dense':
+                    positions = dense[i]
+                else:
+                    lexical = [pos for pos, _ in snapshot.lexical_index.search(query, candidates)]
+                    positions = lexical if mode == 'lexical' else reciprocal_rank_fusion([dense[i], lexical])[:k]
+                results.append([vector_store.docstore.search(vector_store.index_to_docstore_id[pos])
+                                for pos in positions])
+            return results
+
+    def _embed_queries(self, queries):
+        """批量查询向量化：先查缓存，未命中的去重后按 ArkEmbeddings 的批次并发请求"""
+        embeddings = [self.query_embedding_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            for query in missing:
+                self.query_embedding_cache.put(query, computed[query])
+            embeddings = [computed[query] if embedding is None else embedding
+                          for query, embedding in zip(queries, embeddings)]
+        return embeddings
+
+    def search(self, query, k=3, mode=None):
+        """检索最相关的 k 个文本块，mode 为 dense / hybrid / lexical，默认使用 SEARCH_MODE"""
+        snapshot = self.snapshot()
+        if not snapshot.vector_store:
+            return []
+        mode = self._resolve_mode(snapshot, mode)
+        cache_key = (query, k, mode, snapshot.version)
+        docs = self.search_cache.get(cache_key)
+        if docs is None:
+            embeddings = [self.embed_query(query)] if mode != 'lexical' else None
+            docs = self._search_snapshot(snapshot, [query], k, mode, embeddings)[0]
+            self.search_cache.put(cache_key, docs)
+        return list(docs)
+
+    def search_batch(self, queries, k=3, mode=None):
+        """批量检索，返回与 queries 一一对应的结果列表
+
+        未缓存的查询分批向量化，再在同一个快照上用一次矩阵检索完成，
+        比逐条调用 search 少很多网络往返。
+        """
+        queries = list(queries)
+        snapshot = self.snapshot()
+        if not snapshot.vector_store:
+            return [[] for _ in queries]
+        mode = self._resolve_mode(snapshot, mode)
+        results = [self.search_cache.get((query, k, mode, snapshot.version)) for query in queries]
+        pending = list(dict.fromkeys(query for query, docs in zip(queries, results) if docs is None))
+        if pending:
+            embeddings = self._embed_queries(pending) if mode != 'lexical' else None
+            found = dict(zip(pending, self._search_snapshot(snapshot, pending, k, mode, embeddings)))
+            for query, docs in found.items():
+                self.search_cache.put((query, k, mode, snapshot.version), docs)
+            results = [found[query] if docs is None else docs for query, docs in zip(queries, results)]
+        return [list(docs) for docs in results]
 
-    def search(self, query, k=3):
-        if not self.vector_store:
+    async def asearch(self, query, k=3, mode=None):
+        """search 的异步版本：查询向量化不阻塞事件循环，加载新版本和本地检索放到线程池执行"""
+        snapshot = await self.asnapshot()
+        if not snapshot.vector_store:
             return []
-        return self.vector_store.similarity_search(query, k=k)
+        mode = self._resolve_mode(snapshot, mode)
+        cache_key = (query, k, mode, snapshot.version)
+        docs = self.search_cache.get(cache_key)
+        if docs is None:
+            embeddings = [await self.aembed_query(query)] if mode != 'lexical' else None
+            docs = (await asyncio.to_thread(self._search_snapshot, snapshot, [query], k, mode, embeddings))[0]
+            self.search_cache.put(cache_key, docs)
+        return list(docs)
 
     def clear(self):
-        """清空向量存储"""
-        self.vector_store = None
-        # 清空缓存
-        self.file_hashes = {}
-        if self.index_dir.exists():
-            for f in self.index_dir.glob("*"):
-                f.unlink()
-        print("向量存储已清空")
\ No newline at end of file
+        """清空向量存储：发布一个空版本，正在进行的检索继续使用旧快照直到结束"""
+        with self.index_directory.write_lock():
+            self._migrate_layout()
+            self.file_hashes = {}
+            self.file_chunks = {}
+            self.file_stats = {}
+            self._publish(None)
+        print("向量存储已清空")
@@ -0,0 +1,152 @@
+from array import array
+from pathlib import Path
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class EmbeddingCache:
+    """基于 SQLite 的持久化向量缓存
+
+    键为 sha256(模型 ID + 文本)，值为 float32 向量。缓存总大小超过 max_bytes 时
+    按最近使用时间淘汰最旧的条目。
+
+    总大小记在数据库的 cache_meta 表中，与写入、淘汰在同一个事务里更新：gunicorn 的多个 worker
+    共用同一个数据库，进程内各自计数会让每个进程只看到自己写入的部分，总大小可能涨到上限的 worker 数倍。
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn_pid = None
+        self._connection = None
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # 旧版本创建的数据库没有记录总大小，按现有条目计算一次
+        self._conn.execute("""
+            INSERT OR IGNORE INTO cache_meta (key, value)
+            SELECT 'total_bytes', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings
+        """)
+
+    @property
+    def _conn(self):
+        """当前进程的数据库连接；SQLite 连接不能跨 fork 使用，fork 出的 worker 会重新连接"""
+        if self._conn_pid != os.getpid():
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+        return self._connection
+
+    def _total_bytes(self):
+        return self._conn.execute("SELECT value FROM cache_meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _add_total_bytes(self, delta):
+        self._conn.execute("UPDATE cache_meta SET value = value + ? WHERE key = 'total_bytes'", (delta,))
+
+    @staticmethod
+    def _key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, model, texts):
+        """批量查询缓存，未命中的位置返回 None"""
+        keys = [self._key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # SQLite 单条语句的参数个数有限制，分段查询
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [array('f', found[key]).tolist() if key in found else None for key in keys]
+
+    def put_many(self, model, texts, vectors):
+        """批量写入缓存，必要时淘汰旧条目"""
+        now = time.time()
+        rows = [(self._key(model, text), array('f', vector).tobytes(), now) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            # IMMEDIATE：事务开始时就取得写锁，其他进程的写入排在后面，读到的总大小不会过时
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                delta = 0
+                for key, blob, last_used in rows:
+                    old = self._conn.execute("SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)).fetchone()
+                    if old:
+                        delta -= old[0]
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                        (key, blob, last_used)
+                    )
+                    delta += len(blob)
+                self._add_total_bytes(delta)
+                total_bytes = self._total_bytes()
+                if total_bytes > self.max_bytes:
+                    self._evict(total_bytes)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, total_bytes):
+        """淘汰最久未使用的条目，直到总大小降到上限的 90% 以下（在调用方的写事务中执行）"""
+        to_free = total_bytes - self.max_bytes * 0.9
+        victims = []
+        freed = 0
+        cursor = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used, rowid")
+        for key, size in cursor:
+            if freed >= to_free:
+                break
+            victims.append((key,))
+            freed += size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._add_total_bytes(-freed)
+        self.evictions += len(victims)
+
+    def stats(self):
+        """返回命中率等统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self._total_bytes(),
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("UPDATE cache_meta SET value = 0 WHERE key = 'total_bytes'")
+            self._conn.execute("COMMIT")
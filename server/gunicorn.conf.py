@@ -0,0 +1,92 @@
+"""gunicorn 配置
+
+SERVER_MODE=wsgi（默认）: Flask 应用，gthread worker，每个 worker 若干线程
+SERVER_MODE=asgi: asgi_app，uvicorn worker，对话流不占用线程
+
+两种模式都开启 preload_app：索引只在主进程加载一次，fork 后各 worker 共享。
+启动耗时和每个 worker 的内存（RSS / PSS / 共享部分）会打印到日志。
+每个 worker 启动后预先建立一个到模型服务的连接（asgi 模式在 asgi_app 的 lifespan 中进行）。
+各进程的阶段耗时统计写入 METRICS_DIR（未设置时每次启动新建一个临时目录），/metrics 汇总所有 worker。
+"""
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_boot_started = time.perf_counter()
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+# 配置文件在预加载应用之前执行，这里设置的环境变量 metrics 模块导入时就能读到；
+# 上一次运行留下的统计文件先清掉，否则会计入本次的数据
+if os.getenv('METRICS_DIR'):
+    for _stale in Path(os.environ['METRICS_DIR']).glob('*.json'):
+        _stale.unlink(missing_ok=True)
+else:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='rag-metrics-')
+
+bind = os.getenv('BIND', f"127.0.0.1:{os.getenv('PORT', '5001')}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+preload_app = True
+# 对话流可能持续很久，这里只用于检测卡死的 worker
+timeout = int(os.getenv('WORKER_TIMEOUT', 300))
+graceful_timeout = 30
+keepalive = 5
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'asgi_app:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'wsgi:app'
+    worker_class = 'gthread'
+    threads = int(os.getenv('WORKER_THREADS', 16))
+
+
+def _memory_mb():
+    """读取当前进程的 RSS、PSS 和共享内存（MB），PSS 按共享进程数分摊，更能反映真实占用"""
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty'):
+                    usage[key] = int(value.split()[0]) / 1024
+    except OSError:
+        # 非 Linux 系统只能拿到峰值 RSS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage['Rss'] = maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return usage
+
+
+def _format_memory(usage):
+    parts = [f"RSS {usage['Rss']:.1f} MB"]
+    if 'Pss' in usage:
+        shared = usage.get('Shared_Clean', 0) + usage.get('Shared_Dirty', 0)
+        parts.append(f"PSS {usage['Pss']:.1f} MB")
+        parts.append(f"共享 {shared:.1f} MB")
+    return ", ".join(parts)
+
+
+def when_ready(server):
+    server.log.info(
+        f"应用预加载完成 ({SERVER_MODE})，启动耗时 {time.perf_counter() - _boot_started:.2f} 秒，"
+        f"主进程内存: {_format_memory(_memory_mb())}"
+    )
+
+
+def pre_fork(server, worker):
+    # 把预加载阶段创建的对象移出 GC 跟踪，避免 worker 里的垃圾回收改写这些内存页、破坏共享
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    if SERVER_MODE != 'asgi':
+        # 连接池按进程创建，fork 之后在 worker 里预热，第一个请求不必等待 TCP 和 TLS 握手
+        from document_store import ARK_BASE_URL
+        from http_pool import ark_pool
+        ark_pool.warm_up(ARK_BASE_URL)
+    worker.log.info(f"worker {worker.pid} 已就绪，内存: {_format_memory(_memory_mb())}")
@@ -0,0 +1,272 @@
+"""Ark 接口共用的 HTTP 连接池
+
+向量接口（ArkEmbeddings）和对话接口（app.py / asgi_app.py）请求的是同一个 Ark 服务，
+这里为它们提供同一个进程内的连接池：长连接复用、可选 HTTP/2 多路复用，省掉每次请求的
+TCP 和 TLS 握手。连接池大小、空闲连接保持时间和各类超时都可以配置：
+
+ARK_MAX_CONNECTIONS     最多同时打开的连接数（默认 100）
+ARK_MAX_KEEPALIVE       最多保持的空闲连接数（默认 20）
+ARK_KEEPALIVE_EXPIRY    空闲连接保持的秒数（默认 60）
+ARK_HTTP2               是否启用 HTTP/2（默认开启，需要安装 h2，即 pip install "httpx[http2]"）
+ARK_CONNECT_TIMEOUT     建立连接的超时秒数（默认 5）
+ARK_POOL_TIMEOUT        连接池已满时等待空闲连接的秒数（默认 10）
+ARK_EMBED_TIMEOUT       向量请求的读写超时秒数（默认 30）
+ARK_CHAT_TIMEOUT        对话请求的读写超时秒数，流式输出时为两段数据之间的最长间隔（默认 120）
+ARK_CHAT_MAX_RETRIES    对话请求的重试次数（默认 2；向量请求的重试由 ArkEmbeddings 自己处理）
+
+gunicorn 预加载应用后 fork 出的 worker 不会沿用主进程的连接：底层连接池按进程
+（异步连接池再按事件循环）在第一次请求时创建。worker 启动时（gunicorn.conf.py 的
+post_worker_init、asgi_app 的 lifespan）预先建立连接；空闲连接过期后，对话请求开始时
+发现没有空闲连接，会在检索期间再次预热。
+"""
+import asyncio
+import os
+import threading
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+EMBED_TIMEOUT = float(os.getenv('ARK_EMBED_TIMEOUT', 30))
+CHAT_TIMEOUT = float(os.getenv('ARK_CHAT_TIMEOUT', 120))
+CHAT_MAX_RETRIES = int(os.getenv('ARK_CHAT_MAX_RETRIES', 2))
+
+
+class _PooledTransport(httpx.BaseTransport):
+    """同步请求的传输层，每个进程使用自己的底层连接池"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._transport = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # 从父进程继承的连接直接丢弃，不能关闭：关闭会影响父进程仍在使用的连接
+                    self._transport = httpx.HTTPTransport(limits=self._pool.limits, http2=self._pool.http2)
+                    self._pid = os.getpid()
+        return self._transport
+
+    def handle_request(self, request):
+        self._pool.record_request()
+        request.extensions['trace'] = self._pool.trace
+        return self.current().handle_request(request)
+
+    def close(self):
+        # 连接池由所有客户端共用，单个客户端关闭时不关闭连接池，见 HTTPPool.close
+        pass
+
+    def close_pool(self):
+        if self._transport is not None and self._pid == os.getpid():
+            self._transport.close()
+            self._transport, self._pid = None, None
+
+
+class _AsyncPooledTransport(httpx.AsyncBaseTransport):
+    """异步请求的传输层，每个进程、每个事件循环使用自己的底层连接池"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._transport = None
+        self._owner = None
+
+    def current(self):
+        owner = (os.getpid(), asyncio.get_running_loop())
+        if self._owner != owner:
+            self._transport = httpx.AsyncHTTPTransport(limits=self._pool.limits, http2=self._pool.http2)
+            self._owner = owner
+        return self._transport
+
+    async def handle_async_request(self, request):
+        self._pool.record_request()
+        request.extensions['trace'] = self._pool.atrace
+        return await self.current().handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+    async def aclose_pool(self):
+        if self._transport is not None and self._owner == (os.getpid(), asyncio.get_running_loop()):
+            await self._transport.aclose()
+            self._transport, self._owner = None, None
+
+
+class HTTPPool:
+    """一组同步、异步 httpx 客户端及其连接池统计"""
+
+    def __init__(self, max_connections=None, max_keepalive=None, keepalive_expiry=None, http2=None,
+                 connect_timeout=None, pool_timeout=None):
+        self.max_connections = max_connections or int(os.getenv('ARK_MAX_CONNECTIONS', 100))
+        self.max_keepalive = max_keepalive or int(os.getenv('ARK_MAX_KEEPALIVE', 20))
+        self.keepalive_expiry = keepalive_expiry or float(os.getenv('ARK_KEEPALIVE_EXPIRY', 60))
+        self.connect_timeout = connect_timeout or float(os.getenv('ARK_CONNECT_TIMEOUT', 5))
+        self.pool_timeout = pool_timeout or float(os.getenv('ARK_POOL_TIMEOUT', 10))
+        http2 = _env_flag('ARK_HTTP2', '1') if http2 is None else http2
+        if http2 and not _http2_available():
+            print('未安装 h2，Ark 连接池使用 HTTP/1.1（pip install "httpx[http2]" 以启用 HTTP/2）')
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        self._sync_transport = _PooledTransport(self)
+        self._async_transport = _AsyncPooledTransport(self)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.connect_failures = 0
+        self.warm_ups = 0
+        self._sync_warming = threading.Lock()
+        self._async_warming = False
+
+    def timeout(self, read_timeout):
+        """连接和等待连接池的超时使用连接池的配置，读写超时按调用方的需要设置"""
+        return httpx.Timeout(read_timeout, connect=self.connect_timeout, pool=self.pool_timeout)
+
+    def client(self, timeout):
+        """返回共用连接池的同步客户端；客户端本身很轻，连接池在所有客户端之间共享"""
+        return httpx.Client(transport=self._sync_transport, timeout=self.timeout(timeout))
+
+    def async_client(self, timeout):
+        return httpx.AsyncClient(transport=self._async_transport, timeout=self.timeout(timeout))
+
+    def close(self):
+        """关闭当前进程的同步连接池，下次请求时重新建立"""
+        self._sync_transport.close_pool()
+
+    async def aclose(self):
+        """关闭当前事件循环的异步连接池"""
+        await self._async_transport.aclose_pool()
+
+    def _idle_connections(self, transport):
+        return self._connection_counts(transport)[1] if transport is not None else 0
+
+    def _record_warm_up(self):
+        with self._lock:
+            self.warm_ups += 1
+
+    def warm_up(self, url):
+        """当前进程没有空闲连接时，在后台线程中向 url 发一个请求，提前完成 TCP 和 TLS 握手
+
+        只是为了让随后的请求直接复用连接，响应和错误都忽略；同一时间最多一个预热请求。
+        """
+        sync = self._sync_transport
+        if self._idle_connections(sync._transport if sync._pid == os.getpid() else None):
+            return
+        if not self._sync_warming.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._record_warm_up()
+                with httpx.Client(transport=sync, timeout=self.timeout(self.connect_timeout)) as client:
+                    client.get(url)
+            except httpx.HTTPError:
+                pass
+            finally:
+                self._sync_warming.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    async def awarm_up(self, url):
+        """warm_up 的异步版本，在当前事件循环的连接池中预先建立连接"""
+        transport = self._async_transport
+        owner = (os.getpid(), asyncio.get_running_loop())
+        if self._idle_connections(transport._transport if transport._owner == owner else None):
+            return
+        if self._async_warming:
+            return
+        self._async_warming = True
+        try:
+            self._record_warm_up()
+            async with httpx.AsyncClient(transport=transport, timeout=self.timeout(self.connect_timeout)) as client:
+                await client.get(url)
+        except httpx.HTTPError:
+            pass
+        finally:
+            self._async_warming = False
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def trace(self, name, info):
+        """httpcore 的 trace 回调，只统计建立连接和 TLS 握手"""
+        if name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.connections_opened += 1
+        elif name == 'connection.start_tls.complete':
+            with self._lock:
+                self.tls_handshakes += 1
+        elif name == 'connection.connect_tcp.failed':
+            with self._lock:
+                self.connect_failures += 1
+
+    async def atrace(self, name, info):
+        self.trace(name, info)
+
+    @staticmethod
+    def _connection_counts(transport):
+        connections = getattr(getattr(transport, '_pool', None), 'connections', None) or []
+        return len(connections), sum(1 for connection in connections if connection.is_idle())
+
+    def stats(self):
+        """连接池统计：请求数、新建连接数、复用率，以及当前进程中打开和空闲的连接数"""
+        open_connections = idle_connections = 0
+        transports = [self._sync_transport._transport if self._sync_transport._pid == os.getpid() else None,
+                      self._async_transport._transport]
+        for transport in transports:
+            if transport is not None:
+                opened, idle = self._connection_counts(transport)
+                open_connections += opened
+                idle_connections += idle
+        with self._lock:
+            return {
+                'http2': self.http2,
+                'max_connections': self.max_connections,
+                'max_keepalive': self.max_keepalive,
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'tls_handshakes': self.tls_handshakes,
+                'connect_failures': self.connect_failures,
+                'warm_ups': self.warm_ups,
+                'reuse_rate': 1 - self.connections_opened / self.requests if self.requests else 0.0,
+                'open_connections': open_connections,
+                'idle_connections': idle_connections,
+            }
+
+
+# 进程内共用的 Ark 连接池
+ark_pool = HTTPPool()
+
+
+def ark_client(api_key, base_url, timeout=CHAT_TIMEOUT, max_retries=CHAT_MAX_RETRIES, pool=None):
+    """创建使用共用连接池的 OpenAI 客户端"""
+    pool = pool or ark_pool
+    return OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                  timeout=pool.timeout(timeout), http_client=pool.client(timeout))
+
+
+def ark_async_client(api_key, base_url, timeout=CHAT_TIMEOUT, max_retries=CHAT_MAX_RETRIES, pool=None):
+    """创建使用共用连接池的 AsyncOpenAI 客户端"""
+    pool = pool or ark_pool
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                       timeout=pool.timeout(timeout), http_client=pool.async_client(timeout))
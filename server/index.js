@@ -95,7 +95,7 @@ app.post('/upload', upload.array('documents'), async (req, res) => {
       });
     });
     
-    res.json(response.data);
+    res.status(response.status).json(response.data);
   } catch (error) {
     console.error('上传失败:', error);
     console.error('错误详情:', {
@@ -115,6 +115,16 @@ app.post('/upload', upload.array('documents'), async (req, res) => {
   }
 });
 
+// 转发入库任务状态查询
+app.get('/api/jobs/:jobId', async (req, res) => {
+  try {
+    const response = await axios.get(`${RAG_SERVICE_URL}/api/jobs/${encodeURIComponent(req.params.jobId)}`);
+    res.json(response.data);
+  } catch (error) {
+    res.status(error.response?.status || 500).json(error.response?.data || { error: '查询任务状态失败' });
+  }
+});
+
 const MAX_RETRIES = 3;
 const RETRY_DELAY = 1000; // 1秒
 
@@ -0,0 +1,867 @@
+"""向量索引的磁盘格式
+
+faiss_index/
+    CURRENT          当前版本号，写入临时文件后用 os.replace 原子替换
+    v00000012/       每个版本一个完整目录，写好之后才改名为正式名称，发布后不再修改
+    .write.lock      写入者之间的文件锁，多个 gunicorn worker 同时入库时排队
+    .tmp-build-<pid> 入库时正在构建的新版本（IndexBuilder），每个窗口的向量和文本块直接追加写入，写完后改名发布
+
+每个版本目录:
+    meta.json        格式版本、维度和向量数
+    vectors.f32      N×d 的 float32 原始向量（按行存储），加载时用 np.memmap 只读映射
+    norms.f32        每个向量的 L2 范数平方，计算 L2 距离时使用
+    docstore.sqlite  文本块内容和元数据，检索命中时按 ID 读取；pos 列即向量所在行号
+    ann.faiss        可选的近似最近邻索引（HNSW / IVF / PQ / SQ，faiss index_factory 描述），
+                     保存时由原始向量训练并构建，加载时以 IO_FLAG_MMAP 只读打开
+    ann_map.i64      可选，ann.faiss 沿用自之前的版本时，每个近似索引标签对应的当前行号（已删除为 -1）
+
+增量更新不必每次重建近似索引：沿用上一个版本的 ann.faiss（硬链接），只记录标签到行号的映射，
+之后追加的行（meta.json 中 ann_prefix 之后的行）检索时精确计算，两部分的候选合并后按精确距离排序。
+已删除的标签和追加的行合计超过总行数的 INDEX_ANN_REBUILD_RATIO（默认 0.1）或 index_spec 改变时，
+才用全部向量重新构建（复用已训练的参数，不重新训练）。
+
+紧凑模式：INDEX_SPEC=SQ8（int8，每维 1 字节）或 SQfp16（每维 2 字节），也可以与 IVF / HNSW 组合
+（IVF1024,SQ8、HNSW32_SQ8）。粗排只扫描 ann.faiss 中的量化编码，常驻内存约为 float32 的 1/4 或 1/2；
+再从 vectors.f32 中只读取前 k×rescore 个候选行，用精确 L2 距离重新排序（MmapFlatIndex.rescore）。
+SQ / PQ 索引默认 rescore=4，可以用 INDEX_SEARCH_PARAMS="rescore=8" 调整，rescore=1 表示不重排。
+
+    file_hashes.json / file_chunks.json / file_stats.json  与该版本对应的文件记录
+
+加载时不反序列化 pickle，也不把向量读入内存，启动耗时与语料规模基本无关；
+多个 worker 映射同一个文件时共享操作系统的页缓存。
+"""
+from collections.abc import Mapping
+from pathlib import Path
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只做进程内互斥
+    fcntl = None
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+FORMAT_VERSION = 1
+
+# 精确检索时每次参与计算的向量行数，限制中间结果的内存占用
+SEARCH_BLOCK_ROWS = 65536
+# 批量查询时每组的查询条数
+SEARCH_QUERY_ROWS = 256
+
+# 近似索引的默认检索参数，只对支持该参数的索引类型生效
+DEFAULT_SEARCH_PARAMS = {'nprobe': 16, 'efSearch': 64}
+
+# 量化索引（SQ / PQ）粗排时取 k 的多少倍候选，再按精确向量重新排序
+DEFAULT_RESCORE = 4
+
+# 旧版本被替换后至少保留这么久（秒）才删除：其他 worker 和线程可能还在这个版本的快照上检索，
+# 它们按线程惰性打开 SQLite 连接，版本目录删除后再打开会失败
+PRUNE_GRACE = float(os.getenv('INDEX_PRUNE_GRACE', 60))
+
+# 近似索引没有覆盖的行（已删除的标签和之后追加的行）超过总行数的这个比例时才重建
+ANN_REBUILD_RATIO = float(os.getenv('INDEX_ANN_REBUILD_RATIO', 0.1))
+
+# 训练近似索引时最多使用的样本数
+MAX_TRAINING_POINTS = 131072
+
+# 文本块表，pos 即向量所在行号
+CHUNKS_TABLE = """
+    CREATE TABLE {exists}{name} (
+        pos INTEGER PRIMARY KEY,
+        id TEXT NOT NULL UNIQUE,
+        content TEXT NOT NULL,
+        metadata TEXT NOT NULL
+    )
+"""
+
+# 较新的 faiss 用 IO_FLAG_MMAP_IFC 整体映射索引文件（含 Flat/PQ/SQ 编码），旧版本只能映射倒排表；
+# 两个标志不能同时使用，IVF 索引会读取失败
+MMAP_READ_FLAGS = faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+
+
+class MmapFlatIndex:
+    """精确（Flat）L2 向量索引，向量可以是只读的内存映射
+
+    接口与 faiss 索引一致（d、ntotal、search、add、remove_ids、reconstruct_n），
+    可以直接交给 LangChain 的 FAISS 向量存储使用。距离为 L2 距离的平方，与 IndexFlatL2 相同。
+    """
+
+    def __init__(self, d, vectors=None, norms=None):
+        self.d = d
+        self._vectors = vectors if vectors is not None else np.empty((0, d), dtype=np.float32)
+        if norms is None:
+            norms = np.einsum('ij,ij->i', self._vectors, self._vectors).astype(np.float32)
+        self._norms = norms
+        # add 追加时使用的预留空间，_vectors / _norms 是它们的前 ntotal 行
+        self._vector_buffer = None
+        self._norm_buffer = None
+
+    @property
+    def ntotal(self):
+        return self._vectors.shape[0]
+
+    def search(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        nq = x.shape[0]
+        if nq > SEARCH_QUERY_ROWS:
+            # 批量查询分组计算，每组的距离矩阵不超过 SEARCH_QUERY_ROWS × SEARCH_BLOCK_ROWS
+            results = [self.search(x[i:i + SEARCH_QUERY_ROWS], k) for i in range(0, nq, SEARCH_QUERY_ROWS)]
+            return np.concatenate([d for d, _ in results]), np.concatenate([l for _, l in results])
+        distances = np.full((nq, k), np.inf, dtype=np.float32)
+        labels = np.full((nq, k), -1, dtype=np.int64)
+        if self.ntotal == 0 or k <= 0:
+            return distances, labels
+
+        x_norms = np.einsum('ij,ij->i', x, x)[:, None]
+        for start in range(0, self.ntotal, SEARCH_BLOCK_ROWS):
+            block = self._vectors[start:start + SEARCH_BLOCK_ROWS]
+            block_distances = x_norms - 2 * (x @ block.T) + self._norms[start:start + len(block)][None, :]
+            # 先取当前块内的 top-k，再与已有的 top-k 合并
+            if len(block) > k:
+                block_top = np.argpartition(block_distances, k - 1, axis=1)[:, :k]
+                block_distances = np.take_along_axis(block_distances, block_top, axis=1)
+            else:
+                block_top = np.broadcast_to(np.arange(len(block)), block_distances.shape)
+            candidates = np.concatenate([distances, block_distances], axis=1)
+            candidate_labels = np.concatenate([labels, block_top + start], axis=1)
+            top = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+            distances = np.take_along_axis(candidates, top, axis=1)
+            labels = np.take_along_axis(candidate_labels, top, axis=1)
+
+        order = np.argsort(distances, axis=1)
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def rescore(self, x, candidates, k):
+        """按精确 L2 距离对每条查询的候选行重新排序，返回前 k 个；candidates 中的 -1 表示空位
+
+        只读取候选行，向量是内存映射时只有这些行所在的页被换入。
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        candidates = np.asarray(candidates, dtype=np.int64)
+        valid = candidates >= 0
+        rows = np.where(valid, candidates, 0)
+        vectors = np.asarray(self._vectors[rows.ravel()]).reshape(*rows.shape, self.d)
+        distances = (np.einsum('ij,ij->i', x, x)[:, None]
+                     - 2 * np.matmul(vectors, x[:, :, None])[:, :, 0]
+                     + self._norms[rows])
+        distances = np.where(valid, distances, np.inf).astype(np.float32)
+
+        order = np.argsort(distances, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        labels = np.where(np.isinf(distances), -1, np.take_along_axis(candidates, order, axis=1))
+        if order.shape[1] < k:
+            pad = k - order.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+            labels = np.pad(labels, ((0, 0), (0, pad)), constant_values=-1)
+        return distances, labels
+
+    def add(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        n, m = self.ntotal, len(x)
+        if self._vector_buffer is None or len(self._vector_buffer) < n + m:
+            # 按 1.5 倍扩容，逐个窗口追加时总的复制量与向量数成正比，而不是每次复制全部向量
+            capacity = max(n + m, n * 3 // 2, 1024)
+            self._vector_buffer = np.empty((capacity, self.d), dtype=np.float32)
+            self._vector_buffer[:n] = self._vectors
+            self._norm_buffer = np.empty(capacity, dtype=np.float32)
+            self._norm_buffer[:n] = self._norms
+        self._vector_buffer[n:n + m] = x
+        self._norm_buffer[n:n + m] = np.einsum('ij,ij->i', x, x)
+        self._vectors = self._vector_buffer[:n + m]
+        self._norms = self._norm_buffer[:n + m]
+
+    def remove_ids(self, ids):
+        keep = np.ones(self.ntotal, dtype=bool)
+        keep[np.asarray(ids, dtype=np.int64)] = False
+        removed = self.ntotal - int(keep.sum())
+        self._vectors = self._vectors[keep]
+        self._norms = self._norms[keep]
+        self._vector_buffer = self._norm_buffer = None
+        return removed
+
+    def reconstruct_n(self, i0, ni):
+        return np.asarray(self._vectors[i0:i0 + ni])
+
+    def reconstruct(self, i):
+        return np.asarray(self._vectors[i])
+
+    @property
+    def norms(self):
+        return self._norms
+
+
+def parse_search_params(text):
+    """解析 "nprobe=16,efSearch=64" 形式的检索参数"""
+    params = {}
+    for item in (text or '').split(','):
+        if item.strip():
+            key, _, value = item.partition('=')
+            params[key.strip()] = int(value)
+    return params
+
+
+def apply_search_params(index, params):
+    """设置近似索引的检索参数（nprobe、efSearch 等），跳过该索引类型不支持的参数"""
+    space = faiss.ParameterSpace()
+    for key, value in {**DEFAULT_SEARCH_PARAMS, **(params or {})}.items():
+        if key == 'rescore':  # 由 AnnIndex 处理，不是 faiss 的参数
+            continue
+        try:
+            space.set_index_parameter(index, key, value)
+        except RuntimeError:
+            pass
+
+
+def is_quantized(spec):
+    """索引是否只保存量化后的编码（SQ / PQ），距离是近似值"""
+    spec = (spec or '').upper()
+    return 'SQ' in spec or 'PQ' in spec
+
+
+def rescore_factor(spec, params=None):
+    """粗排候选数相对 k 的倍数，1 表示直接使用近似索引的结果"""
+    if params and 'rescore' in params:
+        return max(1, int(params['rescore']))
+    return DEFAULT_RESCORE if is_quantized(spec) else 1
+
+
+def _min_training_points(index, spec):
+    """训练该索引至少需要的向量数"""
+    minimum = 0
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        minimum = ivf.nlist
+    if 'PQ' in spec.upper():
+        minimum = max(minimum, 256)
+    return minimum
+
+
+def build_ann_index(spec, vectors, template=None):
+    """按 index_factory 描述训练并构建近似索引
+
+    template 是之前训练好的同类索引，有的话清空后复用，省去重新训练。
+    向量数不足以训练时返回 None，调用方退回精确检索。
+    """
+    count, dim = vectors.shape
+    if template is not None:
+        index = template
+        index.reset()
+    else:
+        index = faiss.index_factory(dim, spec)
+    if not index.is_trained:
+        minimum = _min_training_points(index, spec)
+        if count < minimum:
+            print(f"向量数 {count} 不足以训练 {spec}（至少需要 {minimum} 个），使用精确检索")
+            return None
+        if count > MAX_TRAINING_POINTS:
+            sample = np.sort(np.random.default_rng(0).choice(count, MAX_TRAINING_POINTS, replace=False))
+            training = np.ascontiguousarray(vectors[sample])
+        else:
+            training = np.ascontiguousarray(vectors)
+        index.train(training)
+    for start in range(0, count, SEARCH_BLOCK_ROWS):
+        index.add(np.ascontiguousarray(vectors[start:start + SEARCH_BLOCK_ROWS]))
+    return index
+
+
+class AnnIndex:
+    """近似最近邻索引，精确向量仍保存在 MmapFlatIndex 中
+
+    检索走近似索引；add/remove_ids 只修改精确向量，近似索引随之失效，
+    保存时再用全部向量重新构建（HNSW 不支持删除，IVF 删除后行号会错位）。
+    近似索引失效期间检索退回精确计算。
+    rescore 大于 1 时，近似索引取 k×rescore 个候选，再用精确向量重新排序，返回的距离是精确值。
+
+    近似索引沿用自之前的版本时（IndexBuilder），label_map 把标签映射到当前行号（-1 为已删除），
+    prefix 之后的行不在近似索引中，精确计算后与近似索引的候选合并，再按精确距离排序。
+    """
+
+    def __init__(self, flat, spec, ann=None, search_params=None, template=None, label_map=None, prefix=None):
+        self.flat = flat
+        self.spec = spec
+        self.ann = ann
+        self.search_params = search_params
+        self.rescore = rescore_factor(spec, search_params)
+        self._template = template  # 之前训练好的同类索引，重建时复用训练结果
+        self.label_map = label_map
+        self.prefix = prefix if prefix is not None else flat.ntotal
+        self._tail = None
+        if ann is not None:
+            apply_search_params(ann, search_params)
+
+    @property
+    def d(self):
+        return self.flat.d
+
+    @property
+    def ntotal(self):
+        return self.flat.ntotal
+
+    @property
+    def norms(self):
+        return self.flat.norms
+
+    def search(self, x, k):
+        if self.ann is None:
+            return self.flat.search(x, k)
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        if self.label_map is not None or self.prefix < self.flat.ntotal:
+            return self._search_with_delta(x, k)
+        if self.ann.ntotal != self.flat.ntotal:
+            return self.flat.search(x, k)
+        if self.rescore <= 1 or k <= 0:
+            return self.ann.search(x, k)
+        _, candidates = self.ann.search(x, k * self.rescore)
+        return self.flat.rescore(x, candidates, k)
+
+    def _search_with_delta(self, x, k):
+        """近似索引的候选映射到当前行号，加上 prefix 之后各行的精确结果，合并后按精确距离取前 k 个"""
+        if k <= 0:
+            return self.flat.search(x, k)
+        # 已删除的标签仍可能出现在候选中，按存活比例多取一些
+        live = self.prefix if self.prefix else 1
+        ann_k = min(self.ann.ntotal, -(-k * max(self.rescore, 1) * self.ann.ntotal // live))
+        _, candidates = self.ann.search(x, ann_k)
+        if self.label_map is not None:
+            candidates = np.where(candidates >= 0, self.label_map[np.maximum(candidates, 0)], -1)
+        if self.prefix < self.flat.ntotal:
+            if self._tail is None or self._tail.ntotal != self.flat.ntotal - self.prefix:
+                tail_rows = self.flat.reconstruct_n(self.prefix, self.flat.ntotal - self.prefix)
+                self._tail = MmapFlatIndex(self.d, tail_rows, self.flat.norms[self.prefix:])
+            _, tail = self._tail.search(x, k)
+            candidates = np.concatenate([candidates, np.where(tail >= 0, tail + self.prefix, -1)], axis=1)
+        return self.flat.rescore(x, candidates, k)
+
+    def add(self, x):
+        self.flat.add(x)
+        self.ann = None
+        self.label_map = None
+
+    def remove_ids(self, ids):
+        self.ann = None
+        self.label_map = None
+        removed = self.flat.remove_ids(ids)
+        self.prefix = self.flat.ntotal
+        return removed
+
+    def reconstruct_n(self, i0, ni):
+        return self.flat.reconstruct_n(i0, ni)
+
+    def reconstruct(self, i):
+        return self.flat.reconstruct(i)
+
+    def build(self, vectors):
+        """用全部向量重新构建近似索引"""
+        self.ann = build_ann_index(self.spec, vectors, self._template)
+        self._template = None
+        self.label_map = None
+        self.prefix = len(vectors)
+        if self.ann is not None:
+            apply_search_params(self.ann, self.search_params)
+        return self.ann
+
+
+class _Connections:
+    """每个进程、每个线程各自一个只读 SQLite 连接（连接不能跨 fork 或线程共享）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteDocstore(Docstore):
+    """只读的文本块存储，按 ID 从 SQLite 读取，不在内存中保存全部文本"""
+
+    def __init__(self, path):
+        self._connections = _Connections(path)
+        # 加载快照时就打开连接：该版本已被清理时在加载阶段报错，而不是在之后某次检索中途
+        self._connections.get()
+
+    def search(self, search):
+        row = self._connections.get().execute(
+            "SELECT content, metadata FROM chunks WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def all_documents(self):
+        """按向量行号顺序返回 (pos, id, Document)"""
+        rows = self._connections.get().execute(
+            "SELECT pos, id, content, metadata FROM chunks ORDER BY pos"
+        )
+        for pos, doc_id, content, metadata in rows:
+            yield pos, doc_id, Document(page_content=content, metadata=json.loads(metadata))
+
+
+class SQLiteIdMap(Mapping):
+    """向量行号到文本块 ID 的只读映射，按需从 SQLite 查询"""
+
+    def __init__(self, docstore, size):
+        self._connections = docstore._connections
+        self._size = size
+
+    def __getitem__(self, pos):
+        row = self._connections.get().execute(
+            "SELECT id FROM chunks WHERE pos = ?", (int(pos),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for (pos,) in self._connections.get().execute("SELECT pos FROM chunks ORDER BY pos"):
+            yield pos
+
+    def items(self):
+        return list(self._connections.get().execute("SELECT pos, id FROM chunks ORDER BY pos"))
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+def _make_index(flat, index_spec, search_params=None, template=None):
+    if not index_spec or index_spec == 'Flat':
+        return flat
+    return AnnIndex(flat, index_spec, search_params=search_params, template=template)
+
+
+def new_vector_store(embeddings, dim, index_spec='Flat', search_params=None):
+    """创建一个空的可写向量存储，index_spec 为 faiss index_factory 描述，如 HNSW32、IVF1024,Flat、IVF1024,PQ32、SQ8"""
+    return FAISS(embeddings, _make_index(MmapFlatIndex(dim), index_spec, search_params), InMemoryDocstore(), {})
+
+
+def save_index(store, path):
+    """把向量存储写成上面描述的磁盘格式"""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    index = store.index
+    count = index.ntotal
+
+    vectors = np.ascontiguousarray(index.reconstruct_n(0, count), dtype=np.float32) if count \
+        else np.empty((0, index.d), dtype=np.float32)
+    vectors.tofile(path / "vectors.f32")
+    norms = getattr(index, 'norms', None)
+    if norms is None:
+        norms = np.einsum('ij,ij->i', vectors, vectors)
+    np.ascontiguousarray(norms, dtype=np.float32).tofile(path / "norms.f32")
+
+    index_spec = 'Flat'
+    if isinstance(index, AnnIndex) and count:
+        ann = index.ann if index.ann is not None and index.ann.ntotal == count else index.build(vectors)
+        if ann is not None:
+            faiss.write_index(ann, str(path / "ann.faiss"))
+            index_spec = index.spec
+
+    db_path = path / "docstore.sqlite"
+    if db_path.exists():
+        db_path.unlink()
+    conn = sqlite3.connect(str(db_path))
+    conn.execute(CHUNKS_TABLE.format(name='chunks', exists=''))
+    rows = []
+    for pos, doc_id in sorted(store.index_to_docstore_id.items()):
+        doc = store.docstore.search(doc_id)
+        rows.append((pos, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str)))
+    conn.executemany("INSERT INTO chunks (pos, id, content, metadata) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    # meta.json 最后写入，它存在即表示索引完整
+    with open(path / "meta.json", "w") as f:
+        json.dump({'format': FORMAT_VERSION, 'dim': index.d, 'count': count, 'index_spec': index_spec}, f)
+
+
+def write_index(store, path):
+    """先写到临时目录再替换，读者不会看到写了一半的索引"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    old_path = path.with_name(path.name + ".old")
+    for p in (tmp_path, old_path):
+        if p.exists():
+            shutil.rmtree(p)
+    save_index(store, tmp_path)
+    if path.exists():
+        path.rename(old_path)
+    tmp_path.rename(path)
+    if old_path.exists():
+        # 仍在映射旧文件的读者不受影响，文件在最后一个映射释放后才真正删除
+        shutil.rmtree(old_path)
+
+
+def _read_meta(path):
+    with open(Path(path) / "meta.json") as f:
+        return json.load(f)
+
+
+def _map_array(file_path, shape):
+    if shape[0] == 0:
+        return np.empty(shape, dtype=np.float32)
+    return np.memmap(file_path, dtype=np.float32, mode='r', shape=shape)
+
+
+def load_index(path, embeddings, search_params=None):
+    """以内存映射方式加载索引，只读"""
+    path = Path(path)
+    meta = _read_meta(path)
+    count, dim = meta['count'], meta['dim']
+    index = MmapFlatIndex(
+        dim,
+        _map_array(path / "vectors.f32", (count, dim)),
+        _map_array(path / "norms.f32", (count,))
+    )
+    index_spec = meta.get('index_spec', 'Flat')
+    if index_spec != 'Flat':
+        ann = faiss.read_index(str(path / "ann.faiss"), MMAP_READ_FLAGS)
+        label_map = None
+        if (path / "ann_map.i64").exists():
+            label_map = np.memmap(path / "ann_map.i64", dtype=np.int64, mode='r', shape=(ann.ntotal,))
+        index = AnnIndex(index, index_spec, ann=ann, search_params=search_params,
+                         label_map=label_map, prefix=meta.get('ann_prefix', count))
+    docstore = SQLiteDocstore(path / "docstore.sqlite")
+    return FAISS(embeddings, index, docstore, SQLiteIdMap(docstore, count))
+
+
+class IndexBuilder:
+    """在一个目录中边入库边写出新版本的索引，用于增量更新
+
+    以 base_path 的版本为基础：vectors.f32、norms.f32 和 docstore.sqlite 按文件复制过来，
+    之后每个窗口的向量直接追加到文件末尾，文本块直接插入 docstore；删除的文本块先只从 docstore 中删除，
+    finish 时再分块压缩向量文件、重新编排行号。内存中只有当前窗口的向量和文本，
+    与文件大小和语料规模无关（近似索引本身除外）。
+
+    index_spec 与基础版本相同时沿用它的近似索引（见模块说明），变化超过 ANN_REBUILD_RATIO 时
+    复用已训练的参数重建，不必重新训练。
+    写完后调用 finish，出错时调用 abort；目录由调用方交给 IndexDirectory.publish 发布。
+    """
+
+    def __init__(self, path, base_path=None, index_spec='Flat', search_params=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index_spec = index_spec or 'Flat'
+        self.search_params = search_params
+        self.dim = None
+        self.count = 0  # 向量文件中的行数，包括已删除、尚未压缩的行
+        self.deleted = 0
+        self._ann_path = None  # 基础版本的近似索引，可以沿用或作为重建的模板
+        self._ann_rows = self._ann_prefix = self._ann_deleted = 0
+        db_path = self.path / "docstore.sqlite"
+        if base_path is not None and (Path(base_path) / "meta.json").exists():
+            base_path = Path(base_path)
+            meta = _read_meta(base_path)
+            self.dim, self.count = meta['dim'], meta['count']
+            for name in ("vectors.f32", "norms.f32", "docstore.sqlite"):
+                shutil.copyfile(base_path / name, self.path / name)
+            if self.index_spec == meta.get('index_spec') and (base_path / "ann.faiss").exists():
+                self._ann_path = base_path / "ann.faiss"
+                self._ann_prefix = meta.get('ann_prefix', self.count)
+                self._ann_deleted = meta.get('ann_deleted', 0)
+                self._ann_rows = self._ann_prefix + self._ann_deleted
+                if (base_path / "ann_map.i64").exists():
+                    shutil.copyfile(base_path / "ann_map.i64", self.path / "ann_map.i64")
+        self._db = sqlite3.connect(str(db_path))
+        # 发布之前目录不会被读者打开，写入过程中崩溃时整个临时目录会被清理，不需要日志和同步
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(CHUNKS_TABLE.format(name='chunks', exists='IF NOT EXISTS '))
+        self._vectors = open(self.path / "vectors.f32", "ab")
+        self._norms = open(self.path / "norms.f32", "ab")
+
+    def add(self, contents, embeddings, metadatas, ids):
+        """把一个窗口的文本块和向量追加到索引末尾"""
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度 {vectors.shape[1]} 与索引的维度 {self.dim} 不一致")
+        self._vectors.write(vectors.tobytes())
+        self._norms.write(np.einsum('ij,ij->i', vectors, vectors).astype(np.float32).tobytes())
+        self._db.executemany(
+            "INSERT INTO chunks (pos, id, content, metadata) VALUES (?, ?, ?, ?)",
+            ((self.count + i, doc_id, content, json.dumps(metadata, ensure_ascii=False, default=str))
+             for i, (doc_id, content, metadata) in enumerate(zip(ids, contents, metadatas)))
+        )
+        self.count += len(ids)
+
+    def delete(self, ids):
+        """删除文本块，对应的向量行在 finish 时压缩掉"""
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            self.deleted += self._db.execute(
+                f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+            ).rowcount
+
+    def _compact(self):
+        """按 docstore 中剩下的行号分块复制向量，再把 docstore 的行号重新编为 0..n-1"""
+        old_vectors = _map_array(self.path / "vectors.f32", (self.count, self.dim))
+        old_norms = _map_array(self.path / "norms.f32", (self.count,))
+        survivors_path = self.path / "survivors.i64"
+        with open(self.path / "vectors.f32.compact", "wb") as vectors, \
+                open(self.path / "norms.f32.compact", "wb") as norms, open(survivors_path, "wb") as survivors:
+            cursor = self._db.execute("SELECT pos FROM chunks ORDER BY pos")
+            while True:
+                rows = cursor.fetchmany(SEARCH_BLOCK_ROWS)
+                if not rows:
+                    break
+                positions = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+                vectors.write(np.ascontiguousarray(old_vectors[positions]).tobytes())
+                norms.write(np.ascontiguousarray(old_norms[positions]).tobytes())
+                survivors.write(positions.tobytes())
+        del old_vectors, old_norms
+        os.replace(self.path / "vectors.f32.compact", self.path / "vectors.f32")
+        os.replace(self.path / "norms.f32.compact", self.path / "norms.f32")
+        if self._ann_path is not None:
+            self._remap_ann_labels(survivors_path)
+        survivors_path.unlink()
+
+        self._db.commit()
+        self._db.close()
+        compact_path = self.path / "docstore.sqlite.compact"
+        conn = sqlite3.connect(str(compact_path))
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute(CHUNKS_TABLE.format(name='chunks', exists=''))
+        conn.execute("ATTACH DATABASE ? AS old", (str(self.path / "docstore.sqlite"),))
+        conn.execute("""
+            INSERT INTO chunks (pos, id, content, metadata)
+            SELECT ROW_NUMBER() OVER (ORDER BY pos) - 1, id, content, metadata FROM old.chunks ORDER BY pos
+        """)
+        conn.commit()
+        self.count = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        conn.execute("DETACH DATABASE old")
+        conn.close()
+        os.replace(compact_path, self.path / "docstore.sqlite")
+        self.deleted = 0
+
+    def _remap_ann_labels(self, survivors_path):
+        """压缩后重新计算近似索引标签对应的行号，写入 ann_map.i64
+
+        survivors_path 中是按顺序保留下来的旧行号，旧行号在其中的位置即新行号。
+        """
+        size = survivors_path.stat().st_size // 8
+        survivors = np.memmap(survivors_path, dtype=np.int64, mode='r', shape=(size,)) if size \
+            else np.empty(0, dtype=np.int64)
+        map_path = self.path / "ann_map.i64"
+        old_map = np.memmap(map_path, dtype=np.int64, mode='r', shape=(self._ann_rows,)) \
+            if map_path.exists() else None
+        deleted = 0
+        with open(self.path / "ann_map.i64.compact", "wb") as f:
+            for start in range(0, self._ann_rows, SEARCH_BLOCK_ROWS):
+                stop = min(start + SEARCH_BLOCK_ROWS, self._ann_rows)
+                old = np.asarray(old_map[start:stop]) if old_map is not None else np.arange(start, stop)
+                new = np.searchsorted(survivors, old)
+                found = (old >= 0) & (new < size)
+                found[found] = survivors[new[found]] == old[found]
+                deleted += int((~found).sum())
+                f.write(np.where(found, new, -1).astype(np.int64).tobytes())
+        # 近似索引覆盖的是旧行号 0..prefix-1 中保留下来的行，压缩后仍排在最前面
+        self._ann_prefix = int(np.searchsorted(survivors, self._ann_prefix))
+        self._ann_deleted = deleted
+        del survivors, old_map
+        os.replace(self.path / "ann_map.i64.compact", map_path)
+
+    def finish(self):
+        """压缩已删除的行、构建近似索引并写入 meta.json，返回文本块数；从未写入过向量时不写 meta.json，返回 None"""
+        self._vectors.close()
+        self._norms.close()
+        if self.deleted:
+            self._compact()
+        else:
+            self._db.commit()
+            self._db.close()
+        if self.dim is None:
+            return None
+
+        index_spec = 'Flat'
+        meta = {}
+        if self.index_spec != 'Flat' and self.count:
+            stale = self._ann_deleted + self.count - self._ann_prefix
+            if self._ann_path is not None and stale <= ANN_REBUILD_RATIO * self.count:
+                # 版本目录发布后不再修改，可以直接硬链接上一个版本的近似索引
+                try:
+                    os.link(self._ann_path, self.path / "ann.faiss")
+                except OSError:
+                    shutil.copyfile(self._ann_path, self.path / "ann.faiss")
+                index_spec = self.index_spec
+                if stale:
+                    meta = {'ann_prefix': self._ann_prefix, 'ann_deleted': self._ann_deleted}
+            else:
+                template = faiss.read_index(str(self._ann_path)) if self._ann_path else None
+                vectors = _map_array(self.path / "vectors.f32", (self.count, self.dim))
+                ann = build_ann_index(self.index_spec, vectors, template)
+                del vectors
+                if ann is not None:
+                    faiss.write_index(ann, str(self.path / "ann.faiss"))
+                    index_spec = self.index_spec
+        if not meta.get('ann_deleted'):
+            # 没有删除过的标签时标签就是行号
+            (self.path / "ann_map.i64").unlink(missing_ok=True)
+
+        # meta.json 最后写入，它存在即表示索引完整
+        with open(self.path / "meta.json", "w") as f:
+            json.dump({'format': FORMAT_VERSION, 'dim': self.dim, 'count': self.count, 'index_spec': index_spec,
+                       **meta}, f)
+        return self.count
+
+    def iter_texts(self):
+        """按行号顺序逐个读出文本块内容（finish 之后调用），用于构建倒排索引"""
+        conn = sqlite3.connect(f"file:{self.path / 'docstore.sqlite'}?mode=ro", uri=True)
+        try:
+            for (content,) in conn.execute("SELECT content FROM chunks ORDER BY pos"):
+                yield content
+        finally:
+            conn.close()
+
+    def abort(self):
+        """放弃这次构建，删除目录"""
+        for f in (self._vectors, self._norms):
+            f.close()
+        try:
+            self._db.close()
+        except sqlite3.ProgrammingError:
+            pass
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def is_legacy_index(path):
+    """是否为旧的 save_local 格式（index.faiss + index.pkl）"""
+    path = Path(path)
+    return (path / "index.pkl").exists() and not (path / "meta.json").exists()
+
+
+def migrate_legacy_index(path, embeddings):
+    """把旧的 pickle 格式索引转换为新格式，只在第一次加载时执行一次"""
+    legacy = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    count = legacy.index.ntotal
+    vectors = legacy.index.reconstruct_n(0, count) if count else None
+    store = FAISS(embeddings, MmapFlatIndex(legacy.index.d, vectors), legacy.docstore,
+                  dict(legacy.index_to_docstore_id))
+    write_index(store, path)
+
+
+class IndexDirectory:
+    """版本化的索引目录
+
+    写入者在临时目录里写好完整的新版本，改名为版本目录，再原子地替换 CURRENT；
+    读者读取 CURRENT 后打开对应的版本目录，永远看不到写了一半的索引。
+    旧版本保留 keep_versions 个，且被替换后至少保留 prune_grace 秒，
+    让还在使用旧快照的读者可以继续打开其中的文件；过期的版本在之后的发布时删除。
+    """
+
+    def __init__(self, root, keep_versions=2, prune_grace=PRUNE_GRACE):
+        self.root = Path(root)
+        self.keep_versions = max(1, keep_versions)
+        self.prune_grace = prune_grace
+        self._lock = threading.Lock()
+
+    def version_path(self, version):
+        return self.root / f"v{version:08d}"
+
+    def current_version(self):
+        """返回当前版本号，还没有发布过任何版本时返回 None"""
+        try:
+            return int((self.root / "CURRENT").read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _versions(self):
+        versions = []
+        for item in self.root.glob("v*"):
+            if item.is_dir() and item.name[1:].isdigit():
+                versions.append(int(item.name[1:]))
+        return sorted(versions)
+
+    def prepare(self):
+        """新建一个临时目录，入库时在其中逐步写出新版本，写好后交给 publish(write, prepared_path=...)
+
+        调用方需持有 write_lock；异常退出时残留的临时目录在之后的发布时清理。
+        """
+        path = self.root / f".tmp-build-{os.getpid()}"
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        return path
+
+    @contextmanager
+    def write_lock(self):
+        """写入者互斥：进程内用线程锁，进程之间用文件锁"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / ".write.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, write, prepared_path=None):
+        """发布一个新版本，write(path) 负责把版本内容写入 path，返回新版本号
+
+        prepared_path 是已经写好的目录（例如旧格式迁移），直接改名发布。
+        调用方需持有 write_lock。
+        """
+        version = max([self.current_version() or 0] + self._versions()) + 1
+        final_path = self.version_path(version)
+        if prepared_path is None:
+            prepared_path = self.root / f".tmp-{version}-{os.getpid()}"
+            if prepared_path.exists():
+                shutil.rmtree(prepared_path)
+            prepared_path.mkdir(parents=True)
+            write(prepared_path)
+        else:
+            write(prepared_path)
+        Path(prepared_path).rename(final_path)
+
+        pointer_tmp = self.root / f".CURRENT.{os.getpid()}.tmp"
+        with open(pointer_tmp, "w") as f:
+            f.write(str(version))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer_tmp, self.root / "CURRENT")
+        self._prune(version)
+        return version
+
+    def _prune(self, current):
+        """删除过旧的版本和异常退出时残留的临时目录
+
+        版本被替换的时间取下一个版本目录的修改时间（版本内容在改名发布前写入）。
+        """
+        versions = self._versions()
+        now = time.time()
+        for version, successor in zip(versions, versions[1:]):
+            if version > current - self.keep_versions:
+                break
+            try:
+                replaced_at = self.version_path(successor).stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if now - replaced_at >= self.prune_grace:
+                shutil.rmtree(self.version_path(version), ignore_errors=True)
+        for item in self.root.glob(".tmp-*"):
+            shutil.rmtree(item, ignore_errors=True)
@@ -0,0 +1,184 @@
+from langchain_community.document_loaders import TextLoader
+from langchain_community.document_loaders.markdown import UnstructuredMarkdownLoader
+from langchain_community.document_loaders.pdf import PyPDFLoader
+from langchain_community.document_loaders.word_document import UnstructuredWordDocumentLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import chain
+from pathlib import Path
+import multiprocessing
+import os
+
+# 支持的文件扩展名及对应的加载器
+LOADERS = {
+    '.txt': TextLoader,
+    '.pdf': PyPDFLoader,
+    '.doc': UnstructuredWordDocumentLoader,
+    '.docx': UnstructuredWordDocumentLoader,
+    '.md': UnstructuredMarkdownLoader,
+}
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# 大文件在主进程中流式处理：文本文件逐段读取、其他格式逐页加载，切分出的文本块按窗口交给调用方，
+# 内存占用取决于窗口大小而不是文件大小；小文件仍整体交给进程池解析
+STREAM_THRESHOLD_BYTES = int(float(os.getenv('INGEST_STREAM_THRESHOLD_MB', 8)) * 1024 * 1024)
+# 每个窗口的文本块数，向量化和写入索引都以窗口为单位
+WINDOW_CHUNKS = int(os.getenv('INGEST_WINDOW_CHUNKS', 256))
+# 流式读取文本文件时每段的字符数，每段在换行处截断
+TEXT_SEGMENT_CHARS = int(os.getenv('INGEST_TEXT_SEGMENT_CHARS', 200000))
+
+
+def default_workers():
+    """解析进程数，可通过环境变量 INGEST_WORKERS 配置，默认等于 CPU 核数"""
+    return int(os.getenv('INGEST_WORKERS', os.cpu_count() or 1))
+
+
+def _mp_context():
+    """解析进程的启动方式：服务进程中有入库线程、日志线程和 gthread 工作线程，
+    fork 会把其他线程持有的锁原样复制到子进程，子进程可能因此死锁；
+    所以使用 forkserver（由单线程的服务进程 fork），不支持的平台使用 spawn"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _text_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True  # 记录块在原文中的位置，组装上下文时据此合并重叠的块
+    )
+
+
+def load_and_split(file_path):
+    """加载单个文件并切分为文本块（在工作进程中运行）"""
+    loader_cls = LOADERS[Path(file_path).suffix.lower()]
+    docs = loader_cls(file_path).load()
+    return _text_splitter().split_documents(docs)
+
+
+def iter_text_segments(file_path, segment_chars=None):
+    """逐段读取文本文件，产出 (段在文件中的字符偏移, 文本)
+
+    每段在后半部分的最后一个换行处截断，余下的部分并入下一段；整段都没有换行时按长度截断。
+    """
+    segment_chars = segment_chars or TEXT_SEGMENT_CHARS
+    offset = 0
+    carry = ''
+    with open(file_path) as f:  # 与 TextLoader 相同，使用默认编码
+        while True:
+            data = f.read(segment_chars)
+            if not data:
+                break
+            text = carry + data
+            cut = text.rfind('\n', len(text) // 2) + 1 or len(text)
+            segment, carry = text[:cut], text[cut:]
+            yield offset, segment
+            offset += len(segment)
+    if carry:
+        yield offset, carry
+
+
+def iter_streamed_chunks(file_path):
+    """流式加载并切分单个大文件，逐个产出文本块
+
+    文本文件逐段读取，start_index 换算为在整个文件中的位置；其他格式使用加载器的 lazy_load
+    （PDF 逐页）。段与段、页与页之间的文本块没有重叠。
+    """
+    splitter = _text_splitter()
+    if Path(file_path).suffix.lower() == '.txt':
+        for offset, segment in iter_text_segments(file_path):
+            for chunk in splitter.create_documents([segment], [{'source': file_path}]):
+                chunk.metadata['start_index'] += offset
+                yield chunk
+        return
+    loader_cls = LOADERS[Path(file_path).suffix.lower()]
+    for doc in loader_cls(file_path).lazy_load():
+        yield from splitter.split_documents([doc])
+
+
+def _windows(chunks, size):
+    """把文本块按 size 个一组产出 (窗口, 是否为最后一组)；没有文本块时产出一个空的最后一组"""
+    window = []
+    for chunk in chunks:
+        if len(window) >= size:
+            yield window, False
+            window = []
+        window.append(chunk)
+    yield window, True
+
+
+def iter_file_chunks(file_paths, workers=None):
+    """解析并切分文件，按完成顺序逐个产出 (file_path, chunks, error)
+
+    workers 大于 1 时使用进程池并行解析，调用方可以边接收边做向量化，
+    不必等全部文件解析完。同时在途的文件数限制为 workers 的两倍，
+    避免解析结果在内存中堆积。
+    """
+    file_paths = list(file_paths)
+    workers = default_workers() if workers is None else workers
+    workers = min(workers, len(file_paths))
+
+    if workers <= 1:
+        for file_path in file_paths:
+            try:
+                yield file_path, load_and_split(file_path), None
+            except Exception as e:
+                yield file_path, None, e
+        return
+
+    pending_paths = iter(file_paths)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context()) as executor:
+        in_flight = {}
+        for file_path in pending_paths:
+            in_flight[executor.submit(load_and_split, file_path)] = file_path
+            if len(in_flight) >= workers * 2:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = in_flight.pop(future)
+                try:
+                    yield file_path, future.result(), None
+                except Exception as e:
+                    yield file_path, None, e
+                next_path = next(pending_paths, None)
+                if next_path is not None:
+                    in_flight[executor.submit(load_and_split, next_path)] = next_path
+
+
+def iter_file_windows(file_paths, workers=None, window=None):
+    """解析并切分文件，逐个产出 (file_path, 文本块窗口, error, 是否为该文件的最后一个窗口)
+
+    不超过 STREAM_THRESHOLD_BYTES 的文件交给 iter_file_chunks 在进程池中整体解析，结果再按窗口切开；
+    更大的文件在主进程中流式加载和切分（进程池同时继续解析小文件），同一时间只有一个窗口的文本块在内存中。
+    某个文件出错时产出 (file_path, None, error, True)，此前已经产出的窗口由调用方撤回。
+    """
+    window = window or WINDOW_CHUNKS
+    small, large = [], []
+    for file_path in file_paths:
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        (large if size > STREAM_THRESHOLD_BYTES else small).append(file_path)
+
+    parsed = iter_file_chunks(small, workers=workers) if small else iter(())
+    # 先取第一个结果，进程池开始解析小文件，再在主进程中处理大文件
+    first = next(parsed, None)
+    for file_path in large:
+        try:
+            for chunks, last in _windows(iter_streamed_chunks(file_path), window):
+                yield file_path, chunks, None, last
+        except Exception as e:
+            yield file_path, None, e, True
+
+    if first is not None:
+        parsed = chain([first], parsed)
+    for file_path, chunks, error in parsed:
+        if error is not None:
+            yield file_path, None, error, True
+            continue
+        for part, last in _windows(chunks, window):
+            yield file_path, part, None, last
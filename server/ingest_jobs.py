@@ -0,0 +1,254 @@
+"""后台文档入库任务队列
+
+/upload 保存文件后只提交一个任务并立即返回任务 ID，解析、向量化和保存索引都在后台线程完成。
+连续上传产生的多个排队任务会合并成一次索引更新（目录扫描本来就会找出所有变化的文件）。
+处理期间检索继续使用旧索引，新索引保存完成后才替换。
+
+任务进度按阶段上报：parsed（已解析文件数）、chunked（文本块数）、
+embedded（已向量化的文本块数）、persisted（索引已保存）。
+
+任务状态保存在索引目录下的 ingest_jobs.sqlite 中（JobStore），而不是进程内存：
+gunicorn 的多个 worker 中只有收到上传的那个在处理任务，查询进度的请求可能落到任何一个 worker。
+处理任务的 worker 定期写入心跳；worker 退出（重启、max_requests、崩溃）后心跳停止，
+未完成的任务在查询时标记为失败，而不是一直停在 queued / running。
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# 收到任务后再等这么久，把紧接着的上传合并进同一次更新
+COALESCE_WINDOW = float(os.getenv('INGEST_COALESCE_WINDOW', 0.5))
+# 最多保留多少个任务的状态，超出后丢弃最早的
+MAX_JOBS = int(os.getenv('INGEST_MAX_JOBS', 200))
+# 未完成的任务每隔多少秒写一次心跳
+HEARTBEAT_INTERVAL = float(os.getenv('INGEST_HEARTBEAT_INTERVAL', 5))
+# 超过多少秒没有心跳的未完成任务视为处理它的 worker 已退出
+STALE_AFTER = float(os.getenv('INGEST_JOB_STALE_AFTER', 60))
+
+
+class IngestJob:
+    def __init__(self, files):
+        self.id = uuid.uuid4().hex
+        self.files = list(files)
+        self.status = 'queued'  # queued / running / succeeded / failed
+        self.stage = None  # 最近完成的阶段
+        self.progress = {
+            'files_total': 0,
+            'files_parsed': 0,
+            'files_failed': 0,
+            'chunks': 0,
+            'chunks_embedded': 0,
+            'persisted': False,
+        }
+        self.error = None
+        self.batch = [self.id]  # 与本任务合并处理的任务 ID
+        self.index_version = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.owner_pid = os.getpid()  # 排队和处理这个任务的 worker
+        self.heartbeat_at = self.created_at
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': dict(self.progress),
+            'files': self.files,
+            'coalesced_with': [job_id for job_id in self.batch if job_id != self.id],
+            'index_version': self.index_version,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'owner_pid': self.owner_pid,
+            'heartbeat_at': self.heartbeat_at,
+        }
+
+
+class JobStore:
+    """各 worker 共用的任务状态表，每个任务一行，状态以 JSON 保存
+
+    每次读写都新建连接：gunicorn preload 时在主进程创建的连接不能在 fork 出的 worker 中继续使用。
+    读取时，超过 stale_after 秒没有心跳的未完成任务标记为失败。
+    """
+
+    def __init__(self, path, max_jobs=MAX_JOBS, stale_after=STALE_AFTER):
+        self.path = Path(path)
+        self.max_jobs = max_jobs
+        self.stale_after = stale_after
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=10)
+
+    def save(self, jobs):
+        """写入（或更新）若干任务的状态，超出 max_jobs 时删除最早的任务"""
+        rows = [(job.id, job.created_at, json.dumps(job.to_dict(), ensure_ascii=False)) for job in jobs]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO jobs (id, created_at, data) VALUES (?, ?, ?)", rows)
+                conn.execute("""
+                    DELETE FROM jobs WHERE id NOT IN (
+                        SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?
+                    )
+                """, (self.max_jobs,))
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            if self._is_stale(job):
+                job['status'] = 'failed'
+                job['error'] = f"处理任务的 worker（pid {job.get('owner_pid')}）已退出，任务未完成"
+                job['finished_at'] = time.time()
+                # 只在行没有被同时更新（心跳恢复或任务完成）时写入
+                with conn:
+                    updated = conn.execute("UPDATE jobs SET data = ? WHERE id = ? AND data = ?",
+                                           (json.dumps(job, ensure_ascii=False), job_id, row[0])).rowcount
+                if not updated:
+                    row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                    return json.loads(row[0]) if row else None
+            return job
+        finally:
+            conn.close()
+
+    def _is_stale(self, job):
+        if job['status'] not in ('queued', 'running'):
+            return False
+        heartbeat_at = job.get('heartbeat_at') or job['started_at'] or job['created_at']
+        return time.time() - heartbeat_at > self.stale_after
+
+
+class IngestJobQueue:
+    """单个后台线程依次执行入库任务，同一时间只有一个任务在更新索引
+
+    jobs_path 是任务状态表的位置，默认为索引目录下的 ingest_jobs.sqlite。
+    另一个后台线程每隔 heartbeat_interval 秒为本进程未完成的任务写入心跳。
+    """
+
+    def __init__(self, doc_store, directory_path, jobs_path=None, coalesce_window=COALESCE_WINDOW,
+                 max_jobs=MAX_JOBS, heartbeat_interval=HEARTBEAT_INTERVAL, stale_after=STALE_AFTER):
+        self.doc_store = doc_store
+        self.directory_path = directory_path
+        self.coalesce_window = coalesce_window
+        self.heartbeat_interval = heartbeat_interval
+        if jobs_path is None:
+            jobs_path = Path(doc_store.index_dir) / "ingest_jobs.sqlite"
+        self.store = JobStore(jobs_path, max_jobs, stale_after)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._active = {}  # 本进程中未完成的任务
+        self._worker = None
+        self._worker_pid = None
+
+    def submit(self, files):
+        """提交一个入库任务，返回任务对象"""
+        job = IngestJob(files)
+        with self._lock:
+            self._ensure_worker()
+            self._active[job.id] = job
+        self._save([job])
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        """返回任务状态字典，任务不存在时返回 None；其他 worker 提交的任务也能查到"""
+        return self.store.get(job_id)
+
+    def _ensure_worker(self):
+        # gunicorn preload 时应用在主进程导入，线程不会随 fork 复制到 worker，
+        # 所以第一次提交任务时才启动线程，并按进程号判断
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker = threading.Thread(target=self._run, name='ingest-worker', daemon=True)
+        self._worker_pid = os.getpid()
+        self._active = {}
+        self._worker.start()
+        threading.Thread(target=self._heartbeat, args=(self._worker,), name='ingest-heartbeat', daemon=True).start()
+
+    def _save(self, jobs):
+        # 心跳线程和处理线程都会写入任务状态，串行写入，避免较旧的状态覆盖较新的
+        with self._save_lock:
+            self.store.save(jobs)
+
+    def _heartbeat(self, worker):
+        while worker.is_alive():
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                jobs = list(self._active.values())
+            if jobs:
+                now = time.time()
+                for job in jobs:
+                    job.heartbeat_at = now
+                self._save(jobs)
+
+    def _next_batch(self):
+        """取出下一个任务，稍等片刻后把队列里其余的任务一并取出"""
+        batch = [self._queue.get()]
+        if self.coalesce_window > 0:
+            time.sleep(self.coalesce_window)
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self._process(batch)
+
+    def _process(self, batch):
+        batch_ids = [job.id for job in batch]
+        for job in batch:
+            job.status = 'running'
+            job.batch = batch_ids
+            job.started_at = time.time()
+        self._save(batch)
+        if len(batch) > 1:
+            print(f"合并 {len(batch)} 个入库任务为一次索引更新")
+
+        def progress(stage, **counts):
+            for job in batch:
+                job.stage = stage
+                job.progress.update(counts)
+            self._save(batch)
+
+        try:
+            self.doc_store.load_documents(self.directory_path, progress=progress)
+            status, error = 'succeeded', None
+        except Exception as e:
+            print(f"入库任务失败: {str(e)}")
+            status, error = 'failed', str(e)
+        for job in batch:
+            job.status = status
+            job.error = error
+            job.index_version = self.doc_store.index_version
+            job.finished_at = time.time()
+        with self._lock:
+            for job in batch:
+                self._active.pop(job.id, None)
+        self._save(batch)
@@ -0,0 +1,257 @@
+"""BM25 倒排索引，与向量索引使用同一批文本块，行号一致
+
+每个索引版本目录下:
+    lexical.json        文本块数、平均长度和 BM25 参数
+    lexical.sqlite      词项表 terms(term, start, df)，查询时按词项查找倒排表的位置
+    postings.u32        所有词项的倒排表依次拼接：文本块行号，加载时 np.memmap 只读映射
+    postings_tf.u16     与 postings.u32 一一对应的词频
+    doclens.u32         每个文本块的词项数
+
+构建时文本块逐个读入，每 LEXICAL_RUN_CHUNKS 个文本块的倒排项按词项排序后写入临时文件，
+最后按词项多路归并，构建的内存占用不随语料规模增长。
+
+分词不依赖外部词典：中日韩文字按相邻两字切分（单字成词时保留单字），
+英文和数字按单词切分，并保留 E1234、ERR_CONN-42 这类带连接符的整体。
+纯关键词检索不需要请求向量接口。
+"""
+from array import array
+from collections import Counter
+import heapq
+from itertools import groupby
+from pathlib import Path
+import json
+import math
+from operator import add, itemgetter
+import re
+import sqlite3
+import unicodedata
+
+import numpy as np
+
+from index_storage import _Connections
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 倒数排名融合的平滑常数，常用 60
+RRF_K = 60
+# 构建时每批处理的文本块数，每批的倒排项排序后写入一个临时文件
+LEXICAL_RUN_CHUNKS = 1024
+
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+TOKEN_PATTERN = re.compile(rf"[0-9a-z]+(?:[._\-/][0-9a-z]+)*|[{_CJK}]+")
+_SPLIT_PATTERN = re.compile(r"[._\-/]")
+
+
+def tokenize(text):
+    """把文本切分为词项，全角字符先转为半角，英文统一小写"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize('NFKC', text).lower()):
+        word = match.group()
+        if word[0] >= '\u3040':
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(map(add, word, word[1:]))
+        else:
+            tokens.append(word)
+            parts = _SPLIT_PATTERN.split(word)
+            if len(parts) > 1:
+                # 带连接符的词同时按各部分索引，查询 conn 也能命中 err_conn-42
+                tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class _Run:
+    """一批文本块的倒排项，按词项排序后写入三个临时文件：词项和倒排项数（文本）、行号、词频
+
+    合并时按词项顺序依次读出，每个文件只顺序读一遍。
+    """
+
+    def __init__(self, prefix, vocab, term_ids, doc_ids, tfs):
+        self.paths = [prefix.with_suffix(suffix) for suffix in ('.terms', '.docs', '.tfs')]
+        terms = sorted(vocab)
+        # 局部词项编号 -> 按词项排序后的名次，同一词项内保持行号升序
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[[vocab[term] for term in terms]] = np.arange(len(terms))
+        ranks = rank[term_ids]
+        order = np.argsort(ranks, kind='stable')
+        counts = np.bincount(ranks, minlength=len(terms))
+        with open(self.paths[0], "w", encoding='utf-8') as f:
+            f.writelines(f"{term}\t{count}\n" for term, count in zip(terms, counts.tolist()))
+        doc_ids[order].tofile(self.paths[1])
+        np.minimum(tfs, 65535).astype(np.uint16)[order].tofile(self.paths[2])
+
+    def entries(self, index):
+        """按词项顺序返回 (词项, index, 倒排项数)，index 是这一批的序号，归并时同一词项按它排序"""
+        with open(self.paths[0], encoding='utf-8') as f:
+            for line in f:
+                term, count = line.rstrip("\n").split("\t")
+                yield term, index, int(count)
+
+    def open(self):
+        self._docs = open(self.paths[1], "rb")
+        self._tfs = open(self.paths[2], "rb")
+
+    def read(self, count):
+        """顺序读出接下来 count 个倒排项的行号和词频"""
+        return (np.frombuffer(self._docs.read(count * 4), dtype=np.uint32),
+                np.frombuffer(self._tfs.read(count * 2), dtype=np.uint16))
+
+    def remove(self):
+        for f in (self._docs, self._tfs):
+            f.close()
+        for run_path in self.paths:
+            run_path.unlink()
+
+
+def _merge_runs(runs):
+    """按词项顺序合并各批，返回 (词项, 行号数组, 词频数组) 的迭代器
+
+    同一词项按批次先后拼接，批次按行号先后排列，拼接后仍是行号升序。
+    """
+    streams = [run.entries(i) for i, run in enumerate(runs)]
+    for term, group in groupby(heapq.merge(*streams), key=itemgetter(0)):
+        parts = [runs[i].read(count) for _, i, count in group]
+        if len(parts) == 1:
+            yield term, parts[0][0], parts[0][1]
+        else:
+            yield term, np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+
+def write_lexical_index(path, texts):
+    """为按行号排列的文本块构建倒排索引并写入 path，texts 可以是迭代器（例如逐行读取 docstore）
+
+    每 LEXICAL_RUN_CHUNKS 个文本块的倒排项按词项排序后写入临时文件（_Run），全部读完后按词项
+    多路归并，依次写入 postings.u32 和词项表；内存中只有一批文本块的倒排项和词表，
+    与语料规模无关。
+    """
+    path = Path(path)
+    runs = []
+    vocab = {}
+    term_ids, doc_ids, tfs = array('i'), array('I'), array('I')
+    doc_count = total_tokens = 0
+
+    def flush():
+        nonlocal vocab, term_ids, doc_ids, tfs
+        if term_ids:
+            runs.append(_Run(path / f".lexical-run-{len(runs)}", vocab, np.frombuffer(term_ids, dtype=np.int32),
+                             np.frombuffer(doc_ids, dtype=np.uint32), np.frombuffer(tfs, dtype=np.uint32)))
+        vocab = {}
+        term_ids, doc_ids, tfs = array('i'), array('I'), array('I')
+
+    with open(path / "doclens.u32", "wb") as doclens:
+        lengths = array('I')
+        for text in texts:
+            tokens = tokenize(text)
+            counts = Counter(tokens)
+            for term in set(counts).difference(vocab):
+                vocab[term] = len(vocab)
+            term_ids.extend(map(vocab.__getitem__, counts))
+            tfs.extend(counts.values())
+            doc_ids.extend([doc_count] * len(counts))
+            lengths.append(len(tokens))
+            total_tokens += len(tokens)
+            doc_count += 1
+            if doc_count % LEXICAL_RUN_CHUNKS == 0:
+                flush()
+                lengths.tofile(doclens)
+                lengths = array('I')
+        flush()
+        lengths.tofile(doclens)
+
+    db_path = path / "lexical.sqlite"
+    if db_path.exists():
+        db_path.unlink()
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("CREATE TABLE terms (term TEXT PRIMARY KEY, start INTEGER NOT NULL, df INTEGER NOT NULL) WITHOUT ROWID")
+    total = 0
+    for run in runs:
+        run.open()
+    with open(path / "postings.u32", "wb") as postings, open(path / "postings_tf.u16", "wb") as postings_tf:
+        def terms():
+            nonlocal total
+            for term, docs, term_tfs in _merge_runs(runs):
+                postings.write(docs.tobytes())
+                postings_tf.write(term_tfs.tobytes())
+                yield term, total, len(docs)
+                total += len(docs)
+
+        # 词项按顺序插入，WITHOUT ROWID 表的主键索引顺序追加
+        conn.executemany("INSERT INTO terms (term, start, df) VALUES (?, ?, ?)", terms())
+    conn.commit()
+    conn.close()
+    for run in runs:
+        run.remove()
+
+    with open(path / "lexical.json", "w") as f:
+        json.dump({
+            'doc_count': doc_count,
+            'postings': total,
+            'avgdl': total_tokens / doc_count if doc_count else 0.0,
+            'k1': BM25_K1,
+            'b': BM25_B,
+        }, f)
+
+
+def _map(file_path, dtype, count):
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(count,))
+
+
+class LexicalIndex:
+    """只读的 BM25 倒排索引，倒排表以内存映射方式打开"""
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path / "lexical.json") as f:
+            meta = json.load(f)
+        self.doc_count = meta['doc_count']
+        self.avgdl = meta['avgdl'] or 1.0
+        self.k1 = meta['k1']
+        self.b = meta['b']
+        self._postings = _map(path / "postings.u32", np.uint32, meta['postings'])
+        self._tfs = _map(path / "postings_tf.u16", np.uint16, meta['postings'])
+        self._doclens = _map(path / "doclens.u32", np.uint32, self.doc_count)
+        self._connections = _Connections(path / "lexical.sqlite")
+
+    @classmethod
+    def load(cls, path):
+        """加载 path 下的倒排索引，不存在时（旧版本的索引）返回 None"""
+        if not (Path(path) / "lexical.json").exists():
+            return None
+        return cls(path)
+
+    def _lookup(self, terms):
+        placeholders = ",".join("?" * len(terms))
+        return self._connections.get().execute(
+            f"SELECT start, df FROM terms WHERE term IN ({placeholders})", terms
+        ).fetchall()
+
+    def search(self, query, k):
+        """返回 BM25 得分最高的 k 个 (行号, 得分)，没有任何词项命中时返回空列表"""
+        terms = list(set(tokenize(query)))
+        if not terms or self.doc_count == 0:
+            return []
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for start, df in self._lookup(terms):
+            docs = self._postings[start:start + df]
+            tf = self._tfs[start:start + df].astype(np.float32)
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._doclens[docs] / self.avgdl)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind='stable')]
+        return [(int(pos), float(scores[pos])) for pos in hits]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """倒数排名融合：每个排名列表中排第 r 位的结果得 1 / (k + r) 分，按总分排序返回"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])
@@ -0,0 +1,222 @@
+"""对话流并发压测
+
+启动模拟 Ark 服务和异步服务（asgi_app），上传一份小语料后同时打开大量 /api/chat 流，
+统计首字节时间、首个回答 token 时间和同时保持的流数量：
+
+python loadtest_chat.py --concurrency 300 --stream-tokens 100 --token-delay 0.05
+
+指定 --url 时压测已经在运行的服务（例如 python app.py 启动的 Flask 服务，
+需要自行把它的 ARK_BASE_URL 指向模拟服务），便于对比两种服务方式。
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from mock_ark_server import MockArkServer
+
+SERVER_DIR = Path(__file__).resolve().parent
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def start_asgi_server(mock, workdir, port):
+    """在临时目录中启动 uvicorn，使用模拟 Ark 服务"""
+    env = dict(
+        os.environ,
+        ARK_BASE_URL=mock.base_url,
+        ARK_API_KEY='test',
+        EMBEDDING_CACHE_MAX_MB='0',
+        INGEST_WORKERS='1',
+    )
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi_app:app',
+         '--host', '127.0.0.1', '--port', str(port),
+         '--app-dir', str(SERVER_DIR), '--log-level', 'warning'],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/api/test", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未能在 {timeout} 秒内启动: {url}")
+
+
+def seed_documents(url, count=5):
+    """上传几篇生成的文档，让压测覆盖检索步骤"""
+    files = [
+        ('documents', (f'loadtest_{i}.txt', f"压测文档 {i}。\n" + f"这是第 {i} 篇文档的内容。" * 50, 'text/plain'))
+        for i in range(count)
+    ]
+    response = httpx.post(f"{url}/upload", files=files, timeout=120)
+    response.raise_for_status()
+    wait_for_job(url, response.json()['job_id'])
+
+
+def wait_for_job(url, job_id, timeout=300):
+    """轮询后台入库任务，直到处理完成"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = httpx.get(f"{url}/api/jobs/{job_id}", timeout=5).json()
+        if job['status'] == 'succeeded':
+            return job
+        if job['status'] == 'failed':
+            raise RuntimeError(f"入库任务失败: {job['error']}")
+        time.sleep(0.2)
+    raise RuntimeError(f"入库任务未能在 {timeout} 秒内完成: {job_id}")
+
+
+class StreamStats:
+    def __init__(self):
+        self.open_streams = 0
+        self.peak_open_streams = 0
+        self.ttfb = []
+        self.ttft = []
+        self.durations = []
+        self.events = 0
+        self.errors = []
+
+
+async def one_stream(client, url, i, stats):
+    start = time.perf_counter()
+    first_byte = first_token = None
+    payload = {
+        'messages': [{'role': 'user', 'content': f"压测问题 {i % 10}：文档里说了什么？"}],
+        'model': 'mock-chat',
+    }
+    try:
+        async with client.stream('POST', f"{url}/api/chat", json=payload) as response:
+            response.raise_for_status()
+            stats.open_streams += 1
+            stats.peak_open_streams = max(stats.peak_open_streams, stats.open_streams)
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith('data: '):
+                        continue
+                    now = time.perf_counter() - start
+                    if first_byte is None:
+                        first_byte = now
+                    if line == 'data: [DONE]':
+                        break
+                    event = json.loads(line[6:])
+                    if 'error' in event:
+                        raise RuntimeError(event['error'])
+                    stats.events += 1
+                    if first_token is None and 'content' in event['choices'][0]['delta']:
+                        first_token = now
+            finally:
+                stats.open_streams -= 1
+    except Exception as e:
+        stats.errors.append(f"{type(e).__name__}: {e}")
+        return
+    stats.durations.append(time.perf_counter() - start)
+    if first_byte is not None:
+        stats.ttfb.append(first_byte)
+    if first_token is not None:
+        stats.ttft.append(first_token)
+
+
+async def run_load(url, concurrency, total):
+    stats = StreamStats()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    timeout = httpx.Timeout(300, connect=30)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def guarded(i):
+            async with semaphore:
+                await one_stream(client, url, i, stats)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(guarded(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'completed': len(stats.durations),
+        'failed': len(stats.errors),
+        'peak_open_streams': stats.peak_open_streams,
+        'elapsed_s': round(elapsed, 3),
+        'streams_per_s': round(len(stats.durations) / elapsed, 2) if elapsed else None,
+        'events_per_s': round(stats.events / elapsed, 1) if elapsed else None,
+        'ttfb_ms_p50': ms(percentile(stats.ttfb, 50)),
+        'ttfb_ms_p99': ms(percentile(stats.ttfb, 99)),
+        'ttft_ms_p50': ms(percentile(stats.ttft, 50)),
+        'ttft_ms_p99': ms(percentile(stats.ttft, 99)),
+        'duration_ms_p50': ms(percentile(stats.durations, 50)),
+        'duration_ms_p99': ms(percentile(stats.durations, 99)),
+        'sample_errors': stats.errors[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/api/chat 并发流压测')
+    parser.add_argument('--url', help='压测已经在运行的服务，不指定时自动启动 asgi_app')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, help='总请求数，默认等于并发数')
+    parser.add_argument('--stream-tokens', type=int, default=50)
+    parser.add_argument('--reasoning-tokens', type=int, default=0)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟模型首个 token 前的等待（秒）')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    with MockArkServer(latency=args.latency, stream_tokens=args.stream_tokens,
+                       reasoning_tokens=args.reasoning_tokens, token_delay=args.token_delay) as mock, \
+            tempfile.TemporaryDirectory() as workdir:
+        server = None
+        url = args.url
+        if url is None:
+            url = f"http://127.0.0.1:{args.port}"
+            server = start_asgi_server(mock, workdir, args.port)
+        try:
+            wait_until_ready(url)
+            if server is not None:
+                seed_documents(url)
+            result = asyncio.run(run_load(url, args.concurrency, args.requests or args.concurrency))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+    result['mock'] = {
+        'latency_s': args.latency,
+        'stream_tokens': args.stream_tokens,
+        'reasoning_tokens': args.reasoning_tokens,
+        'token_delay_s': args.token_delay,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""请求日志的异步输出
+
+请求、检索上下文和完整回答的日志可能很长，原来在请求线程里同步格式化（json.dumps、拼接字符串）
+并写入 stderr。这里改为：请求线程只把原始字段放进 LogRecord，通过有界队列交给后台线程，
+由后台线程截断、格式化并写出。队列满时直接丢弃并计数，不阻塞请求。
+
+LOG_FORMAT                 json（默认，每条日志一行 JSON）或 text（原来的多行文本格式）
+LOG_MAX_FIELD_CHARS        单个字段最多保留的字符数，超出部分截断（默认 2000，0 表示不截断）
+LOG_PAYLOAD_SAMPLE_RATE    完整内容（请求数据、检索上下文、完整回答）的抽样比例（默认 0.1），
+                           未抽中时只记录长度等摘要；按问题文本哈希抽样，同一个问题的几条日志一起保留
+LOG_QUEUE_SIZE             队列长度（默认 10000）
+
+gunicorn 预加载应用后 fork 出的 worker 没有主进程的后台线程，每个进程在第一次写日志时启动自己的队列和线程。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', 2000))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.1))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# flush / stop 最多等待后台线程这么久（秒），写出端卡住时不让调用方（包括进程退出）一直等下去
+FLUSH_TIMEOUT = 5.0
+
+
+def truncate(value, max_chars=None):
+    """截断过长的字符串，末尾注明原长度"""
+    max_chars = LOG_MAX_FIELD_CHARS if max_chars is None else max_chars
+    if max_chars and isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}...(共 {len(value)} 字)"
+    return value
+
+
+def sampled(key, rate=None):
+    """按 key 的哈希决定是否记录完整内容，同一个 key 的结果总是相同"""
+    rate = LOG_PAYLOAD_SAMPLE_RATE if rate is None else rate
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    return zlib.crc32(str(key).encode('utf-8')) < rate * 2 ** 32
+
+
+def _render(value, max_chars):
+    """在后台线程中把字段转成可写出的值：dict/list 序列化为 JSON 后截断"""
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return truncate(value, max_chars)
+
+
+class JSONLineFormatter(logging.Formatter):
+    """每条日志输出一行 JSON：时间、级别、消息和 record.fields 中的字段"""
+
+    def __init__(self, max_chars=None):
+        super().__init__()
+        self.max_chars = LOG_MAX_FIELD_CHARS if max_chars is None else max_chars
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'message': truncate(record.getMessage(), self.max_chars),
+        }
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            entry[key] = _render(value, self.max_chars)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """原来的多行文本格式：消息之后逐行列出 record.fields，最后一行分隔线"""
+
+    def __init__(self, max_chars=None):
+        super().__init__(fmt='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.max_chars = LOG_MAX_FIELD_CHARS if max_chars is None else max_chars
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            lines = []
+            for key, value in fields.items():
+                value = _render(value, self.max_chars)
+                lines.append(f"{key}:\n{value}" if isinstance(value, str) and '\n' in value else f"{key}: {value}")
+            text += "\n" + "\n".join(lines) + "\n" + "-" * 80
+        return text
+
+
+class _Listener(QueueListener):
+    """停止时限时放入结束标记：队列满时 QueueListener.stop 的 put_nowait 会抛出 queue.Full"""
+
+    def stop(self, timeout=FLUSH_TIMEOUT):
+        try:
+            self.queue.put(self._sentinel, timeout=timeout)
+        except queue.Full:
+            return  # 后台线程卡住，放弃等待；它是守护线程，随进程退出
+        self._thread.join(timeout)
+        self._thread = None
+
+
+class AsyncQueueHandler(QueueHandler):
+    """把日志放进有界队列，由后台线程交给 handlers 写出；每个进程使用自己的队列和线程
+
+    enqueue 在锁内检查进程号并放入队列，stop 也在锁内放入结束标记，日志不会排在结束标记之后。
+    """
+
+    def __init__(self, handlers, maxsize=None):
+        super().__init__(None)
+        self.handlers = handlers
+        self.maxsize = LOG_QUEUE_SIZE if maxsize is None else maxsize
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def _start(self):
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._pid != os.getpid():
+            # 从父进程继承的队列没有线程在读，直接换成新的
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = _Listener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # 不在请求线程里格式化消息和字段，只把异常信息转成文本（traceback 会持有整个调用栈）
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        with self._lock:
+            self._start_locked()
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """等后台线程写完队列中已有的日志（最多 timeout 秒），不停止后台线程"""
+        if self._pid != os.getpid():
+            return
+        q = self.queue
+        deadline = time.monotonic() + timeout
+        with q.all_tasks_done:
+            while q.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return  # 写出端卡住，不再等它（handler.flush 也要等同一把锁）
+                q.all_tasks_done.wait(remaining)
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self, timeout=FLUSH_TIMEOUT):
+        """写出剩下的日志并停止后台线程，之后再有日志时重新启动"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop(timeout)
+            self._listener, self._pid = None, None
+
+
+def async_handler(stream=None, log_format=None, max_chars=None, maxsize=None):
+    """创建写到 stream（默认 stderr）的异步日志处理器"""
+    log_format = log_format or LOG_FORMAT
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(TextFormatter(max_chars) if log_format == 'text' else JSONLineFormatter(max_chars))
+    return AsyncQueueHandler([handler], maxsize=maxsize)
@@ -0,0 +1,284 @@
+"""各阶段耗时统计，以 Prometheus 文本格式从 /metrics 输出
+
+rag_stage_seconds{stage=...} 记录对话、检索和入库各阶段的耗时分布：
+
+对话   history、retrieval、context_build、llm_first_token、llm_stream
+检索   query_embedding（未命中缓存时的查询向量化）、index_search（本地向量/关键词检索）、search_batch
+向量   embed_request（每次向量接口请求，含重试）
+索引   index_load、index_save、ingest_scan、ingest_embed、ingest_total
+
+rag_llm_tokens_per_second 记录模型流式输出的速度（按收到的片段数计）。
+
+METRICS_ENABLED   是否统计（默认开启）；关闭时 timer 返回空的上下文管理器，几乎没有开销
+METRICS_MODELS    按模型统计输出速度时使用的模型列表（逗号分隔，默认为前端可选的模型），
+                  model 由客户端传入，不在列表中的一律记为 other，避免任意取值产生无限多的序列
+SERVER_TIMING     是否在响应中附带本次请求各阶段的耗时（默认关闭）：普通接口用 Server-Timing 响应头，
+                  /api/chat 的响应头在检索之前就已发出，改为在流结束前发送一行 SSE 注释 ": server-timing ..."
+
+METRICS_DIR             多进程部署时各进程写出统计的共用目录（gunicorn.conf.py 默认设置）：每个进程每隔
+                        METRICS_FLUSH_INTERVAL 秒（默认 1）把自己的直方图写入 <pid>.json，/metrics 汇总目录下
+                        所有进程（包括已退出的 worker）的数据，不论请求落到哪个 worker，计数都不会倒退。
+                        不设置时只统计当前进程。服务启动时应清空该目录
+连接池、语义缓存等 gauge 是处理该请求的进程的当前值，带有 pid 标签。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+METRICS_ENABLED = _env_flag('METRICS_ENABLED', '1')
+SERVER_TIMING = _env_flag('SERVER_TIMING', '0')
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+METRICS_MODELS = frozenset(
+    name.strip()
+    for name in os.getenv('METRICS_MODELS',
+                          'deepseek-v3-241226,deepseek-r1-250120,deepseek-chat,deepseek-reasoner').split(',')
+    if name.strip()
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (5, 10, 20, 40, 80, 160, 320, 640)
+
+
+def _escape_label(value):
+    """按 Prometheus 文本格式转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """按标签值分组的直方图，输出累计的 bucket 计数、总和与次数"""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _current_series(self):
+        # fork 出的子进程从空的统计开始，父进程的数据由父进程自己写出，汇总时不会重复计算
+        if self._pid != os.getpid():
+            self._series = {}
+            self._pid = os.getpid()
+        return self._series
+
+    def observe(self, label_value, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._current_series().get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """{标签值: (各 bucket 计数, 总和, 次数)}"""
+        with self._lock:
+            return {key: (list(counts), total, count)
+                    for key, (counts, total, count) in self._current_series().items()}
+
+    def render(self, snapshot=None):
+        """snapshot 为多个进程汇总后的数据，不传时输出当前进程的数据"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        for label_value, (counts, total, count) in sorted(snapshot.items()):
+            label = f'{self.label}="{_escape_label(label_value)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {_format_value(total)}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+class RequestTimings:
+    """单个请求各阶段的耗时，用于 Server-Timing"""
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, stage, seconds):
+        self.stages.append((stage, seconds))
+
+    def header(self):
+        """Server-Timing 的值，例如 retrieval;dur=12.3, context_build;dur=0.4"""
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages)
+
+
+class _StageTimer:
+    __slots__ = ('_metrics', '_stage', '_timings', '_started')
+
+    def __init__(self, metrics, stage, timings):
+        self._metrics = metrics
+        self._stage = stage
+        self._timings = timings
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.observe(self._stage, time.perf_counter() - self._started, self._timings)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """阶段耗时统计和 /metrics 输出
+
+    directory 不为 None 时，各进程把统计写入该目录，render 汇总所有进程的数据。
+    """
+
+    def __init__(self, enabled=None, server_timing=None, models=None, directory=None,
+                 flush_interval=METRICS_FLUSH_INTERVAL):
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self.server_timing = SERVER_TIMING if server_timing is None else server_timing
+        self.models = METRICS_MODELS if models is None else frozenset(models)
+        self.stages = Histogram('rag_stage_seconds', '各阶段耗时（秒）', 'stage', LATENCY_BUCKETS)
+        self.rates = Histogram('rag_llm_tokens_per_second', '模型流式输出速度（片段/秒）', 'model', RATE_BUCKETS)
+        self._gauges = []
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self._flusher_pid = None
+        self._flush_lock = threading.Lock()
+        self._flushed = None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # 正常退出的进程写出最后的数据；fork 出的 worker 继承这个回调，写出的是自己的文件
+            atexit.register(self.flush)
+
+    @property
+    def _histograms(self):
+        return (self.stages, self.rates)
+
+    def timer(self, stage, timings=None):
+        """统计 with 块的耗时；timings 为 RequestTimings 时同时记入本次请求"""
+        if not self.enabled and timings is None:
+            return _NULL_TIMER
+        return _StageTimer(self, stage, timings)
+
+    def observe(self, stage, seconds, timings=None):
+        if self.enabled:
+            self.stages.observe(stage, seconds)
+            self._ensure_flusher()
+        if timings is not None:
+            timings.add(stage, seconds)
+
+    def observe_rate(self, model, chunks, seconds):
+        if self.enabled and chunks and seconds > 0:
+            label = model if isinstance(model, str) and model in self.models else 'other'
+            self.rates.observe(label, chunks / seconds)
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # 线程不会随 fork 复制到 worker，按进程号判断，每个进程第一次统计时启动写出线程
+        if self.directory is None or self._flusher_pid == os.getpid():
+            return
+        with self._flush_lock:
+            if self._flusher_pid != os.getpid():
+                self._flusher_pid = os.getpid()
+                threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """把当前进程的统计写入 directory/<pid>.json（先写临时文件再改名），没有变化时不写"""
+        if self.directory is None:
+            return
+        data = {histogram.name: histogram.snapshot() for histogram in self._histograms}
+        with self._flush_lock:
+            if not any(data.values()) or data == self._flushed:
+                return
+            path = self.directory / f"{os.getpid()}.json"
+            tmp_path = path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, path)
+            self._flushed = data
+
+    def _merged(self):
+        """汇总 directory 下所有进程写出的统计，{直方图名称: {标签值: (各 bucket 计数, 总和, 次数)}}"""
+        merged = {histogram.name: {} for histogram in self._histograms}
+        for path in self.directory.glob('*.json'):
+            try:
+                data = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue  # 文件刚被删除，或者不是统计文件
+            for name, series in data.items():
+                target = merged.get(name)
+                if target is None:
+                    continue
+                for label_value, (counts, total, count) in series.items():
+                    current = target.get(label_value)
+                    if current is None or len(current[0]) != len(counts):
+                        target[label_value] = (list(counts), total, count)
+                    else:
+                        target[label_value] = ([a + b for a, b in zip(current[0], counts)],
+                                               current[1] + total, current[2] + count)
+        return merged
+
+    def request_timings(self):
+        """开启 SERVER_TIMING 时返回新的 RequestTimings，否则返回 None"""
+        return RequestTimings() if self.server_timing else None
+
+    def register_gauges(self, prefix, collect):
+        """/metrics 输出时调用 collect()，把返回的 dict 中的数值作为 gauge 输出，名称为 prefix_键"""
+        self._gauges.append((prefix, collect))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        if self.directory is not None:
+            self.flush()
+            merged = self._merged()
+            lines = []
+            for histogram in self._histograms:
+                lines += histogram.render(merged[histogram.name])
+        else:
+            lines = self.stages.render() + self.rates.render()
+        pid = os.getpid()
+        for prefix, collect in self._gauges:
+            for key, value in collect().items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f'{prefix}_{key}{{pid="{pid}"}} {_format_value(value)}')
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共用的统计
+metrics = Metrics(directory=METRICS_DIR)
@@ -0,0 +1,217 @@
+"""本地模拟的 Ark（OpenAI 兼容）接口，用于离线测试和压测
+
+python mock_ark_server.py --port 8900 --latency 0.05
+然后设置 ARK_BASE_URL=http://127.0.0.1:8900/api/v3 启动服务即可。
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_DIM = 256
+
+
+def fake_embedding(text, dim=DEFAULT_DIM):
+    """根据文本生成确定性的单位向量，相同文本总是得到相同向量"""
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，不关闭 Nagle 算法时每个请求都会多等一个延迟确认（约 40 毫秒）
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # 连接预热会发 GET 请求，返回 404 但保持连接，与真实服务的行为一致
+        self._send_json(404, {'error': {'message': 'Not found', 'type': 'not_found'}})
+
+    def do_POST(self):
+        mock = self.server.mock
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        with mock.lock:
+            mock.stats['requests'] += 1
+            mock.stats['in_flight'] += 1
+            mock.stats['max_in_flight'] = max(mock.stats['max_in_flight'], mock.stats['in_flight'])
+            request_no = mock.stats['requests']
+        try:
+            if mock.latency:
+                time.sleep(mock.latency)
+            if mock.throttle_every and request_no % mock.throttle_every == 0:
+                with mock.lock:
+                    mock.stats['throttled'] += 1
+                self._send_json(429, {'error': {'message': 'Too many requests', 'type': 'rate_limit_error'}},
+                                headers={'Retry-After': '0'})
+                return
+            if self.path.endswith('/embeddings'):
+                self._handle_embeddings(payload)
+            elif self.path.endswith('/chat/completions'):
+                self._handle_chat(payload)
+            else:
+                self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+        finally:
+            with mock.lock:
+                mock.stats['in_flight'] -= 1
+
+    def _handle_embeddings(self, payload):
+        mock = self.server.mock
+        inputs = payload.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        with mock.lock:
+            mock.stats['embedded_texts'] += len(inputs)
+        tokens = sum(len(text) for text in inputs)
+        self._send_json(200, {
+            'object': 'list',
+            'model': payload.get('model', 'mock-embedding'),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, mock.dim)}
+                for i, text in enumerate(inputs)
+            ],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _handle_chat(self, payload):
+        mock = self.server.mock
+        model = payload.get('model', 'mock-chat')
+        completion_id = f"chatcmpl-mock-{int(time.time() * 1000)}"
+        deltas = [{'reasoning_content': f"思考{i} "} for i in range(mock.reasoning_tokens)]
+        deltas += [{'content': f"词{i} "} for i in range(mock.stream_tokens)]
+        with mock.lock:
+            mock.stats['chat_requests'] += 1
+
+        if not payload.get('stream'):
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(d.get('content', '') for d in deltas)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(deltas), 'total_tokens': len(deltas)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+
+        try:
+            for delta in deltas:
+                if mock.token_delay:
+                    time.sleep(mock.token_delay)
+                self._write_chunk(f"data: {json.dumps(chunk(delta))}\n\n".encode('utf-8'))
+            self._write_chunk(f"data: {json.dumps(chunk({}, 'stop'))}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 压测时会有数百个并发连接
+
+
+class MockArkServer:
+    """在后台线程中运行的模拟 Ark 服务
+
+    latency: 每个请求的固定延迟（秒），对聊天接口即首个 token 之前的等待
+    throttle_every: 每第 N 个请求返回 429，0 表示不限流
+    stream_tokens / reasoning_tokens: 聊天接口流式返回的回答和推理 token 数
+    token_delay: 流式返回时每个 token 之间的间隔（秒）
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, dim=DEFAULT_DIM, latency=0.0, throttle_every=0,
+                 stream_tokens=20, reasoning_tokens=0, token_delay=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.stream_tokens = stream_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.token_delay = token_delay
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'in_flight': 0, 'max_in_flight': 0,
+                      'embedded_texts': 0, 'chat_requests': 0}
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟 Ark 接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--dim', type=int, default=DEFAULT_DIM)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--stream-tokens', type=int, default=20)
+    parser.add_argument('--reasoning-tokens', type=int, default=0)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockArkServer(args.host, args.port, args.dim, args.latency, args.throttle_every,
+                           args.stream_tokens, args.reasoning_tokens, args.token_delay)
+    print(f"模拟 Ark 服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,134 @@
+"""语义答案缓存（可选，SEMANTIC_CACHE=1 开启）
+
+记录过去的 (问题向量, 检索到的上下文, 最终答案)。新问题的向量与某条记录足够相似
+（余弦相似度不低于 SEMANTIC_CACHE_THRESHOLD），并且检索到的上下文完全相同时，
+直接回放记录的答案，不再调用模型。
+
+上下文相同才可能命中，所以记录按 (模型, 上下文哈希) 分组，只和同组的少量记录比较相似度。
+索引发布新版本后全部记录失效；记录有 TTL，总数超过上限时淘汰最久未命中的。
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+
+def _env_flag(name):
+    return os.getenv(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+class _Entry(namedtuple('_Entry', ['group', 'vector', 'answer', 'expires_at'])):
+    __slots__ = ()
+
+
+def context_digest(context):
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()
+
+
+class SemanticAnswerCache:
+    """按问题语义和检索上下文缓存模型答案，线程安全"""
+
+    def __init__(self, enabled=None, threshold=None, maxsize=None, ttl=None):
+        self.enabled = _env_flag('SEMANTIC_CACHE') if enabled is None else enabled
+        self.threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95)) if threshold is None else threshold
+        self.maxsize = int(os.getenv('SEMANTIC_CACHE_SIZE', 1000)) if maxsize is None else maxsize
+        self.ttl = float(os.getenv('SEMANTIC_CACHE_TTL', 3600)) if ttl is None else ttl
+        self._entries = OrderedDict()  # 记录 ID -> _Entry，按最近命中排序
+        self._groups = {}  # (模型, 上下文哈希) -> {记录 ID}
+        self._next_id = 0
+        self._index_version = None  # 当前记录对应的索引版本
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version):
+        """调用方需持有锁；索引版本变化后清空全部记录，返回该版本是否可用"""
+        if self._index_version is None or index_version > self._index_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._groups.clear()
+            self._index_version = index_version
+        return index_version == self._index_version
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._groups[entry.group]
+        ids.discard(entry_id)
+        if not ids:
+            del self._groups[entry.group]
+
+    def lookup(self, embedding, model, context, index_version):
+        """查找可以复用的答案，没有时返回 None"""
+        group = (model, context_digest(context))
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if not self._check_version(index_version):
+                self.misses += 1
+                return None
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._groups.get(group, ())):
+                entry = self._entries[entry_id]
+                if entry.expires_at <= now:
+                    self._remove(entry_id)
+                    continue
+                score = float(vector @ entry.vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].answer
+
+    def put(self, embedding, model, context, index_version, answer):
+        """记录一个完整的答案；答案生成期间索引已经更新时不记录"""
+        if not answer or self.maxsize <= 0:
+            return
+        group = (model, context_digest(context))
+        entry = _Entry(group, self._normalize(embedding), answer, time.monotonic() + self.ttl)
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._groups.setdefault(group, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
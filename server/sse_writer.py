@@ -0,0 +1,167 @@
+"""聊天流的 SSE 事件编码
+
+每个 token 都要生成一个事件，对话流多的时候逐个构造字典再 json.dumps 的开销不可忽略。
+这里为推理内容和正式回答两种事件预先准备好帧的前后缀，只对文本本身做 JSON 字符串转义
+（json 模块的 C 实现），输出与 json.dumps 构造的事件逐字节相同。
+
+SSEWriter 还可以把短时间内连续到达的同类小片段合并成一帧发送，减少写出次数：
+
+SSE_FLUSH_INTERVAL    合并的时间窗口（毫秒，默认 0，即不合并，每个片段单独发送）
+SSE_BATCH_MAX_CHARS   合并后一帧最多的字符数（默认 256）
+
+推理内容和正式回答各自的第一个片段总是立即发出，合并不影响首 token 延迟。
+上游停顿时缓存的片段也要按时发出：paced / apaced 迭代上游片段，等待下一个片段最多等到
+合并窗口结束（SSEWriter.remaining），超时时产出 None，调用方此时调用 flush 发出缓存的片段。
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from json.encoder import encode_basestring_ascii
+
+REASONING_PREFIX = b'data: {"choices": [{"delta": {"reasoning_content": '
+CONTENT_PREFIX = b'data: {"choices": [{"delta": {"content": '
+FRAME_SUFFIX = b'}}]}\n\n'
+
+SSE_FLUSH_INTERVAL = float(os.getenv('SSE_FLUSH_INTERVAL', 0)) / 1000
+SSE_BATCH_MAX_CHARS = int(os.getenv('SSE_BATCH_MAX_CHARS', 256))
+
+
+def encode_reasoning(text):
+    return REASONING_PREFIX + encode_basestring_ascii(text).encode('ascii') + FRAME_SUFFIX
+
+
+def encode_content(text):
+    return CONTENT_PREFIX + encode_basestring_ascii(text).encode('ascii') + FRAME_SUFFIX
+
+
+class SSEWriter:
+    """把模型的流式片段编码成 SSE 事件，可选地把连续的同类片段合并成一帧
+
+    write 返回需要立即发出的字节（可能为 None），流结束时调用 flush 取出剩下的部分。
+    """
+
+    def __init__(self, flush_interval=None, max_chars=None, clock=time.monotonic):
+        self.flush_interval = SSE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_chars = max_chars or SSE_BATCH_MAX_CHARS
+        self._clock = clock
+        self._pending = []
+        self._pending_chars = 0
+        self._pending_answer = False
+        self._started = 0.0
+        self._first_sent = set()  # 已经发出过第一个片段的类型（is_answer 的取值）
+        self.frames = 0
+        self.deltas = 0
+
+    def write(self, text, is_answer):
+        """编码一个片段；is_answer 为 True 时是正式回答，否则是推理内容"""
+        self.deltas += 1
+        if self.flush_interval <= 0:
+            self.frames += 1
+            return encode_content(text) if is_answer else encode_reasoning(text)
+
+        out = None
+        if self._pending and is_answer != self._pending_answer:
+            out = self._take()
+        if is_answer not in self._first_sent:
+            # 每种片段的第一个立即发出
+            self._first_sent.add(is_answer)
+            self.frames += 1
+            frame = encode_content(text) if is_answer else encode_reasoning(text)
+            return out + frame if out else frame
+        if not self._pending:
+            self._started = self._clock()
+            self._pending_answer = is_answer
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.max_chars or self._clock() - self._started >= self.flush_interval:
+            out = out + self._take() if out else self._take()
+        return out
+
+    def flush(self):
+        """取出还没有发出的片段，没有时返回 None"""
+        return self._take() if self._pending else None
+
+    def remaining(self):
+        """距离缓存的片段必须发出还有多少秒；没有缓存的片段时返回 None"""
+        if not self._pending:
+            return None
+        return max(0.0, self._started + self.flush_interval - self._clock())
+
+    def _take(self):
+        text = ''.join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self.frames += 1
+        return encode_content(text) if self._pending_answer else encode_reasoning(text)
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+def paced(chunks, writer):
+    """迭代上游片段；writer 有缓存的片段而上游超过合并窗口还没有新片段时产出 None
+
+    合并开启时由后台线程读取上游，主循环按 writer.remaining() 限时等待。
+    """
+    if writer.flush_interval <= 0:
+        yield from chunks
+        return
+    items = queue.Queue()
+
+    def pump():
+        try:
+            for chunk in chunks:
+                items.put(chunk)
+        except BaseException as e:
+            items.put(_Failure(e))
+        finally:
+            items.put(_END)
+
+    threading.Thread(target=pump, name='sse-upstream', daemon=True).start()
+    while True:
+        try:
+            item = items.get(timeout=writer.remaining())
+        except queue.Empty:
+            yield None
+            continue
+        if item is _END:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+async def apaced(chunks, writer):
+    """paced 的异步版本：等待下一个片段时用 asyncio.wait 限时，超时不会取消对上游的读取"""
+    if writer.flush_interval <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = writer.remaining()
+            if timeout is not None:
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield None
+                    continue
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                return
+            pending = None
+            yield chunk
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
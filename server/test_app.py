@@ -1,6 +1,7 @@
 import requests
 import json
 import os
+import time
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -40,7 +41,18 @@ def test_upload_document():
         print(f"上传请求失败: {str(e)}")
         return False
     
-    return response.status_code == 200
+    if response.status_code != 202:
+        return False
+    
+    # 文档在后台处理，轮询任务状态直到完成
+    job_id = response.json()['job_id']
+    for _ in range(120):
+        job = requests.get(f'{BASE_URL}/api/jobs/{job_id}').json()
+        print(f"任务状态: {job['status']}, 阶段: {job['stage']}")
+        if job['status'] in ('succeeded', 'failed'):
+            return job['status'] == 'succeeded'
+        time.sleep(1)
+    return False
 
 def test_chat_endpoint():
     """测试聊天接口"""
@@ -0,0 +1,33 @@
+import json
+import sys
+
+import benchmark_suite
+
+
+def test_offline_scenarios_write_json(tmp_path, monkeypatch):
+    """测试入库、冷启动加载和检索场景在模拟服务上运行，结果写成 JSON 并能与上一次对比"""
+    print("\n1. 测试离线基准测试套件...")
+    # benchmark_suite 会设置这些环境变量，测试结束时由 monkeypatch 恢复
+    for key in ('ARK_API_KEY', 'EMBEDDING_CACHE_MAX_MB', 'INGEST_WORKERS'):
+        monkeypatch.delenv(key, raising=False)
+    output = tmp_path / "bench.json"
+    for compare in ([], ['--compare', str(output)]):
+        monkeypatch.setattr(sys, 'argv', ['benchmark_suite.py', '--scenarios', 'ingest,index_load,search',
+                                          '--docs', '6', '--queries', '10', '--output', str(output)] + compare)
+        benchmark_suite.main()
+    report = json.loads(output.read_text())
+
+    results = report['results']
+    assert set(results) == {'ingest', 'index_load', 'search'}
+    assert results['ingest']['docs'] == 6 and results['ingest']['chunks'] >= 6
+    assert results['index_load']['chunks'] == results['ingest']['chunks']
+    assert results['search']['uncached']['latency_ms_p99'] >= results['search']['uncached']['latency_ms_p50']
+    assert report['args']['docs'] == 6 and report['python']
+    flat = benchmark_suite.flatten(results)
+    assert 'search.cached.latency_ms_p50' in flat and 'search.mode' not in flat
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 基准测试套件测试完成 ===")
@@ -0,0 +1,81 @@
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from context_builder import assemble_context, count_tokens
+from ingest import CHUNK_SIZE, CHUNK_OVERLAP
+
+
+def split(text, source, add_start_index=True):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=add_start_index
+    )
+    return splitter.split_documents([Document(page_content=text, metadata={'source': source})])
+
+
+def sentences(prefix, count):
+    return "".join(f"{prefix}第 {i} 句话，内容编号 {prefix}{i:04d}。" for i in range(count))
+
+
+def test_merge_overlapping_chunks():
+    """测试同一来源中重叠、相邻的文本块合并为一段，合并结果与原文一致"""
+    print("\n1. 测试合并重叠的文本块...")
+    text = sentences("甲", 200)
+    chunks = split(text, "a.txt")
+    assert len(chunks) >= 4
+    # 打乱排名顺序，合并后仍按原文顺序拼接
+    candidates = [chunks[2], chunks[0], chunks[1], chunks[3]]
+    result = assemble_context(candidates, token_budget=100000)
+    assert len(result.docs) == 1
+    merged = result.docs[0]
+    start = chunks[0].metadata['start_index']
+    assert text[start:start + len(merged.page_content)] == merged.page_content
+    assert merged.metadata['chunks'] == 4
+    assert merged.page_content.startswith(chunks[0].page_content)
+    assert merged.page_content.endswith(chunks[3].page_content)
+    # 去重后的上下文比直接拼接短
+    assert result.tokens < sum(count_tokens(chunk.page_content) for chunk in candidates)
+
+    # 不相邻的块和其他文件的块不会合并
+    other = split(sentences("乙", 50), "b.txt")
+    result = assemble_context([chunks[0], chunks[3], other[0], chunks[0]], token_budget=100000)
+    assert [doc.metadata['source'] for doc in result.docs] == ["a.txt", "a.txt", "b.txt"]
+    assert result.docs[0].metadata['chunks'] == 2  # 重复的块并入第一段
+
+
+def test_merge_without_start_index():
+    """测试旧索引中没有位置信息的文本块按首尾重合的内容合并"""
+    print("\n2. 测试按文本重合合并...")
+    text = sentences("丙", 120)
+    chunks = split(text, "c.txt", add_start_index=False)
+    assert len(chunks) >= 2
+    result = assemble_context([chunks[1], chunks[0]], token_budget=100000)
+    assert len(result.docs) == 1
+    assert result.docs[0].page_content in text
+    assert result.docs[0].page_content.startswith(chunks[0].page_content)
+
+
+def test_token_budget():
+    """测试上下文不超过 token 预算，排名靠前的块优先，放不下的块跳过"""
+    print("\n3. 测试 token 预算...")
+    candidates = [
+        split(sentences("丁", 60), "d.txt")[0],
+        split(sentences("戊", 60), "e.txt")[0],
+        Document(page_content="短片段。", metadata={'source': "f.txt"}),
+    ]
+    first_tokens = count_tokens(candidates[0].page_content)
+    budget = first_tokens + 50
+    result = assemble_context(candidates, token_budget=budget)
+    assert [doc.metadata['source'] for doc in result.docs] == ["d.txt", "f.txt"]
+    assert result.dropped == 1
+    assert result.candidates == 3
+    assert result.tokens <= budget
+    assert result.tokens == count_tokens(result.context)
+
+    assert assemble_context([], token_budget=budget) == ([], "", 0, 0, 0)
+
+
+if __name__ == '__main__':
+    test_merge_overlapping_chunks()
+    test_merge_without_start_index()
+    test_token_budget()
+    print("\n=== 上下文组装测试完成 ===")
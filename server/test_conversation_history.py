@@ -0,0 +1,115 @@
+import asyncio
+
+from context_builder import count_tokens
+from conversation_history import ConversationHistory, condense_query, message_tokens
+
+
+def make_turns(count, size=200):
+    messages = []
+    for i in range(count):
+        messages.append({'role': 'user', 'content': f"第 {i} 个问题：" + "问" * size})
+        messages.append({'role': 'assistant', 'content': f"第 {i} 个回答：" + "答" * size})
+    return messages
+
+
+class Summarizer:
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return f"摘要 {len(self.prompts)}"
+
+
+def test_window_and_summary_cache():
+    """测试超出预算时较早的消息由摘要代替，摘要按对话缓存，前缀不变时不重复生成"""
+    print("\n1. 测试历史窗口和摘要缓存...")
+    turn_tokens = message_tokens(make_turns(1)[0]) * 2
+    history = ConversationHistory(token_budget=turn_tokens * 4, keep_ratio=0.5)
+    summarize = Summarizer()
+
+    # 没超出预算时原样发送，不生成摘要
+    messages = make_turns(3) + [{'role': 'user', 'content': "新问题"}]
+    window = history.trim('c1', messages, summarize)
+    assert window.messages == messages and window.summary is None and not summarize.prompts
+
+    # 超出预算后截掉较早的轮次，保留的部分从用户消息开始
+    messages = make_turns(6) + [{'role': 'user', 'content': "新问题"}]
+    window = history.trim('c1', messages, summarize)
+    assert len(summarize.prompts) == 1
+    assert window.summary == "摘要 1"
+    assert window.messages == messages[window.covered:]
+    assert window.messages[0]['role'] == 'user' and window.messages[-1]['content'] == "新问题"
+    assert sum(message_tokens(m) for m in window.messages) <= history.token_budget
+
+    # 之后几轮复用缓存的摘要
+    covered = window.covered
+    messages = messages[:-1] + make_turns(1)[:1]
+    window = history.trim('c1', messages, summarize)
+    assert len(summarize.prompts) == 1
+    assert window.summary == "摘要 1" and window.covered == covered
+
+    # 再次超出预算时只总结新截掉的消息，并带上之前的摘要
+    messages = make_turns(12) + [{'role': 'user', 'content': "新问题"}]
+    window = history.trim('c1', messages, summarize)
+    assert len(summarize.prompts) == 2
+    assert "摘要 1" in summarize.prompts[1][1]['content']
+    assert messages[0]['content'] not in summarize.prompts[1][1]['content']
+    assert window.covered > covered and window.summary == "摘要 2"
+
+    # 较早的消息被修改后（例如编辑了问题），缓存的摘要失效
+    edited = [{'role': 'user', 'content': "修改后的问题"}] + messages[1:]
+    window = history.trim('c1', edited, summarize)
+    assert len(summarize.prompts) == 3
+    assert "修改后的问题" in summarize.prompts[2][1]['content']
+
+    # 其他对话不共用摘要
+    window = history.trim('c2', messages, summarize)
+    assert len(summarize.prompts) == 4
+
+    assert history.stats()['summaries_computed'] == 4
+
+
+def test_summary_failure_and_async():
+    """测试摘要失败时只截断历史，以及异步版本"""
+    print("\n2. 测试摘要失败和异步版本...")
+    history = ConversationHistory(token_budget=500, keep_ratio=0.5)
+    messages = make_turns(6) + [{'role': 'user', 'content': "新问题"}]
+
+    def fail(prompt):
+        raise RuntimeError("模型不可用")
+
+    window = history.trim('c1', messages, fail)
+    assert window.summary is None and window.covered > 0
+    assert window.messages[-1]['content'] == "新问题"
+    assert len(history.summary_cache) == 0
+
+    async def summarize(prompt):
+        return "异步摘要"
+
+    window = asyncio.run(history.atrim('c1', messages, summarize))
+    assert window.summary == "异步摘要"
+    assert history.trim('c1', messages, fail).summary == "异步摘要"
+
+
+def test_condense_query():
+    """测试检索查询：较短的追问带上之前的问题，完整的问题单独使用"""
+    print("\n3. 测试检索查询...")
+    messages = [
+        {'role': 'user', 'content': "FAISS 的 HNSW 索引怎么配置？"},
+        {'role': 'assistant', 'content': "设置 INDEX_SPEC=HNSW32 即可。"},
+        {'role': 'user', 'content': "那 IVF 呢？"},
+    ]
+    assert condense_query(messages) == "FAISS 的 HNSW 索引怎么配置？\n那 IVF 呢？"
+
+    long_question = "请详细介绍一下向量检索中倒排文件索引的训练过程、nprobe 参数的含义以及它对召回率和延迟的影响"
+    assert count_tokens(long_question) >= 16
+    assert condense_query(messages + [{'role': 'user', 'content': long_question}]) == long_question
+    assert condense_query([{'role': 'user', 'content': "你好"}]) == "你好"
+
+
+if __name__ == '__main__':
+    test_window_and_summary_cache()
+    test_summary_failure_and_async()
+    test_condense_query()
+    print("\n=== 对话历史测试完成 ===")
@@ -0,0 +1,149 @@
+from document_store import ArkEmbeddings
+from embedding_cache import EmbeddingCache
+from mock_ark_server import MockArkServer, fake_embedding
+import asyncio
+import tempfile
+import threading
+import os
+
+
+def test_embed_documents_concurrent():
+    """测试并发批量向量化：结果保持输入顺序，且请求确实并发"""
+    print("\n1. 测试并发批量向量化...")
+    texts = [f"第 {i} 段测试文本。" * (i % 7 + 1) for i in range(95)]
+
+    with MockArkServer(latency=0.05) as server:
+        embeddings = ArkEmbeddings(
+            api_key='test',
+            base_url=server.base_url,
+            max_concurrency=4,
+            max_batch_size=10
+        )
+        vectors = embeddings.embed_documents(texts)
+        print(f"请求数: {server.stats['requests']}, 最大并发: {server.stats['max_in_flight']}")
+
+        assert len(vectors) == len(texts)
+        for text, vector in zip(texts, vectors):
+            assert vector == fake_embedding(text, server.dim)
+        assert server.stats['max_in_flight'] > 1, "批次没有并发执行"
+        assert embeddings.embed_query(texts[0]) == fake_embedding(texts[0], server.dim)
+
+
+def test_embed_documents_token_budget():
+    """测试按 token 数切分批次"""
+    print("\n2. 测试按 token 数切分批次...")
+    embeddings = ArkEmbeddings(api_key='test', base_url='http://127.0.0.1:1',
+                               max_batch_size=10, max_batch_tokens=300)
+    texts = ["长" * 200, "短", "长" * 200, "短", "短"]
+    batches = embeddings._make_batches(texts)
+    print(f"批次: {[len(batch) for _, batch in batches]}")
+    assert [start for start, _ in batches] == [0, 2]
+    assert sum(len(batch) for _, batch in batches) == len(texts)
+
+
+def test_embed_documents_retry_on_throttle():
+    """测试遇到 429 时退避重试而不是中断"""
+    print("\n3. 测试限流重试...")
+    texts = [f"重试测试 {i}" for i in range(40)]
+
+    with MockArkServer(throttle_every=3) as server:
+        embeddings = ArkEmbeddings(
+            api_key='test',
+            base_url=server.base_url,
+            max_concurrency=4,
+            max_batch_size=5,
+            base_backoff=0.01
+        )
+        vectors = embeddings.embed_documents(texts)
+        print(f"请求数: {server.stats['requests']}, 被限流: {server.stats['throttled']}")
+
+        assert server.stats['throttled'] > 0
+        assert vectors == [fake_embedding(text, server.dim) for text in texts]
+
+
+def test_embedding_cache():
+    """测试向量缓存：重复文本不再请求接口，超出大小后淘汰旧条目"""
+    print("\n4. 测试向量缓存...")
+    texts = [f"缓存测试 {i % 20}" for i in range(60)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir, MockArkServer() as server:
+        cache = EmbeddingCache(os.path.join(tmp_dir, 'cache.sqlite'))
+        embeddings = ArkEmbeddings(api_key='test', base_url=server.base_url, cache=cache)
+
+        vectors = embeddings.embed_documents(texts)
+        assert server.stats['embedded_texts'] == 20, "重复文本应该只请求一次"
+        embeddings.embed_documents(texts)
+        embeddings.embed_query(texts[0])
+        assert server.stats['embedded_texts'] == 20, "缓存命中后不应再请求接口"
+        stats = cache.stats()
+        print(f"缓存统计: {stats}")
+        assert stats['hits'] == 61 and stats['entries'] == 20
+        for text, vector in zip(texts, vectors):
+            expected = fake_embedding(text, server.dim)
+            assert max(abs(a - b) for a, b in zip(vector, expected)) < 1e-6
+
+        # 上限只够放下约 10 个向量，写入 20 个后应淘汰最旧的
+        small = EmbeddingCache(os.path.join(tmp_dir, 'small.sqlite'), max_bytes=server.dim * 4 * 10)
+        small.put_many('m', texts[:20], vectors[:20])
+        assert small.stats()['entries'] <= 10 and small.evictions > 0
+        assert small.get_many('m', [texts[19]])[0] is not None
+
+
+def test_async_query_does_not_block_loop():
+    """测试异步查询向量化时，向量缓存的读写在线程中执行：入库线程持有缓存锁时事件循环照常运行"""
+    print("\n5. 测试异步查询不阻塞事件循环...")
+    with tempfile.TemporaryDirectory() as tmp_dir, MockArkServer() as server:
+        cache = EmbeddingCache(os.path.join(tmp_dir, 'cache.sqlite'))
+        embeddings = ArkEmbeddings(api_key='test', base_url=server.base_url, cache=cache)
+        # 模拟入库线程正在批量写入缓存
+        cache._lock.acquire()
+        threading.Timer(0.3, cache._lock.release).start()
+
+        async def query():
+            task = asyncio.ensure_future(embeddings.aembed_query("异步查询"))
+            ticks = 0
+            while not task.done():
+                await asyncio.sleep(0.01)
+                ticks += 1
+            return ticks, task.result()
+
+        ticks, vector = asyncio.run(query())
+        print(f"等待缓存锁期间事件循环运行了 {ticks} 次")
+        assert ticks >= 10
+        assert vector == fake_embedding("异步查询", server.dim)
+        assert asyncio.run(embeddings.aembed_query("异步查询")) is not None
+        assert cache.stats()['hits'] == 1 and server.stats['embedded_texts'] == 1
+
+
+def test_cache_size_shared_by_workers():
+    """测试多个进程共用缓存数据库时，总大小按数据库中的记录计算，淘汰后总大小不超过上限"""
+    print("\n6. 测试多 worker 共用缓存的大小上限...")
+    dim = 64
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'shared.sqlite')
+        workers = [EmbeddingCache(path, max_bytes=dim * 4 * 10) for _ in range(3)]
+        for i, cache in enumerate(workers):
+            texts = [f"worker {i} 文本 {j}" for j in range(8)]
+            cache.put_many('m', texts, [fake_embedding(text, dim) for text in texts])
+        # 重复写入已有的条目不增加总大小
+        workers[0].put_many('m', ["worker 2 文本 7"], [fake_embedding("worker 2 文本 7", dim)])
+
+        stats = [cache.stats() for cache in workers]
+        actual = workers[0]._conn.execute("SELECT SUM(LENGTH(vector)) FROM embeddings").fetchone()[0]
+        print(f"缓存统计: {stats[0]}")
+        assert all(item['bytes'] == actual for item in stats)
+        assert actual <= dim * 4 * 10 and stats[0]['entries'] <= 10
+        assert workers[0].get_many('m', ["worker 2 文本 7"])[0] is not None
+        assert EmbeddingCache(path).stats()['bytes'] == actual
+        workers[1].clear()
+        assert workers[2].stats()['bytes'] == 0
+
+
+if __name__ == '__main__':
+    test_embed_documents_concurrent()
+    test_embed_documents_token_budget()
+    test_embed_documents_retry_on_throttle()
+    test_embedding_cache()
+    test_async_query_does_not_block_loop()
+    test_cache_size_shared_by_workers()
+    print("\n=== ArkEmbeddings 测试完成 ===")
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from document_store import ArkEmbeddings
+from http_pool import HTTPPool, ark_client, ark_async_client
+from mock_ark_server import MockArkServer
+
+
+def test_connections_are_reused():
+    """测试向量和对话客户端共用连接池，连续请求复用同一个连接"""
+    print("\n1. 测试连接复用...")
+    with MockArkServer(stream_tokens=3) as server:
+        pool = HTTPPool(http2=False)
+        embeddings = ArkEmbeddings(api_key='test', base_url=server.base_url, http_pool=pool)
+        chat = ark_client('test', server.base_url, pool=pool)
+        for _ in range(5):
+            embeddings.embed_query("你好")
+            for _ in chat.chat.completions.create(model='mock', messages=[{'role': 'user', 'content': "你好"}],
+                                                  stream=True):
+                pass
+        # 客户端关闭不影响共用的连接池
+        ark_client('test', server.base_url, pool=pool).close()
+        embeddings.embed_query("再见")
+
+        stats = pool.stats()
+        assert stats['requests'] == 11
+        assert stats['connections_opened'] == 1
+        assert stats['open_connections'] == 1 and stats['idle_connections'] == 1
+        assert stats['reuse_rate'] > 0.9
+        pool.close()
+        assert pool.stats()['open_connections'] == 0
+
+
+def test_new_pool_per_process_and_loop():
+    """测试 fork 之后和换了事件循环之后使用新的连接池，不沿用原来的连接"""
+    print("\n2. 测试进程和事件循环隔离...")
+    with MockArkServer() as server:
+        pool = HTTPPool(http2=False)
+        client = ark_client('test', server.base_url, pool=pool)
+        client.embeddings.create(model='mock', input=["a"])
+        transport = pool._sync_transport._transport
+        pool._sync_transport._pid = os.getpid() + 1  # 模拟 fork 出的子进程
+        client.embeddings.create(model='mock', input=["a"])
+        assert pool._sync_transport._transport is not transport
+        assert pool.stats()['connections_opened'] == 2
+
+        async_client = ark_async_client('test', server.base_url, pool=pool)
+
+        async def request():
+            await async_client.embeddings.create(model='mock', input=["a"])
+            await async_client.embeddings.create(model='mock', input=["b"])
+
+        asyncio.run(request())
+        asyncio.run(request())
+        assert pool.stats()['connections_opened'] == 4
+
+
+def test_warm_up_opens_idle_connection():
+    """测试预热在后台建立连接，随后的请求直接复用；已有空闲连接时不再预热"""
+    print("\n3. 测试连接预热...")
+    with MockArkServer() as server:
+        pool = HTTPPool(http2=False)
+        pool.warm_up(server.base_url)
+        for _ in range(100):
+            if pool.stats()['idle_connections']:
+                break
+            time.sleep(0.01)
+        assert pool.stats()['connections_opened'] == 1
+        pool.warm_up(server.base_url)
+        assert pool.stats()['warm_ups'] == 1
+
+        ark_client('test', server.base_url, pool=pool).embeddings.create(model='mock', input=["a"])
+        assert pool.stats()['connections_opened'] == 1
+
+        async def request():
+            await pool.awarm_up(server.base_url)
+            await pool.awarm_up(server.base_url)
+            await ark_async_client('test', server.base_url, pool=pool).embeddings.create(model='mock', input=["a"])
+
+        asyncio.run(request())
+        stats = pool.stats()
+        assert stats['warm_ups'] == 2 and stats['connections_opened'] == 2
+
+
+@pytest.mark.mock_ark(stream_tokens=3)
+def test_chat_warms_up_cold_pool(make_store, documents, app_client, mock_ark, monkeypatch):
+    """测试对话请求开始时，模型客户端所用的连接池没有空闲连接才预热；已有空闲连接时直接复用。
+    ASGI 应用启动（lifespan）时也预热一次"""
+    print("\n4. 测试对话请求的连接预热...")
+    (documents / "doc.txt").write_text("预热测试文档。" * 20, encoding='utf-8')
+    store = make_store()
+    store.load_documents(str(documents))
+    pool = HTTPPool(http2=False)
+
+    def chat(client):
+        return client.post('/api/chat', json={'messages': [{'role': 'user', 'content': "讲了什么？"}],
+                                              'model': 'mock'}).get_data(as_text=True)
+
+    client = app_client(store, client=ark_client('test', mock_ark.base_url, pool=pool), ark_pool=pool,
+                        ARK_BASE_URL=mock_ark.base_url)
+    assert "data: [DONE]" in chat(client)
+    assert pool.stats()['warm_ups'] == 1
+    for _ in range(3):
+        chat(client)
+    stats = pool.stats()
+    assert stats['warm_ups'] == 1 and stats['requests'] >= 4
+    # 空闲连接过期后（这里直接关闭连接池），下一个请求重新预热
+    pool.close()
+    chat(client)
+    assert pool.stats()['warm_ups'] == 2
+
+    import asgi_app
+    from starlette.testclient import TestClient
+    async_pool = HTTPPool(http2=False)
+    monkeypatch.setattr(asgi_app, 'doc_store', store)
+    monkeypatch.setattr(asgi_app, 'async_client', ark_async_client('test', mock_ark.base_url, pool=async_pool))
+    monkeypatch.setattr(asgi_app, 'ark_pool', async_pool)
+    monkeypatch.setattr(asgi_app, 'ARK_BASE_URL', mock_ark.base_url)
+    with TestClient(asgi_app.app) as asgi_client:
+        for _ in range(100):
+            if async_pool.stats()['idle_connections']:
+                break
+            time.sleep(0.01)
+        assert async_pool.stats()['warm_ups'] == 1
+        response = asgi_client.post('/api/chat', json={'messages': [{'role': 'user', 'content': "讲了什么？"}],
+                                                       'model': 'mock'})
+        assert "data: [DONE]" in response.text
+        stats = async_pool.stats()
+        assert stats['warm_ups'] == 1 and stats['connections_opened'] == 1 and stats['requests'] >= 2
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 连接池测试完成 ===")
@@ -0,0 +1,124 @@
+import os
+
+import ingest
+from document_store import DocumentStore
+
+
+def write_file(directory, name, label, paragraphs=6):
+    text = "\n\n".join(f"{label} 第 {i} 段，增量入库测试。" + f"{label}{i} 的内容。" * 40 for i in range(paragraphs))
+    (directory / name).write_text(text, encoding='utf-8')
+
+
+def indexed_ids(store):
+    """当前版本中全部向量块的 ID"""
+    return set(store.vector_store.index_to_docstore_id.values())
+
+
+def test_changed_and_removed_files_replace_their_chunks(make_store, documents, mock_ark):
+    """测试修改和删除的文件的旧向量块从向量索引和 docstore 中删除，只有修改的文件重新向量化"""
+    print("\n1. 测试修改和删除文件...")
+    for name, label in (("a.txt", "甲"), ("b.txt", "乙"), ("c.txt", "丙")):
+        write_file(documents, name, label)
+    store = make_store()
+    store.load_documents(str(documents))
+    before = {path: list(ids) for path, ids in store.file_chunks.items()}
+    a, b, c = (str(documents / name) for name in ("a.txt", "b.txt", "c.txt"))
+    assert indexed_ids(store) == set(before[a]) | set(before[b]) | set(before[c])
+
+    write_file(documents, "b.txt", "丁", paragraphs=4)
+    (documents / "c.txt").unlink()
+    embedded = mock_ark.stats['embedded_texts']
+    store.load_documents(str(documents))
+
+    assert store.file_chunks[a] == before[a]
+    assert set(store.file_chunks) == {a, b}
+    assert not set(store.file_chunks[b]) & set(before[b])
+    # 只有修改后的 b.txt 请求了向量
+    assert mock_ark.stats['embedded_texts'] - embedded == len(store.file_chunks[b])
+
+    assert indexed_ids(store) == set(before[a]) | set(store.file_chunks[b])
+    assert store.vector_store.index.ntotal == len(before[a]) + len(store.file_chunks[b])
+    docstore = store.vector_store.docstore
+    for doc_id in before[b] + before[c]:
+        assert docstore.search(doc_id) == f"ID {doc_id} not found."
+    assert "丁" in docstore.search(store.file_chunks[b][0]).page_content
+    assert store.snapshot().lexical_index.doc_count == store.vector_store.index.ntotal
+    # 旧内容不再被检索到
+    assert all(doc.metadata['source'] != c for doc in store.search("丙 第 1 段", k=5, mode='lexical'))
+
+
+def test_unchanged_files_keep_their_chunks(make_store, documents, mock_ark):
+    """测试文件都没有变化时不请求向量、不发布新版本；新增文件只向量化新文件，其他文件的向量块不变"""
+    print("\n2. 测试未修改的文件...")
+    write_file(documents, "a.txt", "甲")
+    write_file(documents, "b.txt", "乙")
+    store = make_store()
+    store.load_documents(str(documents))
+    before = {path: list(ids) for path, ids in store.file_chunks.items()}
+
+    requests = mock_ark.stats['requests']
+    store.load_documents(str(documents))
+    assert mock_ark.stats['requests'] == requests
+    assert store.index_version == 1 and store.file_chunks == before
+
+    write_file(documents, "new.txt", "戊", paragraphs=2)
+    embedded = mock_ark.stats['embedded_texts']
+    store.load_documents(str(documents))
+    new = str(documents / "new.txt")
+    assert mock_ark.stats['embedded_texts'] - embedded == len(store.file_chunks[new])
+    assert {path: ids for path, ids in store.file_chunks.items() if path != new} == before
+    assert indexed_ids(store) == {doc_id for ids in store.file_chunks.values() for doc_id in ids}
+
+    # 重新打开的进程读到同样的文件记录
+    other = DocumentStore(ingest_workers=1)
+    other.load_existing_index()
+    assert other.file_chunks == store.file_chunks
+
+
+def test_unchanged_files_are_not_parsed(make_store, documents, monkeypatch):
+    """测试未修改的文件不会交给解析器：状态一致时连哈希也不计算，只是 touch 时计算哈希但不解析"""
+    print("\n3. 测试跳过未修改文件的解析...")
+    write_file(documents, "a.txt", "甲")
+    write_file(documents, "b.txt", "乙")
+    loaded, hashed = [], []
+    loader_cls = ingest.LOADERS['.txt']
+
+    def counting_loader(file_path, *args, **kwargs):
+        loaded.append(file_path)
+        return loader_cls(file_path, *args, **kwargs)
+
+    monkeypatch.setitem(ingest.LOADERS, '.txt', counting_loader)
+    store = make_store()
+    file_hash = store._file_hash
+
+    def counting_hash(file_path):
+        hashed.append(file_path)
+        return file_hash(file_path)
+
+    monkeypatch.setattr(store, '_file_hash', counting_hash)
+    store.load_documents(str(documents))
+    assert sorted(loaded) == [str(documents / "a.txt"), str(documents / "b.txt")]
+
+    # 大小和修改时间都没变：不解析，也不计算哈希
+    loaded.clear(), hashed.clear()
+    store.load_documents(str(documents))
+    assert loaded == [] and hashed == []
+
+    # 只改修改时间：计算哈希后发现内容相同，仍然不解析
+    touched = documents / "a.txt"
+    os.utime(touched, ns=(touched.stat().st_atime_ns, touched.stat().st_mtime_ns + 10 ** 9))
+    store.load_documents(str(documents))
+    assert hashed == [str(touched)] and loaded == []
+    assert store.index_version == 1
+
+    # 内容变化的文件才会解析
+    hashed.clear()
+    write_file(documents, "b.txt", "丁")
+    store.load_documents(str(documents))
+    assert loaded == [str(documents / "b.txt")] and hashed == [str(documents / "b.txt")]
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 增量入库测试完成 ===")
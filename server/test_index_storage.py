@@ -0,0 +1,259 @@
+from langchain_core.documents import Document
+import numpy as np
+import tempfile
+from pathlib import Path
+
+import index_storage
+from index_storage import (
+    AnnIndex, IndexBuilder, IndexDirectory, MmapFlatIndex, new_vector_store, write_index, load_index
+)
+
+
+def test_flat_index_matches_brute_force():
+    """测试分块精确检索与暴力计算结果一致"""
+    print("\n1. 测试分块精确检索...")
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2500, 32)).astype(np.float32)
+    queries = rng.standard_normal((5, 32)).astype(np.float32)
+
+    old_block_rows, old_query_rows = index_storage.SEARCH_BLOCK_ROWS, index_storage.SEARCH_QUERY_ROWS
+    index_storage.SEARCH_BLOCK_ROWS = 700  # 让检索跨越多个块
+    index_storage.SEARCH_QUERY_ROWS = 2  # 批量查询分组
+    try:
+        index = MmapFlatIndex(32)
+        index.add(vectors)
+        distances, labels = index.search(queries, 10)
+        # 批量查询与逐条查询的结果一致，k 大于向量数时多出的位置为 -1
+        for i, query in enumerate(queries):
+            assert (index.search(query, 10)[1][0] == labels[i]).all()
+        small = MmapFlatIndex(32, vectors[:3])
+        assert small.search(queries, 5)[1][:, 3:].tolist() == [[-1, -1]] * 5
+    finally:
+        index_storage.SEARCH_BLOCK_ROWS, index_storage.SEARCH_QUERY_ROWS = old_block_rows, old_query_rows
+
+    expected = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+    assert (labels == np.argsort(expected, axis=1)[:, :10]).all()
+    assert np.allclose(distances, np.sort(expected, axis=1)[:, :10], atol=1e-3)
+
+    removed = index.remove_ids(labels[:, 0])
+    assert removed == len(set(labels[:, 0].tolist()))
+    assert index.ntotal == 2500 - removed
+
+
+def test_save_and_load_roundtrip():
+    """测试保存后以内存映射方式加载，检索结果和文本块内容保持一致"""
+    print("\n2. 测试索引保存和加载...")
+    rng = np.random.default_rng(1)
+    texts = [f"文本块 {i}" for i in range(50)]
+    vectors = rng.standard_normal((50, 16)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "current_index"
+        store = new_vector_store(None, 16)
+        store.add_embeddings(
+            list(zip(texts, vectors.tolist())),
+            metadatas=[{'source': f"doc{i % 5}.txt"} for i in range(50)],
+            ids=[f"id-{i}" for i in range(50)]
+        )
+        write_index(store, path)
+
+        reader = load_index(path, None)
+        assert isinstance(reader.index._vectors, np.memmap)
+        docs = reader.similarity_search_by_vector(vectors[7].tolist(), k=1)
+        assert docs[0].page_content == texts[7]
+        assert docs[0].metadata == {'source': 'doc2.txt'}
+        assert reader.index_to_docstore_id[7] == "id-7"
+
+        # 以当前版本为基础构建新版本：删除和追加后行号重新编排，原版本不变
+        next_path = Path(tmp_dir) / "next_index"
+        builder = IndexBuilder(next_path, base_path=path)
+        builder.delete([f"id-{i}" for i in range(10)])
+        builder.add(["新文本块"], vectors[:1] * 2, [{'source': 'new.txt'}], ["id-new"])
+        assert builder.finish() == 41
+        assert list(builder.iter_texts()) == texts[10:] + ["新文本块"]
+        reader = load_index(next_path, None)
+        assert reader.index.ntotal == 41
+        assert reader.similarity_search_by_vector(vectors[7].tolist(), k=1)[0].page_content != texts[7]
+        assert reader.docstore.search("id-20") == Document(page_content=texts[20], metadata={'source': 'doc0.txt'})
+        assert reader.index_to_docstore_id[40] == "id-new"
+        assert np.allclose(reader.index.reconstruct(0), vectors[10])
+        assert np.allclose(reader.index.norms[40], (vectors[0] * 2) @ (vectors[0] * 2), rtol=1e-4)
+        assert load_index(path, None).index.ntotal == 50
+
+        # 出错时放弃构建，临时目录被删除
+        builder = IndexBuilder(Path(tmp_dir) / "aborted", base_path=path)
+        builder.add(["x"], vectors[:1], [{}], ["id-x"])
+        builder.abort()
+        assert not (Path(tmp_dir) / "aborted").exists()
+
+
+def test_ann_index_roundtrip():
+    """测试近似索引保存后加载，召回与精确检索基本一致，向量太少时退回精确检索"""
+    print("\n3. 测试近似索引...")
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    texts = [f"文本块 {i}" for i in range(2000)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "current_index"
+        store = new_vector_store(None, 16, "IVF16,Flat", {'nprobe': 16})
+        store.add_embeddings(list(zip(texts, vectors.tolist())), ids=[f"id-{i}" for i in range(2000)])
+        write_index(store, path)
+        assert (path / "ann.faiss").exists()
+
+        reader = load_index(path, None, {'nprobe': 16})
+        assert isinstance(reader.index, AnnIndex) and reader.index.ann is not None
+        for i in (3, 500, 1999):
+            assert reader.similarity_search_by_vector(vectors[i].tolist(), k=1)[0].page_content == texts[i]
+
+        # 增量更新沿用已有的近似索引，删除的标签通过 ann_map.i64 映射为 -1
+        next_path = Path(tmp_dir) / "next_index"
+        builder = IndexBuilder(next_path, base_path=path, index_spec="IVF16,Flat")
+        builder.delete([f"id-{i}" for i in range(100)])
+        builder.finish()
+        assert (next_path / "ann.faiss").stat().st_ino == (path / "ann.faiss").stat().st_ino
+        reader = load_index(next_path, None, {'nprobe': 16})
+        assert reader.index.ntotal == 1900 and reader.index.ann.ntotal == 2000
+        assert reader.index.label_map[:101].tolist() == [-1] * 100 + [0]
+        assert reader.similarity_search_by_vector(vectors[500].tolist(), k=1)[0].page_content == texts[500]
+        assert all(doc.page_content not in texts[:100]
+                   for doc in reader.similarity_search_by_vector(vectors[5].tolist(), k=20))
+
+        # 向量数不够训练时只保存精确向量
+        small = new_vector_store(None, 16, "IVF64,Flat")
+        small.add_embeddings(list(zip(texts[:10], vectors[:10].tolist())))
+        write_index(small, path)
+        assert not (path / "ann.faiss").exists()
+        assert isinstance(load_index(path, None).index, MmapFlatIndex)
+
+
+def test_compact_index_rescoring():
+    """测试紧凑模式（SQ8）：粗排用量化编码，精确重排后结果和距离与精确检索一致"""
+    print("\n4. 测试紧凑模式和精确重排...")
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((3000, 32)).astype(np.float32)
+    queries = vectors[rng.integers(0, 3000, 20)] + 0.1 * rng.standard_normal((20, 32)).astype(np.float32)
+    texts = [f"文本块 {i}" for i in range(3000)]
+
+    # 候选中的 -1 空位排在最后，候选数不足 k 时补齐
+    flat = MmapFlatIndex(32, vectors)
+    distances, labels = flat.rescore(queries[:1], [[5, -1, 7]], 4)
+    assert sorted(labels[0, :2].tolist()) == [5, 7] and labels[0, 2:].tolist() == [-1, -1]
+    assert np.isinf(distances[0, 2:]).all()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "current_index"
+        store = new_vector_store(None, 32, "SQ8")
+        store.add_embeddings(list(zip(texts, vectors.tolist())), ids=[f"id-{i}" for i in range(3000)])
+        write_index(store, path)
+        assert (path / "ann.faiss").stat().st_size < (path / "vectors.f32").stat().st_size / 3
+
+        reader = load_index(path, None)
+        assert isinstance(reader.index.flat._vectors, np.memmap) and reader.index.rescore == 4
+        exact_distances, exact_labels = flat.search(queries, 10)
+        distances, labels = reader.index.search(queries, 10)
+        assert (labels[:, 0] == exact_labels[:, 0]).all()
+        assert np.mean([len(set(a) & set(b)) for a, b in zip(labels.tolist(), exact_labels.tolist())]) >= 9.5
+        # 重排后的距离是精确值
+        assert np.allclose(np.sort(distances[labels == exact_labels]),
+                           np.sort(exact_distances[labels == exact_labels]), atol=1e-3)
+
+        reader = load_index(path, None, {'rescore': 1})
+        assert reader.index.rescore == 1
+        approx_distances, _ = reader.index.search(queries, 10)
+        assert not np.allclose(approx_distances, exact_distances, atol=1e-3)
+
+
+def test_ann_rebuild_gated_by_delta(monkeypatch):
+    """测试增量更新：变化不超过 ANN_REBUILD_RATIO 时沿用近似索引，追加的行精确检索；超过后才重建"""
+    print("\n5. 测试近似索引的增量更新...")
+    monkeypatch.setattr(index_storage, 'ANN_REBUILD_RATIO', 0.1)
+    rng = np.random.default_rng(4)
+    vectors = rng.standard_normal((2400, 16)).astype(np.float32)
+    texts = [f"文本块 {i}" for i in range(2400)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base = Path(tmp_dir) / "v1"
+        builder = IndexBuilder(base, index_spec="HNSW16")
+        builder.add(texts[:2000], vectors[:2000], [{}] * 2000, [f"id-{i}" for i in range(2000)])
+        builder.finish()
+
+        # 删除 50 行、追加 100 行，合计 7.5%：沿用 v1 的近似索引，追加的行在 ann_prefix 之后
+        v2 = Path(tmp_dir) / "v2"
+        builder = IndexBuilder(v2, base_path=base, index_spec="HNSW16")
+        builder.delete([f"id-{i}" for i in range(50)])
+        builder.add(texts[2000:2100], vectors[2000:2100], [{}] * 100, [f"id-{i}" for i in range(2000, 2100)])
+        builder.finish()
+        meta = index_storage._read_meta(v2)
+        assert meta['ann_prefix'] == 1950 and meta['ann_deleted'] == 50 and meta['count'] == 2050
+        reader = load_index(v2, None)
+        assert reader.index.ann.ntotal == 2000
+        for i in (60, 1999, 2000, 2099):
+            doc = reader.similarity_search_by_vector(vectors[i].tolist(), k=1)[0]
+            assert doc.page_content == texts[i]
+        exact = MmapFlatIndex(16, reader.index.reconstruct_n(0, 2050))
+        distances, labels = reader.index.search(vectors[2050:2060], 5)
+        exact_distances, exact_labels = exact.search(vectors[2050:2060], 5)
+        assert (labels[:, 0] == exact_labels[:, 0]).all()
+        assert np.allclose(distances[:, 0], exact_distances[:, 0], atol=1e-3)
+
+        # 在 v2 的基础上再删除 v1 的行和追加的行，标签映射随压缩更新
+        v3 = Path(tmp_dir) / "v3"
+        builder = IndexBuilder(v3, base_path=v2, index_spec="HNSW16")
+        builder.delete(["id-60", "id-2000"])
+        builder.finish()
+        meta = index_storage._read_meta(v3)
+        assert meta['ann_prefix'] == 1949 and meta['ann_deleted'] == 51 and meta['count'] == 2048
+        reader = load_index(v3, None)
+        assert reader.similarity_search_by_vector(vectors[2099].tolist(), k=1)[0].page_content == texts[2099]
+        assert reader.similarity_search_by_vector(vectors[1999].tolist(), k=1)[0].page_content == texts[1999]
+        assert reader.similarity_search_by_vector(vectors[60].tolist(), k=1)[0].page_content != texts[60]
+
+        # 再追加 300 行后超过 10%，用全部向量重建，不再需要标签映射
+        v4 = Path(tmp_dir) / "v4"
+        builder = IndexBuilder(v4, base_path=v3, index_spec="HNSW16")
+        builder.add(texts[2100:2400], vectors[2100:2400], [{}] * 300, [f"id-{i}" for i in range(2100, 2400)])
+        builder.finish()
+        meta = index_storage._read_meta(v4)
+        assert 'ann_prefix' not in meta and not (v4 / "ann_map.i64").exists()
+        reader = load_index(v4, None)
+        assert reader.index.ann.ntotal == 2348 and reader.index.label_map is None
+        assert reader.similarity_search_by_vector(vectors[2399].tolist(), k=1)[0].page_content == texts[2399]
+
+
+def test_index_directory_versions():
+    """测试版本目录发布：CURRENT 指向最新版本，只保留最近的几个版本，残留的临时目录被清理"""
+    print("\n6. 测试版本化索引目录...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = IndexDirectory(tmp_dir, keep_versions=2, prune_grace=0)
+        assert directory.current_version() is None
+        (Path(tmp_dir) / ".tmp-9-1").mkdir()  # 模拟写入中途退出留下的临时目录
+
+        for expected in (1, 2, 3):
+            with directory.write_lock():
+                version = directory.publish(lambda path: (path / "data.txt").write_text(str(expected)))
+            assert version == expected
+            assert directory.current_version() == expected
+            assert (directory.version_path(expected) / "data.txt").read_text() == str(expected)
+
+        names = sorted(p.name for p in Path(tmp_dir).iterdir())
+        assert names == [".write.lock", "CURRENT", "v00000002", "v00000003"]
+
+        # 被替换不久的旧版本在宽限期内保留，可能还有读者在用它的快照
+        directory.prune_grace = 60
+        with directory.write_lock():
+            directory.publish(lambda path: (path / "data.txt").write_text("4"))
+        assert (directory.version_path(2) / "data.txt").exists()
+        directory.prune_grace = 0
+        with directory.write_lock():
+            directory.publish(lambda path: (path / "data.txt").write_text("5"))
+        assert sorted(p.name for p in Path(tmp_dir).glob("v*")) == ["v00000004", "v00000005"]
+
+
+if __name__ == '__main__':
+    test_flat_index_matches_brute_force()
+    test_save_and_load_roundtrip()
+    test_ann_index_roundtrip()
+    test_compact_index_rescoring()
+    test_index_directory_versions()
+    print("\n=== 索引存储测试完成 ===")
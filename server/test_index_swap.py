@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+from pathlib import Path
+
+from document_store import DocumentStore
+
+
+def write_documents(directory, round_no):
+    for i in range(4):
+        (directory / f"doc{i}.txt").write_text(f"第 {round_no} 轮文档 {i}。" + f"内容 {i}。" * 300, encoding='utf-8')
+
+
+def test_search_during_reindex(make_store, documents):
+    """测试反复重建索引、清空的同时并发检索：检索不报错，每次都在某个完整版本上完成"""
+    print("\n1. 测试重建索引时并发检索...")
+    write_documents(documents, 0)
+    store = make_store()
+    store.load_documents(str(documents))
+
+    # 另一个实例模拟其他 gunicorn worker，只读，靠 CURRENT 发现新版本
+    reader = DocumentStore()
+    reader.embeddings = store.embeddings
+    reader.refresh_interval = 0
+    reader.load_existing_index()
+
+    errors = []
+    searches = [0]
+    stop = threading.Event()
+
+    def search_loop(doc_store):
+        while not stop.is_set():
+            try:
+                for doc in doc_store.search("文档 2 的内容", k=3):
+                    assert doc.page_content
+                searches[0] += 1
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=search_loop, args=(s,)) for s in (store, store, reader, reader)]
+    for thread in threads:
+        thread.start()
+    try:
+        for round_no in range(1, 6):
+            write_documents(documents, round_no)
+            store.load_documents(str(documents))
+            if round_no == 3:
+                store.clear()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    print(f"检索 {searches[0]} 次，错误 {len(errors)} 个，最终版本 {store.index_version}")
+    assert not errors, errors[:3]
+    assert searches[0] > 0
+    assert store.index_version == 7
+    reader.search("刷新", k=1)
+    assert reader.index_version == store.index_version
+    # 被替换的旧版本在宽限期内保留，宽限期过后在下次发布时清理
+    assert len(list(Path("faiss_index").glob("v*"))) == 7
+    store.index_directory.prune_grace = 0
+    store.clear()
+    assert len(list(Path("faiss_index").glob("v*"))) == 2
+
+
+def test_touched_files_do_not_modify_published_version(make_store, documents):
+    """测试文件只是 touch 时不发布新版本，也不改写已发布的版本目录，文件状态提示写在版本目录之外"""
+    print("\n2. 测试文件状态提示...")
+    write_documents(documents, 0)
+    store = make_store()
+    store.load_documents(str(documents))
+    version_stats = store.index_directory.version_path(1) / "file_stats.json"
+    published = version_stats.read_bytes()
+
+    touched = documents / "doc1.txt"
+    os.utime(touched, ns=(touched.stat().st_atime_ns, touched.stat().st_mtime_ns + 10 ** 9))
+    store.load_documents(str(documents))
+    assert store.index_version == 1
+    assert version_stats.read_bytes() == published
+
+    # 另一个 worker 加载同一版本时使用提示中的文件状态，不必重新计算哈希
+    other = DocumentStore(ingest_workers=1)
+    other.load_existing_index()
+    assert other.file_stats[str(touched)]['mtime_ns'] == touched.stat().st_mtime_ns
+    other._file_hash = None
+    assert other._scan_directory(str(documents))[0] == {}
+
+
+def test_async_refresh_off_event_loop(make_store, documents):
+    """测试异步检索发现新版本时，在线程中加载索引，不阻塞事件循环"""
+    print("\n3. 测试异步检索时加载新版本...")
+    write_documents(documents, 0)
+    store = make_store()
+    store.load_documents(str(documents))
+    reader = DocumentStore()
+    reader.embeddings = store.embeddings
+    reader.load_existing_index()
+
+    write_documents(documents, 1)
+    store.load_documents(str(documents))
+    loaded_in = []
+    open_version = reader._open_version
+
+    def recording_open(version):
+        loaded_in.append(threading.get_ident())
+        return open_version(version)
+
+    reader._open_version = recording_open
+    reader._last_refresh_check = 0.0
+
+    async def search():
+        return threading.get_ident(), await reader.asearch("文档 2 的内容", k=3)
+
+    loop_thread, docs = asyncio.run(search())
+    assert reader.index_version == 2 and docs
+    assert loaded_in and loop_thread not in loaded_in
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 索引切换测试完成 ===")
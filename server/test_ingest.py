@@ -0,0 +1,45 @@
+import ingest
+from ingest import iter_file_chunks
+
+
+def write_files(directory):
+    paths = []
+    for i in range(6):
+        path = directory / f"doc{i}.txt"
+        path.write_text("".join(f"文档 {i} 第 {j} 段，" + "进程池解析测试。" * 20 + "\n" for j in range(i * 5 + 1)),
+                        encoding='utf-8')
+        paths.append(str(path))
+    broken = directory / "broken.txt"
+    broken.write_bytes(b"\xff\xfe" * 100)
+    return paths + [str(broken)]
+
+
+def chunk_output(results):
+    output = {}
+    for file_path, chunks, error in results:
+        output[file_path] = ([(c.page_content, c.metadata) for c in chunks] if error is None
+                             else type(error).__name__)
+    return output
+
+
+def test_process_pool_matches_serial(tmp_path):
+    """测试多进程解析的结果与单进程相同（按文件比较，完成顺序可以不同），出错的文件同样返回错误"""
+    print("\n1. 测试进程池解析...")
+    paths = write_files(tmp_path)
+    serial = chunk_output(iter_file_chunks(paths, workers=1))
+    parallel = chunk_output(iter_file_chunks(paths, workers=3))
+    assert parallel == serial
+    assert isinstance(serial[paths[-1]], str)  # 不是合法 UTF-8 的文件解析出错
+    assert sum(len(chunks) for chunks in serial.values() if isinstance(chunks, list)) > len(paths)
+
+
+def test_pool_does_not_fork():
+    """测试解析进程不是从多线程的服务进程直接 fork 出来的"""
+    print("\n2. 测试进程启动方式...")
+    assert ingest._mp_context().get_start_method() in ('forkserver', 'spawn')
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 文档解析测试完成 ===")
@@ -0,0 +1,136 @@
+import threading
+import time
+
+from ingest_jobs import IngestJob, IngestJobQueue, JobStore
+
+
+class FakeDocStore:
+    """记录 load_documents 调用次数，第一次调用会阻塞到 release 被设置"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.index_version = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+
+    def load_documents(self, directory_path, progress=None):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise ValueError("没有成功加载任何文档")
+        progress('scanned', files_total=2)
+        progress('parsed', files_parsed=2, files_failed=0)
+        progress('chunked', chunks=7)
+        progress('embedded', chunks_embedded=7)
+        progress('persisted', persisted=True)
+        self.index_version += 1
+        return True
+
+
+def wait_for(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('succeeded', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"任务 {job_id} 没有完成")
+
+
+def test_jobs_coalesce_and_report_progress(tmp_path):
+    """测试处理期间排队的多个任务合并为一次更新，并上报各阶段进度"""
+    print("\n1. 测试任务合并和进度...")
+    store = FakeDocStore()
+    queue = IngestJobQueue(store, 'documents', tmp_path / "jobs.sqlite", coalesce_window=0.05)
+
+    first = queue.submit(['a.txt'])
+    assert store.started.wait(5)
+    assert queue.get(first.id)['status'] == 'running'
+    # 第一个任务处理期间连续上传的文件合并成一次更新
+    second = queue.submit(['b.txt'])
+    third = queue.submit(['c.pdf'])
+    assert queue.get(second.id)['status'] == 'queued'
+    store.release.set()
+
+    job = wait_for(queue, first.id)
+    assert job['status'] == 'succeeded' and job['index_version'] == 1
+    job = wait_for(queue, third.id)
+    assert job['status'] == 'succeeded'
+    assert job['stage'] == 'persisted'
+    assert job['progress'] == {
+        'files_total': 2, 'files_parsed': 2, 'files_failed': 0,
+        'chunks': 7, 'chunks_embedded': 7, 'persisted': True,
+    }
+    assert job['coalesced_with'] == [second.id]
+    assert job['index_version'] == 2
+    assert store.calls == 2
+    assert queue.get('missing') is None
+
+
+def test_failed_job(tmp_path):
+    """测试处理失败时任务状态为 failed 并带有错误信息"""
+    print("\n2. 测试任务失败...")
+    store = FakeDocStore(fail=True)
+    store.release.set()
+    queue = IngestJobQueue(store, 'documents', tmp_path / "jobs.sqlite", coalesce_window=0)
+    job = wait_for(queue, queue.submit(['a.txt']).id)
+    assert job['status'] == 'failed'
+    assert "没有成功加载任何文档" in job['error']
+    assert job['finished_at'] >= job['started_at']
+
+
+def test_jobs_visible_across_workers(tmp_path):
+    """测试任务状态保存在共用的 SQLite 表中：另一个 worker 的队列也能查到进度，超出上限时删除最早的任务"""
+    print("\n3. 测试跨 worker 查询任务...")
+    store = FakeDocStore()
+    jobs_path = tmp_path / "jobs.sqlite"
+    queue = IngestJobQueue(store, 'documents', jobs_path, coalesce_window=0)
+    other_worker = IngestJobQueue(FakeDocStore(), 'documents', jobs_path)
+
+    job = queue.submit(['a.txt'])
+    assert store.started.wait(5)
+    assert other_worker.get(job.id)['status'] == 'running'
+    store.release.set()
+    assert wait_for(other_worker, job.id)['progress']['chunks_embedded'] == 7
+
+    small = JobStore(tmp_path / "small.sqlite", max_jobs=2)
+    jobs = [IngestJob([f"{i}.txt"]) for i in range(3)]
+    for i, item in enumerate(jobs):
+        item.created_at = i
+        small.save([item])
+    assert small.get(jobs[0].id) is None
+    assert JobStore(tmp_path / "small.sqlite").get(jobs[2].id)['files'] == ["2.txt"]
+
+
+def test_stale_jobs_fail(tmp_path):
+    """测试处理中的 worker 持续写入心跳，任务不会被误判；worker 退出后心跳停止，未完成的任务查询时标记为失败"""
+    print("\n4. 测试 worker 退出后的任务...")
+    store = FakeDocStore()
+    jobs_path = tmp_path / "jobs.sqlite"
+    queue = IngestJobQueue(store, 'documents', jobs_path, coalesce_window=0, heartbeat_interval=0.02,
+                           stale_after=0.3)
+    job = queue.submit(['a.txt'])
+    assert store.started.wait(5)
+    time.sleep(0.6)
+    assert JobStore(jobs_path, stale_after=0.3).get(job.id)['status'] == 'running'
+    store.release.set()
+    assert wait_for(queue, job.id)['status'] == 'succeeded'
+
+    # 模拟 worker 在处理途中退出：任务停在 running，之后不再有心跳
+    dead = IngestJob(['b.txt'])
+    dead.status = 'running'
+    dead.owner_pid = 12345
+    dead.heartbeat_at = time.time() - 120
+    JobStore(jobs_path).save([dead])
+    assert JobStore(jobs_path, stale_after=300).get(dead.id)['status'] == 'running'
+    job = JobStore(jobs_path).get(dead.id)
+    assert job['status'] == 'failed' and "12345" in job['error'] and job['finished_at']
+    assert JobStore(jobs_path).get(dead.id) == job
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 入库任务测试完成 ===")
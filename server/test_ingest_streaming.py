@@ -0,0 +1,65 @@
+import ingest
+from ingest import iter_file_windows, iter_streamed_chunks, iter_text_segments
+
+
+def paragraphs(n, tag):
+    return "".join(f"{tag}第 {i} 段，" + "流式入库测试内容。" * 12 + "\n" for i in range(n))
+
+
+def test_streamed_chunks_keep_offsets(tmp_path, monkeypatch):
+    """测试大文本文件逐段读取：各段拼起来是原文，文本块的 start_index 对应原文中的位置"""
+    print("\n1. 测试流式切分...")
+    path = tmp_path / "large.txt"
+    text = paragraphs(200, "甲")
+    path.write_text(text, encoding='utf-8')
+
+    segments = list(iter_text_segments(str(path), segment_chars=3000))
+    assert len(segments) > 5
+    assert "".join(segment for _, segment in segments) == text
+    assert all(segment.endswith("\n") for _, segment in segments)
+    assert [offset for offset, _ in segments] == [sum(len(s) for _, s in segments[:i]) for i in range(len(segments))]
+
+    monkeypatch.setattr(ingest, 'TEXT_SEGMENT_CHARS', 3000)
+    chunks = list(iter_streamed_chunks(str(path)))
+    assert len(chunks) > 5
+    for chunk in chunks:
+        start = chunk.metadata['start_index']
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+        assert chunk.metadata['source'] == str(path)
+
+
+def test_windows_and_rollback(make_store, documents, monkeypatch):
+    """测试按窗口产出文本块；大文件中途出错时撤回已追加的窗口，保留原来的向量块"""
+    print("\n2. 测试窗口和出错撤回...")
+    monkeypatch.setattr(ingest, 'STREAM_THRESHOLD_BYTES', 20000)
+    monkeypatch.setattr(ingest, 'TEXT_SEGMENT_CHARS', 3000)
+    (documents / "small.txt").write_text(paragraphs(3, "乙"), encoding='utf-8')
+    large = documents / "large.txt"
+    large.write_text(paragraphs(200, "甲"), encoding='utf-8')
+
+    windows = list(iter_file_windows([str(large), str(documents / "small.txt")], workers=1, window=8))
+    large_windows = [w for w in windows if w[0] == str(large)]
+    assert len(large_windows) > 3
+    assert all(len(chunks) <= 8 and error is None for _, chunks, error, _ in windows)
+    assert [last for *_, last in large_windows] == [False] * (len(large_windows) - 1) + [True]
+    assert sum(last for *_, last in windows) == 2
+
+    store = make_store()
+    store.load_documents(str(documents))
+    before = store.vector_store.index.ntotal
+    large_ids = list(store.file_chunks[str(large)])
+    assert len(large_ids) == sum(len(chunks) for _, chunks, _, _ in large_windows)
+
+    # 改写大文件，后半部分不是合法的 UTF-8：前面的窗口已经追加后才出错
+    large.write_bytes(paragraphs(150, "丙").encode('utf-8') + b"\xff\xfe" * 10)
+    store.load_documents(str(documents))
+    assert store.vector_store.index.ntotal == before
+    assert store.file_chunks[str(large)] == large_ids
+    assert all("甲第" in doc.page_content for doc in store.search("流式入库测试", k=3)
+               if doc.metadata['source'] == str(large))
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 流式入库测试完成 ===")
@@ -0,0 +1,112 @@
+from collections import Counter
+import filecmp
+import math
+import tempfile
+from pathlib import Path
+
+import lexical_index
+from lexical_index import LexicalIndex, tokenize, write_lexical_index, reciprocal_rank_fusion
+
+
+def test_tokenize():
+    """测试分词：中文按相邻两字切分，英文小写，错误码保留整体和各部分，全角转半角"""
+    print("\n1. 测试分词...")
+    assert tokenize("向量检索") == ["向量", "量检", "检索"]
+    assert tokenize("的 API") == ["的", "api"]
+    assert tokenize("错误 ERR_CONN-42") == ["错误", "err_conn-42", "err", "conn", "42"]
+    assert tokenize("ＧＰＴ４") == ["gpt4"]
+
+
+def test_bm25_matches_reference():
+    """测试 BM25 得分与逐项计算的结果一致"""
+    print("\n2. 测试 BM25 打分...")
+    texts = [
+        "服务启动失败，错误码 E1001，请检查配置文件。",
+        "向量检索使用 FAISS，支持 HNSW 和 IVF 索引。",
+        "错误码 E2002 表示向量接口限流，稍后重试即可。",
+        "配置文件位于 server 目录，修改后重启服务。",
+        "",
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_lexical_index(tmp_dir, texts)
+        index = LexicalIndex.load(tmp_dir)
+
+        docs = [Counter(tokenize(text)) for text in texts]
+        avgdl = sum(sum(doc.values()) for doc in docs) / len(docs)
+        for query in ["错误码 E2002", "配置文件", "HNSW 索引", "不存在的词"]:
+            expected = {}
+            for term in set(tokenize(query)):
+                df = sum(1 for doc in docs if term in doc)
+                if not df:
+                    continue
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                for pos, doc in enumerate(docs):
+                    tf = doc.get(term, 0)
+                    if tf:
+                        norm = 1.2 * (1 - 0.75 + 0.75 * sum(doc.values()) / avgdl)
+                        expected[pos] = expected.get(pos, 0.0) + idf * tf * 2.2 / (tf + norm)
+            results = index.search(query, 3)
+            ranked = sorted(expected.items(), key=lambda item: -item[1])[:3]
+            assert [pos for pos, _ in results] == [pos for pos, _ in ranked], query
+            for (_, score), (_, expected_score) in zip(results, ranked):
+                assert abs(score - expected_score) < 1e-4
+
+        assert index.search("错误码 E2002", 1)[0][0] == 2
+        assert index.search("", 3) == []
+        assert LexicalIndex.load(Path(tmp_dir) / "missing") is None
+
+
+def test_reciprocal_rank_fusion():
+    """测试倒数排名融合：两个列表中都靠前的结果排在最前"""
+    print("\n3. 测试倒数排名融合...")
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]]) == [1, 3, 2, 4]
+    assert reciprocal_rank_fusion([[], [5]]) == [5]
+
+
+def test_search_modes(make_store, documents, mock_ark):
+    """测试三种检索方式；关键词检索在向量接口不可用时仍然可用"""
+    print("\n4. 测试检索方式...")
+    (documents / "errors.txt").write_text("错误码 E2002 表示向量接口限流，稍后重试即可。", encoding='utf-8')
+    (documents / "deploy.txt").write_text("生产环境使用 gunicorn 启动，预加载索引。", encoding='utf-8')
+    (documents / "faq.txt").write_text("常见问题：如何上传 PDF 文档？在侧边栏选择文件。", encoding='utf-8')
+
+    store = make_store(max_retries=0)
+    store.load_documents(str(documents))
+    dense = store.search("E2002 是什么错误", k=3, mode='dense')
+    hybrid = store.search("E2002 是什么错误", k=3, mode='hybrid')
+    assert len(dense) == len(hybrid) == 3
+    assert hybrid[0].metadata['source'] == str(documents / "errors.txt")
+
+    # 模拟服务已经停止，关键词检索不需要网络
+    mock_ark.stop()
+    lexical = store.search("gunicorn 预加载", k=2, mode='lexical')
+    assert lexical[0].metadata['source'] == str(documents / "deploy.txt")
+    assert len(lexical) == 1
+    try:
+        store.search("gunicorn", k=2, mode='fuzzy')
+        assert False, "不支持的检索方式应当报错"
+    except ValueError:
+        pass
+
+
+def test_spilled_build_matches_single_run(monkeypatch):
+    """测试分批写入临时文件再合并的构建结果与一次构建完全相同，输入可以是迭代器"""
+    print("\n5. 测试分批构建倒排索引...")
+    texts = [f"第 {i} 个文本块，错误码 E{i % 7}，向量检索与关键词检索。" + "补充说明" * (i % 3) for i in range(50)]
+    texts[10] = ""
+    names = ("doclens.u32", "postings.u32", "postings_tf.u16", "lexical.json")
+    with tempfile.TemporaryDirectory() as single, tempfile.TemporaryDirectory() as spilled:
+        write_lexical_index(single, texts)
+        monkeypatch.setattr(lexical_index, 'LEXICAL_RUN_CHUNKS', 4)
+        write_lexical_index(spilled, iter(texts))
+        assert sorted(p.name for p in Path(spilled).iterdir()) == sorted(names + ("lexical.sqlite",))
+        for name in names:
+            assert filecmp.cmp(Path(single) / name, Path(spilled) / name, shallow=False), name
+        for query in ["错误码 E3", "向量检索", "补充说明"]:
+            assert LexicalIndex.load(spilled).search(query, 5) == LexicalIndex.load(single).search(query, 5)
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 关键词检索测试完成 ===")
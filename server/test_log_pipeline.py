@@ -0,0 +1,99 @@
+import io
+import json
+import logging
+import threading
+
+from log_pipeline import async_handler, sampled, truncate
+
+
+class Payload(dict):
+    """记录被序列化时所在的线程"""
+    threads = []
+
+    def items(self):
+        Payload.threads.append(threading.get_ident())
+        return super().items()
+
+
+def make_logger(name, **kwargs):
+    stream = io.StringIO()
+    handler = async_handler(stream, **kwargs)
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    return logger, handler, stream
+
+
+def test_json_lines_are_formatted_off_thread():
+    """测试每条日志一行 JSON，字段在后台线程中序列化并截断"""
+    print("\n1. 测试异步 JSON 日志...")
+    logger, handler, stream = make_logger('test_log_pipeline.json', log_format='json', max_chars=10)
+    Payload.threads.clear()
+    logger.info("收到请求", extra={'fields': {'data': Payload(q="很长的问题" * 10), 'count': 3}})
+    try:
+        raise ValueError("出错了")
+    except ValueError:
+        logger.exception("生成响应流时出错")
+    handler.flush()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    entry = json.loads(lines[0])
+    assert entry['message'] == "收到请求" and entry['level'] == 'INFO' and entry['count'] == 3
+    assert entry['data'].endswith("字)") and len(entry['data']) < 30
+    assert Payload.threads and threading.get_ident() not in Payload.threads
+    assert 'ValueError: 出错了' in json.loads(lines[1])['exception']
+
+    # flush 只等待队列写完，不停止后台线程；停止后再写日志会重新启动
+    listener = handler._listener
+    assert listener._thread is not None and listener._thread.is_alive()
+    handler.stop()
+    logger.info("再来一条")
+    handler.flush()
+    assert len(stream.getvalue().splitlines()) == 3
+    assert handler._listener is not listener
+
+
+def test_text_format_truncation_and_sampling():
+    """测试文本格式、截断、队列满时丢弃和按问题抽样"""
+    print("\n2. 测试文本格式和抽样...")
+    logger, handler, stream = make_logger('test_log_pipeline.text', log_format='text', max_chars=0)
+    logger.info("处理聊天请求", extra={'fields': {'query': "问题", 'context': "第一行\n第二行"}})
+    handler.flush()
+    text = stream.getvalue()
+    assert "[INFO] 处理聊天请求\nquery: 问题\ncontext:\n第一行\n第二行\n" + "-" * 80 in text
+
+    assert truncate("abcdef", 3) == "abc...(共 6 字)" and truncate("abc", 3) == "abc"
+    assert truncate("abcdef", 0) == "abcdef"
+
+    assert sampled("任意问题", 1.0) and not sampled("任意问题", 0.0)
+    keys = [f"问题 {i}" for i in range(2000)]
+    assert [sampled(key, 0.3) for key in keys] == [sampled(key, 0.3) for key in keys]
+    assert 0.25 < sum(sampled(key, 0.3) for key in keys) / len(keys) < 0.35
+
+    # 写出端卡住时队列很快就满：多余的日志丢弃并计数，flush 和 stop 限时返回而不是抛出 queue.Full
+    release = threading.Event()
+
+    class BlockingStream(io.StringIO):
+        def write(self, text):
+            release.wait(5)
+            return super().write(text)
+
+    logger, handler, stream = make_logger('test_log_pipeline.full', maxsize=1)
+    handler.handlers[0].setStream(BlockingStream())
+    threads = [threading.Thread(target=lambda: [logger.info("第 %d 条", i) for i in range(50)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 190 <= handler.dropped <= 199
+    handler.flush(timeout=0.05)
+    handler.stop(timeout=0.05)
+    release.set()
+
+
+if __name__ == '__main__':
+    test_json_lines_are_formatted_off_thread()
+    test_text_format_truncation_and_sampling()
+    print("\n=== 异步日志测试完成 ===")
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+from metrics import Metrics, metrics as shared_metrics
+
+
+def test_histogram_render_and_disabled():
+    """测试直方图的 Prometheus 输出、Server-Timing 和关闭统计时的空计时器"""
+    print("\n1. 测试直方图输出...")
+    metrics = Metrics(enabled=True, server_timing=True, models=['mock'])
+    timings = metrics.request_timings()
+    metrics.observe('retrieval', 0.02, timings)
+    metrics.observe('retrieval', 3.0)
+    with metrics.timer('context_build', timings):
+        pass
+    metrics.observe_rate('mock', 50, 2.0)
+    metrics.register_gauges('pool', lambda: {'requests': 3, 'http2': False, 'mode': 'x'})
+
+    text = metrics.render()
+    assert 'rag_stage_seconds_bucket{stage="retrieval",le="0.01"} 0' in text
+    assert 'rag_stage_seconds_bucket{stage="retrieval",le="0.025"} 1' in text
+    assert 'rag_stage_seconds_bucket{stage="retrieval",le="+Inf"} 2' in text
+    assert 'rag_stage_seconds_sum{stage="retrieval"} 3.02' in text
+    assert 'rag_stage_seconds_count{stage="context_build"} 1' in text
+    assert 'rag_llm_tokens_per_second_bucket{model="mock",le="40"} 1' in text
+    assert f'pool_requests{{pid="{os.getpid()}"}} 3' in text and 'pool_http2{pid=' in text
+    assert 'pool_mode' not in text
+
+    # 客户端传入的模型名不在列表中时记为 other，标签值按文本格式转义
+    for model in ('a"b\\c\nd', 'x' * 100, ['列表']):
+        metrics.observe_rate(model, 10, 1.0)
+    metrics.observe('say "hi"\n', 0.1)
+    text = metrics.render()
+    assert 'rag_llm_tokens_per_second_count{model="other"} 3' in text
+    assert 'rag_stage_seconds_count{stage="say \\"hi\\"\\n"} 1' in text
+    assert all(line.startswith(('#', 'rag_', 'pool_')) for line in text.splitlines())  # 标签值中的换行不会拆开一行
+    header = timings.header()
+    assert header.startswith("retrieval;dur=20.0, context_build;dur=")
+
+    disabled = Metrics(enabled=False, server_timing=False)
+    assert disabled.request_timings() is None
+    with disabled.timer('retrieval'):
+        pass
+    disabled.observe('retrieval', 1.0)
+    assert 'stage=' not in disabled.render()
+
+
+@pytest.mark.mock_ark(stream_tokens=5)
+def test_chat_stages_and_server_timing(make_store, documents, app_client, monkeypatch):
+    """测试一次对话后 /metrics 中有各阶段的统计，开启 SERVER_TIMING 时流中带有本次耗时"""
+    print("\n2. 测试对话阶段统计...")
+    (documents / "doc.txt").write_text("阶段耗时测试文档。" * 20, encoding='utf-8')
+    store = make_store()
+    store.load_documents(str(documents))
+
+    client = app_client(store)
+    monkeypatch.setattr(shared_metrics, 'models', frozenset({'mock'}))
+    monkeypatch.setattr(shared_metrics, 'server_timing', True)
+    body = client.post('/api/chat', json={'messages': [{'role': 'user', 'content': "讲了什么？"}],
+                                          'model': 'mock'}).get_data(as_text=True)
+    response = client.post('/api/search/batch', json={'queries': ["讲了什么？"]})
+    monkeypatch.setattr(shared_metrics, 'server_timing', False)
+    frames = body.split("\n\n")
+    timing = next(frame for frame in frames if frame.startswith(": server-timing "))
+    for stage in ('history', 'retrieval', 'context_build', 'llm_first_token', 'llm_stream'):
+        assert f"{stage};dur=" in timing
+    assert frames.index(timing) == frames.index("data: [DONE]") - 1
+    assert response.headers['Server-Timing'].startswith("search_batch;dur=")
+
+    text = client.get('/metrics').get_data(as_text=True)
+    for stage in ('embed_request', 'query_embedding', 'index_search', 'index_save', 'ingest_total',
+                  'retrieval', 'llm_first_token'):
+        assert f'rag_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'rag_llm_tokens_per_second_count{model="mock"}' in text
+    assert 'ark_pool_requests' in text
+
+
+def test_metrics_aggregate_across_workers(tmp_path):
+    """测试多进程时各 worker 把统计写入共用目录，任何一个进程输出的都是所有 worker 的合计；
+    fork 出的 worker 不重复计入主进程的数据，已退出的 worker 的数据保留，计数不会倒退"""
+    print("\n3. 测试多 worker 汇总...")
+    master = Metrics(enabled=True, models=['mock'], directory=tmp_path, flush_interval=0.05)
+    master.observe('index_load', 0.2)  # 预加载阶段在主进程中的统计
+
+    children = []
+    for _ in range(2):
+        pid = os.fork()
+        if pid == 0:
+            master.observe('retrieval', 0.02)
+            master.observe_rate('mock', 10, 1.0)
+            master.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        children.append(pid)
+    # 主进程的写出线程可能也已经写出了自己的文件
+    assert all((tmp_path / f"{pid}.json").exists() for pid in children)
+
+    other_worker = Metrics(enabled=True, directory=tmp_path)
+    for text in (master.render(), other_worker.render(), master.render()):
+        assert 'rag_stage_seconds_count{stage="index_load"} 1' in text
+        assert 'rag_stage_seconds_count{stage="retrieval"} 2' in text
+        assert 'rag_stage_seconds_sum{stage="retrieval"} 0.04' in text
+        assert 'rag_stage_seconds_bucket{stage="retrieval",le="0.025"} 2' in text
+        assert 'rag_llm_tokens_per_second_count{model="mock"} 2' in text
+    # 新的统计由后台线程每隔 flush_interval 写出
+    master.observe('retrieval', 0.5)
+    deadline = time.monotonic() + 5
+    while 'rag_stage_seconds_count{stage="retrieval"} 3' not in other_worker.render():
+        assert time.monotonic() < deadline, "主进程的新统计没有写出"
+        time.sleep(0.05)
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 阶段耗时统计测试完成 ===")
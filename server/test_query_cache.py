@@ -0,0 +1,90 @@
+import query_cache
+from query_cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_eviction_order():
+    """测试超出容量时淘汰最久未使用的条目，get 和重复 put 都会刷新使用顺序"""
+    print("\n1. 测试 LRU 淘汰顺序...")
+    cache = LRUCache(maxsize=3)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key.upper())
+    assert cache.get('a') == 'A'  # a 变为最近使用
+    cache.put('b', 'B2')  # b 变为最近使用，值被替换
+    cache.put('d', 'D')
+    assert cache.get('c') is None
+    assert [cache.get(key) for key in ('a', 'b', 'd')] == ['A', 'B2', 'D']
+    cache.put('e', 'E')
+    assert cache.get('a') is None and len(cache) == 3
+
+    stats = cache.stats()
+    assert stats['hits'] == 4 and stats['misses'] == 2 and stats['size'] == 3 and stats['maxsize'] == 3
+
+    disabled = LRUCache(maxsize=0)
+    disabled.put('a', 1)
+    assert disabled.get('a', 'default') == 'default' and len(disabled) == 0
+
+
+def test_ttl_expiry(monkeypatch):
+    """测试条目在 TTL 之后过期，过期的条目在读取时删除并计为未命中；不设 TTL 时不过期"""
+    print("\n2. 测试 TTL 过期...")
+    clock = FakeClock()
+    monkeypatch.setattr(query_cache.time, 'monotonic', clock)
+    cache = LRUCache(maxsize=10, ttl=5)
+    cache.put('a', 1)
+    clock.now += 3
+    cache.put('b', 2)
+    clock.now += 2.5  # a 已存在 5.5 秒，b 存在 2.5 秒
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert len(cache) == 1 and cache.stats()['misses'] == 1
+
+    # 重新写入会重新计时
+    cache.put('b', 3)
+    clock.now += 4
+    assert cache.get('b') == 3
+
+    forever = LRUCache(maxsize=10)
+    forever.put('a', 1)
+    clock.now += 10 ** 6
+    assert forever.get('a') == 1
+
+
+def test_invalidation_on_index_publish(make_store, documents, mock_ark):
+    """测试发布新版本索引后检索结果缓存失效，查询向量缓存与索引无关，继续使用"""
+    print("\n3. 测试索引更新后缓存失效...")
+    (documents / "a.txt").write_text("第一版文档，缓存失效测试。" * 10, encoding='utf-8')
+    store = make_store()
+    store.load_documents(str(documents))
+
+    first = store.search("缓存失效", k=1)
+    requests = mock_ark.stats['requests']
+    assert store.search("缓存失效", k=1) == first
+    assert store.search_cache.stats()['hits'] == 1 and mock_ark.stats['requests'] == requests
+
+    (documents / "a.txt").write_text("第二版文档，内容已经更新。" * 10, encoding='utf-8')
+    store.load_documents(str(documents))
+    assert store.index_version == 2 and len(store.search_cache) == 0
+    assert len(store.query_embedding_cache) == 1
+
+    requests = mock_ark.stats['requests']
+    second = store.search("缓存失效", k=1)
+    assert "第二版" in second[0].page_content
+    assert mock_ark.stats['requests'] == requests  # 查询向量来自缓存
+    assert store.query_embedding_cache.stats()['hits'] >= 1
+
+    store.clear()
+    assert len(store.search_cache) == 0 and store.search("缓存失效", k=1) == []
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 查询缓存测试完成 ===")
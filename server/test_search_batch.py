@@ -0,0 +1,48 @@
+import math
+
+
+def test_search_batch(make_store, documents, mock_ark, app_client, monkeypatch):
+    """测试批量检索与逐条检索结果一致，查询向量分批请求，并通过 /api/search/batch 调用"""
+    print("\n1. 测试批量检索...")
+    for i in range(6):
+        (documents / f"doc{i}.txt").write_text(f"第 {i} 篇文档，编号 D{i:03d}。" * 40, encoding='utf-8')
+    store = make_store(max_batch_size=10)
+    store.load_documents(str(documents))
+
+    queries = [f"编号 D{i % 6:03d} 的文档讲了什么？第 {i} 问" for i in range(25)] + ["编号 D001 的文档讲了什么？第 1 问"]
+    requests_before = mock_ark.stats['requests']
+    batch = store.search_batch(queries, k=2)
+    # 25 条不同的查询按每批 10 条请求，重复的查询不重复请求
+    assert mock_ark.stats['requests'] - requests_before == math.ceil(25 / 10)
+    assert len(batch) == len(queries)
+    assert batch[1] == batch[-1]
+
+    store.search_cache.clear()
+    for mode in ('dense', 'hybrid', 'lexical'):
+        batch = store.search_batch(queries, k=2, mode=mode)
+        store.search_cache.clear()
+        for query, docs in zip(queries, batch):
+            assert docs == store.search(query, k=2, mode=mode), (mode, query)
+
+    client = app_client(store)
+    response = client.post('/api/search/batch', json={'queries': queries[:3], 'k': 1, 'search_mode': 'lexical'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [item['query'] for item in body['results']] == queries[:3]
+    assert body['results'][0]['documents'][0]['metadata']['source'] == str(documents / "doc0.txt")
+    assert client.post('/api/search/batch', json={'queries': 'x'}).status_code == 400
+    assert client.post('/api/search/batch', json={'queries': ['x'], 'search_mode': 'fuzzy'}).status_code == 400
+    # k 不合法时返回 400，过大时截断为 MAX_SEARCH_K
+    for k in ('abc', 0, -1, 2.5, True, None):
+        assert client.post('/api/search/batch', json={'queries': ['x'], 'k': k}).status_code == 400, k
+    import app as app_module
+    monkeypatch.setattr(app_module, 'MAX_SEARCH_K', 4)
+    response = client.post('/api/search/batch', json={'queries': queries[:1], 'k': 10 ** 9})
+    assert response.status_code == 200 and len(response.get_json()['results'][0]['documents']) == 4
+    assert client.post('/api/search/batch', json={'queries': ['x'], 'k': '2'}).status_code == 200
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 批量检索测试完成 ===")
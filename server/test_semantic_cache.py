@@ -0,0 +1,106 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+from chat_service import ANALYZING_EVENT
+from semantic_cache import SemanticAnswerCache
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_lookup_threshold_and_context():
+    """测试相似度达到阈值且上下文相同才命中"""
+    print("\n1. 测试相似度阈值和上下文匹配...")
+    rng = np.random.default_rng(0)
+    question = unit(rng.standard_normal(64))
+    paraphrase = unit(question + 0.1 * unit(rng.standard_normal(64)))
+    unrelated = unit(rng.standard_normal(64))
+    assert float(question @ paraphrase) > 0.95 > float(question @ unrelated)
+
+    cache = SemanticAnswerCache(enabled=True, threshold=0.95, maxsize=10, ttl=60)
+    cache.put(question, 'm', "上下文 A", 1, "答案 A")
+    assert cache.lookup(paraphrase, 'm', "上下文 A", 1) == "答案 A"
+    assert cache.lookup(unrelated, 'm', "上下文 A", 1) is None
+    assert cache.lookup(paraphrase, 'm', "上下文 B", 1) is None  # 检索到的文档不同
+    assert cache.lookup(paraphrase, 'other', "上下文 A", 1) is None  # 模型不同
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 3 and stats['hit_rate'] == 0.25
+
+
+def test_eviction_ttl_and_invalidation():
+    """测试 LRU 淘汰、TTL 过期和索引更新后失效"""
+    print("\n2. 测试淘汰、过期和失效...")
+    vectors = [unit(np.eye(8)[i]) for i in range(4)]
+    cache = SemanticAnswerCache(enabled=True, threshold=0.9, maxsize=2, ttl=60)
+    cache.put(vectors[0], 'm', "ctx", 1, "答案 0")
+    cache.put(vectors[1], 'm', "ctx", 1, "答案 1")
+    assert cache.lookup(vectors[0], 'm', "ctx", 1) == "答案 0"  # 0 变为最近使用
+    cache.put(vectors[2], 'm', "ctx", 1, "答案 2")
+    assert cache.lookup(vectors[1], 'm', "ctx", 1) is None
+    assert cache.lookup(vectors[0], 'm', "ctx", 1) == "答案 0"
+    assert cache.stats()['evictions'] == 1
+
+    # 旧版本索引上生成的答案不记录；新版本出现后旧记录全部失效
+    cache.put(vectors[3], 'm', "ctx", 0, "旧答案")
+    assert cache.lookup(vectors[3], 'm', "ctx", 1) is None
+    assert cache.lookup(vectors[0], 'm', "ctx", 2) is None
+    assert len(cache) == 0 and cache.stats()['invalidations'] == 1
+
+    cache = SemanticAnswerCache(enabled=True, threshold=0.9, maxsize=2, ttl=0.05)
+    cache.put(vectors[0], 'm', "ctx", 1, "答案 0")
+    time.sleep(0.1)
+    assert cache.lookup(vectors[0], 'm', "ctx", 1) is None
+    assert len(cache) == 0
+
+
+def read_events(response):
+    events = []
+    for line in response.get_data(as_text=True).split("\n\n"):
+        if line.startswith("data: ") and line != "data: [DONE]":
+            events.append(json.loads(line[len("data: "):]))
+    return events
+
+
+@pytest.mark.mock_ark(stream_tokens=5)
+def test_chat_replays_cached_answer(make_store, documents, mock_ark, app_client):
+    """测试 /api/chat 对重复的问题回放已有答案，事件格式相同，不再请求模型"""
+    print("\n3. 测试聊天接口回放答案...")
+    (documents / "doc.txt").write_text("语义缓存测试文档。" * 20, encoding='utf-8')
+    store = make_store()
+    store.load_documents(str(documents))
+
+    client = app_client(store, answer_cache=SemanticAnswerCache(enabled=True))
+    body = {'messages': [{'role': 'user', 'content': "文档讲了什么？"}], 'model': 'mock'}
+
+    response = client.post('/api/chat', json=body)
+    # 第一个事件在检索之前发出，上下文 token 数以 SSE 注释行发出
+    assert response.get_data().startswith(ANALYZING_EVENT)
+    frames = response.get_data(as_text=True).split("\n\n")
+    assert any(frame.startswith(": context_tokens ") for frame in frames)
+    first = read_events(response)
+    assert mock_ark.stats['chat_requests'] == 1
+    second = read_events(client.post('/api/chat', json=body))
+    assert mock_ark.stats['chat_requests'] == 1
+
+    def answer(events):
+        return ''.join(e['choices'][0]['delta'].get('content', '') for e in events)
+
+    assert answer(second) == answer(first) == ''.join(f"词{i} " for i in range(5))
+    stats = client.get('/api/cache/stats').get_json()['semantic_answer']
+    assert stats['hits'] == 1 and stats['size'] == 1
+
+    # 多轮对话不使用缓存
+    body['messages'] += [{'role': 'assistant', 'content': "讲了缓存。"}, {'role': 'user', 'content': "文档讲了什么？"}]
+    read_events(client.post('/api/chat', json=body))
+    assert mock_ark.stats['chat_requests'] == 2
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main([__file__, '-s', '-q'])
+    print("\n=== 语义答案缓存测试完成 ===")
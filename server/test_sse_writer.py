@@ -0,0 +1,134 @@
+import asyncio
+import json
+import threading
+import time
+
+from chat_service import sse_event
+from sse_writer import SSEWriter, apaced, encode_content, encode_reasoning, paced
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def delta_of(frame):
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    return json.loads(frame[len(b"data: "):])['choices'][0]['delta']
+
+
+def deltas_of(data):
+    return [delta_of(frame + b"\n\n") for frame in data.split(b"\n\n") if frame]
+
+
+def test_templates_match_json_dumps():
+    """测试预先准备的帧模板与 json.dumps 构造的事件逐字节相同"""
+    print("\n1. 测试帧模板...")
+    for text in ["你好", 'a "quoted" \\ path\n', "emoji 😀", "\t\x00"]:
+        assert encode_content(text) == sse_event({'choices': [{'delta': {'content': text}}]})
+        assert encode_reasoning(text) == sse_event({'choices': [{'delta': {'reasoning_content': text}}]})
+
+
+def test_batching_window_and_flush():
+    """测试合并窗口：每种片段的第一个立即发出，之后同类片段在窗口内合并，类型切换、超过字数或结束时发出"""
+    print("\n2. 测试合并小片段...")
+    writer = SSEWriter(flush_interval=0)
+    assert delta_of(writer.write("a", True)) == {'content': "a"}
+    assert writer.flush() is None and writer.remaining() is None
+
+    clock = FakeClock()
+    writer = SSEWriter(flush_interval=0.02, max_chars=8, clock=clock)
+    assert delta_of(writer.write("想", False)) == {'reasoning_content': "想"}
+    clock.now = 0.01
+    assert writer.write("一想", False) is None
+    assert abs(writer.remaining() - 0.02) < 1e-9
+    # 类型切换时先发出之前的推理内容，第一个回答片段立即发出
+    assert deltas_of(writer.write("答", True)) == [{'reasoning_content': "一想"}, {'content': "答"}]
+    clock.now = 0.04
+    assert writer.write("案", True) is None
+    clock.now = 0.05
+    assert delta_of(writer.write("12345678", True)) == {'content': "案12345678"}  # 超过字数立即发出
+    assert writer.write("尾", True) is None
+    clock.now = 0.1
+    assert writer.remaining() == 0.0
+    assert delta_of(writer.flush()) == {'content': "尾"}
+    assert writer.flush() is None
+    assert writer.deltas == 6 and writer.frames == 5
+
+
+def stalled_upstream(events):
+    """前两个片段立即到达，之后上游停顿"""
+    yield "甲"
+    yield "乙"
+    events.wait(5)
+    yield "丙"
+
+
+class Recorder:
+    """记录每个发出的回答片段和发出时间"""
+
+    def __init__(self):
+        self.writer = SSEWriter(flush_interval=0.05)
+        self.started = time.monotonic()
+        self.frames = []
+        self.timestamps = []
+
+    def handle(self, chunk):
+        out = self.writer.flush() if chunk is None else self.writer.write(chunk, True)
+        if out:
+            self.frames.extend(d['content'] for d in deltas_of(out))
+            self.timestamps.append(time.monotonic() - self.started)
+
+
+def test_stalled_upstream_flushes_on_timer():
+    """测试上游停顿时，缓存的片段在合并窗口结束时发出，不等下一个片段；同步和异步两种迭代方式"""
+    print("\n3. 测试上游停顿时按时发出...")
+    resume = threading.Event()
+    threading.Timer(0.5, resume.set).start()
+    recorder = Recorder()
+    for chunk in paced(stalled_upstream(resume), recorder.writer):
+        recorder.handle(chunk)
+    recorder.handle(None)
+    assert recorder.frames == ["甲", "乙", "丙"]
+    # "乙" 在合并窗口结束后发出，而不是等到上游恢复
+    assert recorder.timestamps[1] < 0.3 and recorder.timestamps[2] >= 0.45
+
+    async def stalled():
+        yield "甲"
+        yield "乙"
+        await asyncio.sleep(0.5)
+        yield "丙"
+
+    async def run():
+        recorder = Recorder()
+        async for chunk in apaced(stalled(), recorder.writer):
+            recorder.handle(chunk)
+        recorder.handle(None)
+        return recorder
+
+    recorder = asyncio.run(run())
+    assert recorder.frames == ["甲", "乙", "丙"]
+    assert recorder.timestamps[1] < 0.3 and recorder.timestamps[2] >= 0.45
+
+    # 上游出错时异常传给调用方
+    def broken():
+        yield "甲"
+        raise ValueError("上游断开")
+
+    writer = SSEWriter(flush_interval=0.05)
+    try:
+        list(paced(broken(), writer))
+    except ValueError as e:
+        assert str(e) == "上游断开"
+    else:
+        raise AssertionError("没有抛出上游的异常")
+
+
+if __name__ == '__main__':
+    test_templates_match_json_dumps()
+    test_batching_window_and_flush()
+    test_stalled_upstream_flushes_on_timer()
+    print("\n=== SSE 编码测试完成 ===")
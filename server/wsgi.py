@@ -0,0 +1,9 @@
+"""生产环境 WSGI 入口
+
+gunicorn -c gunicorn.conf.py
+
+向量索引在导入 app 时加载。gunicorn 以 preload_app 方式先在主进程导入应用，
+再 fork 出各个 worker，索引所在的内存页由所有 worker 共享（写时复制），
+N 个 worker 不会各自持有一份向量。
+"""
+from app import app, doc_store  # noqa: F401
@@ -0,0 +1,18 @@
+#!/bin/bash
+
+cd server
+
+# 检查并激活虚拟环境
+if [ ! -d "venv" ]; then
+    echo "Python virtual environment not found. Please run start-python-server.sh first."
+    exit 1
+fi
+
+source venv/bin/activate
+
+pip install gunicorn
+
+# 使用 gunicorn 多进程启动，索引在主进程预加载后由各 worker 共享
+# SERVER_MODE=asgi 时使用异步服务（uvicorn worker），WEB_CONCURRENCY 控制 worker 数
+echo "Starting production server (${SERVER_MODE:-wsgi})..."
+exec gunicorn -c gunicorn.conf.py
@@ -13,7 +13,7 @@ source venv/bin/activate
 
 # 安装依赖
 echo "Installing Python dependencies..."
-pip install "flask[async]" flask-cors langchain-community langchain openai faiss-cpu python-dotenv "httpx[socks]" tiktoken
+pip install "flask[async]" flask-cors langchain-community langchain openai faiss-cpu python-dotenv "httpx[socks,http2]" tiktoken starlette uvicorn a2wsgi
 pip install pypdf unstructured python-docx markdown
 brew install libmagic  # macOS
 # 检查 documents 目录是否存在